@@ -0,0 +1,82 @@
+"""
+Measure recall and latency of the IVF index against exact cosine search.
+
+    python -m benchmarks.ann_index --properties 1000000 --queries 200 --probes 1 4 8 16
+
+Builds an IVFIndex over a synthetic catalog of normalized property
+features and, for each n_probe (with and without int8 quantization),
+reports the mean query latency and recall@N: the share of the exact top-N
+rows that the index returns.
+"""
+
+import argparse
+import time
+
+import numpy as np
+from sklearn.preprocessing import MinMaxScaler
+
+from recommender.ann import IVFIndex
+from recommender.ranking import top_n_indices
+from recommender.scoring import cosine_scores, unit_rows
+
+from .scoring_kernel import synthetic_features, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--properties', type=int, default=200_000)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--top-n', type=int, default=5)
+    parser.add_argument('--lists', type=int, default=None)
+    parser.add_argument('--probes', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--rerank', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    scaler = MinMaxScaler()
+    features = unit_rows(scaler.fit_transform(synthetic_features(args.properties, rng)))
+    queries = unit_rows(
+        scaler.transform(synthetic_features(args.queries, rng)).clip(0, 1)
+    )
+
+    exact_seconds, expected = timed(
+        lambda query: top_n_indices(cosine_scores(features, query), args.top_n),
+        queries,
+    )
+    print(f"properties: {args.properties}, queries: {args.queries}")
+    print(f"exact: {exact_seconds * 1000:.2f} ms/query")
+
+    for quantize in (False, True):
+        start = time.perf_counter()
+        index = IVFIndex(
+            features, n_lists=args.lists, quantize=quantize, rerank=args.rerank
+        )
+        build_seconds = time.perf_counter() - start
+        print(
+            f"\nIVF lists={index.n_lists} quantize={quantize}: "
+            f"built in {build_seconds:.2f}s"
+        )
+        for n_probe in args.probes:
+            seconds, found = timed(
+                lambda query: index.search(
+                    features, query, args.top_n, n_probe=n_probe
+                ),
+                queries,
+            )
+            # A None result falls back to exact search, which finds everything
+            hits = sum(
+                exact.size if result is None else np.intersect1d(result[0], exact).size
+                for result, exact in zip(found, expected)
+            )
+            fallbacks = sum(result is None for result in found)
+            recall = hits / (args.top_n * args.queries)
+            print(
+                f"  n_probe={n_probe:<3} {seconds * 1000:7.2f} ms/query  "
+                f"recall@{args.top_n}={recall:.3f}  "
+                f"speed-up={exact_seconds / seconds:.1f}x  fallbacks={fallbacks}"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+"""
+Benchmark every recommender engine and endpoint on seeded synthetic data.
+
+    python -m benchmarks.recommenders --scale 100k --output results.json
+
+Creates a throwaway test database, fills it with benchmarks.synthetic_data
+at the chosen scale and, for each engine, reports the build time, the
+peak and retained memory of a build, and the latency percentiles and
+throughput of single requests. The HTTP endpoints are then measured end
+to end through the Django test client. Results are written as JSON so
+runs of different versions can be compared.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+django.setup()
+
+import numpy as np
+import scipy
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from real_state.models import RealState, UserInteraction
+from recommender.hybrid import HYBRID_ENGINES
+from recommender.registry import ENGINE_SLOTS
+
+from .synthetic_data import SCALES, populate
+
+# How each engine answers one request
+ENGINE_REQUESTS = {
+    'real_state': lambda engine, query, n: engine.get_recommendations(query, n),
+    'content_filtering': lambda engine, user_id, n: engine.get_similar_property_ids(
+        user_id, n
+    ),
+    'user_based_cf': lambda engine, user_id, n: engine.get_recommended_ids(user_id, n),
+    'item_based_cf': lambda engine, user_id, n: engine.get_recommended_ids(user_id, n),
+    'matrix_factorization': lambda engine, user_id, n: engine.get_recommended_ids(
+        user_id, n
+    ),
+}
+
+# URL names of the endpoints and the engines behind them
+VIEWS = {
+    'cosine-similarity-recommendations/': ('real_state',),
+    'content-based-recommendations': ('content_filtering',),
+    'user-based-cf-recommendations': ('user_based_cf',),
+    'item-based-cf-recommendations': ('item_based_cf',),
+    'matrix-factorization-recommendations': ('matrix_factorization',),
+    'hybrid-recommendations': HYBRID_ENGINES,
+    'async-cosine-similarity-recommendations': ('real_state',),
+    'async-content-based-recommendations': ('content_filtering',),
+    'async-user-based-cf-recommendations': ('user_based_cf',),
+    'async-item-based-cf-recommendations': ('item_based_cf',),
+    'async-matrix-factorization-recommendations': ('matrix_factorization',),
+    'async-hybrid-recommendations': HYBRID_ENGINES,
+}
+
+
+def preference_queries(rng, n):
+    """
+    Random request parameters of the preference endpoint, as the engine's
+    preference dicts and as query strings.
+    """
+    queries = []
+    for _ in range(n):
+        params = {
+            'budget': int(rng.uniform(200_000, 5_000_000)),
+            'bedrooms': int(rng.integers(1, 5)),
+            'bathrooms': int(rng.integers(1, 3)),
+            'sqft': int(rng.uniform(500, 4000)),
+            'year_built': int(rng.integers(1950, 2015)),
+            'parking_spaces': int(rng.integers(0, 3)),
+        }
+        preferences = {
+            'budget': float(params['budget']),
+            'min_bedrooms': params['bedrooms'],
+            'min_bathrooms': params['bathrooms'],
+            'preferred_sqft': float(params['sqft']),
+            'min_year_built': params['year_built'],
+            'parking_spaces': params['parking_spaces'],
+        }
+        queries.append((preferences, params))
+    return queries
+
+
+def latency_stats(seconds, wall_seconds):
+    milliseconds = np.asarray(seconds) * 1000
+    return {
+        'requests': len(seconds),
+        'mean_ms': float(milliseconds.mean()),
+        'p50_ms': float(np.percentile(milliseconds, 50)),
+        'p90_ms': float(np.percentile(milliseconds, 90)),
+        'p99_ms': float(np.percentile(milliseconds, 99)),
+        'max_ms': float(milliseconds.max()),
+        'throughput_rps': len(seconds) / wall_seconds,
+    }
+
+
+def measure(function, queries):
+    """
+    Call function(query) for each query in turn; latency_stats of the calls.
+    """
+    seconds = []
+    start = time.perf_counter()
+    for query in queries:
+        request_start = time.perf_counter()
+        function(query)
+        seconds.append(time.perf_counter() - request_start)
+    return latency_stats(seconds, time.perf_counter() - start)
+
+
+def build(engine_class, trace_memory):
+    """
+    (engine, stats) of a build from the database. Memory is traced in a
+    second build, so tracing does not slow down the timed one.
+    """
+    gc.collect()
+    start = time.perf_counter()
+    engine = engine_class()
+    stats = {'build_seconds': time.perf_counter() - start}
+
+    if trace_memory:
+        gc.collect()
+        tracemalloc.start()
+        traced = engine_class()
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del traced
+        stats.update(build_peak_bytes=peak, retained_bytes=retained)
+    return engine, stats
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args, log):
+    rng = np.random.default_rng(args.seed)
+    sizes = {**SCALES[args.scale]}
+    for key in sizes:
+        if getattr(args, key) is not None:
+            sizes[key] = getattr(args, key)
+
+    start = time.perf_counter()
+    if args.keepdb and RealState.objects.exists():
+        log("Reusing the kept benchmark database")
+        counts = None
+    else:
+        counts = populate(**sizes, seed=args.seed, log=log)
+    generate_seconds = time.perf_counter() - start
+
+    user_ids = np.array(
+        UserInteraction.objects.order_by('user_id')
+        .values_list('user_id', flat=True)
+        .distinct()
+    )
+    # Separate users per engine and endpoint keep result caches cold
+    user_ids = rng.permutation(user_ids)
+    queries = preference_queries(rng, max(args.requests, args.view_requests))
+    used = 0
+
+    def users(count):
+        nonlocal used
+        if used + count > user_ids.size:
+            log("Not enough users for cold requests; repeating some")
+        # Cycles through the permutation once every user has been taken
+        taken = user_ids[np.arange(used, used + count) % user_ids.size]
+        used += count
+        return [int(user_id) for user_id in taken]
+
+    engines = {}
+    results = {}
+    for name in args.engines:
+        slot = ENGINE_SLOTS[name]
+        log(f"Building {name}")
+        engine, stats = build(slot.engine_class, not args.no_memory)
+
+        request = ENGINE_REQUESTS[name]
+        if name == 'real_state':
+            engine_queries = [preferences for preferences, _ in queries]
+        else:
+            engine_queries = users(args.requests)
+        stats['latency'] = measure(
+            lambda query: request(engine, query, args.top_n),
+            engine_queries[: args.requests],
+        )
+        results[name] = stats
+        engines[name] = engine
+
+    # Serve the endpoints from the engines built above
+    for name, engine in engines.items():
+        ENGINE_SLOTS[name].engine = engine
+        ENGINE_SLOTS[name].version = None
+
+    client = Client()
+    views = {}
+    for url_name, required in VIEWS.items():
+        if not all(name in engines for name in required):
+            continue
+        log(f"Requesting {url_name}")
+        url = reverse(url_name)
+        failures = 0
+
+        if required == ('real_state',):
+            view_queries = [('', params) for _, params in queries[: args.view_requests]]
+        else:
+            view_queries = [
+                (f"Token {Token.objects.get_or_create(user_id=user_id)[0].key}", {})
+                for user_id in users(args.view_requests)
+            ]
+
+        def request(query):
+            nonlocal failures
+            authorization, params = query
+            response = client.get(url, params, HTTP_AUTHORIZATION=authorization)
+            failures += response.status_code != 200
+
+        views[url_name] = {**measure(request, view_queries), 'failures': failures}
+
+    return {
+        'meta': {
+            'scale': args.scale,
+            'seed': args.seed,
+            'sizes': sizes,
+            'rows': counts,
+            'top_n': args.top_n,
+            'git_revision': git_revision(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'django': django.__version__,
+            'generate_seconds': generate_seconds,
+            # Linux reports kilobytes
+            'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        },
+        'engines': results,
+        'views': views,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', choices=SCALES, default='10k')
+    parser.add_argument('--properties', type=int, default=None)
+    parser.add_argument('--users', type=int, default=None)
+    parser.add_argument('--interactions', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--engines', nargs='+', choices=ENGINE_SLOTS, default=list(ENGINE_SLOTS)
+    )
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--view-requests', type=int, default=100)
+    parser.add_argument('--top-n', type=int, default=5)
+    parser.add_argument(
+        '--no-memory', action='store_true', help="Skip the traced memory builds."
+    )
+    parser.add_argument(
+        '--keepdb',
+        action='store_true',
+        help="Keep the test database, and reuse it if it already has data.",
+    )
+    parser.add_argument('--output', help="JSON file to write (default: stdout).")
+    args = parser.parse_args()
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, keepdb=args.keepdb, serialize=False
+    )
+    try:
+        # No published snapshots: every engine is built from this database
+        with tempfile.TemporaryDirectory() as model_dir, override_settings(
+            RECOMMENDER_MODEL_DIR=model_dir
+        ):
+            results = run(args, log)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=args.keepdb)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Compare the preference-vector scoring paths of RealEstateRecommender.
+
+    python -m benchmarks.scoring_kernel --properties 1000000 --queries 200
+
+The baseline is MinMaxScaler.transform + sklearn cosine_similarity over the
+float64 feature matrix; the kernel is one float32 matrix-vector product
+against prenormalized rows. Both rank the same synthetic catalog and the
+script reports how many top-N lists agree.
+"""
+
+import argparse
+import time
+
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import MinMaxScaler
+
+from recommender.ranking import top_n_indices
+from recommender.scoring import cosine_scores, unit_rows
+
+
+def synthetic_features(n, rng):
+    return np.column_stack(
+        [
+            rng.uniform(50_000, 2_000_000, n),  # price
+            rng.integers(1, 7, n),  # bedrooms
+            rng.integers(1, 5, n),  # bathrooms
+            rng.uniform(400, 6000, n),  # sqft
+            rng.integers(1950, 2025, n),  # year_built
+            rng.integers(0, 4, n),  # parking_spaces
+        ]
+    ).astype(np.float64)
+
+
+def timed(function, queries):
+    start = time.perf_counter()
+    results = [function(query) for query in queries]
+    return (time.perf_counter() - start) / len(queries), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--properties', type=int, default=200_000)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--top-n', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    raw = synthetic_features(args.properties, rng)
+    queries = synthetic_features(args.queries, rng)
+
+    scaler = MinMaxScaler()
+    features = scaler.fit_transform(raw)
+    unit_features = unit_rows(features)
+
+    def baseline(query):
+        scores = cosine_similarity(features, scaler.transform(query[None, :]))
+        return top_n_indices(scores.ravel(), args.top_n)
+
+    def kernel(query):
+        unit_query = unit_rows(query * scaler.scale_ + scaler.min_)[0]
+        return top_n_indices(cosine_scores(unit_features, unit_query), args.top_n)
+
+    baseline_seconds, expected = timed(baseline, queries)
+    kernel_seconds, actual = timed(kernel, queries)
+    agreeing = sum(set(a) == set(b) for a, b in zip(expected, actual))
+
+    print(f"properties: {args.properties}, queries: {args.queries}")
+    print(f"sklearn cosine_similarity: {baseline_seconds * 1000:.2f} ms/query")
+    print(f"float32 unit-row kernel:   {kernel_seconds * 1000:.2f} ms/query")
+    print(f"speed-up: {baseline_seconds / kernel_seconds:.1f}x")
+    print(f"identical top-{args.top_n}: {agreeing}/{args.queries}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Seeded generator of Location, Feature, RealState and UserInteraction rows.
+
+The same seed and sizes always produce the same catalog and interaction
+log. Property popularity is skewed (a few properties collect most of the
+interactions) and prices follow square footage, so the engines see data
+shaped roughly like a real listing site rather than uniform noise.
+"""
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from real_state.models import Feature, Location, RealState, UserInteraction
+
+SCALES = {
+    '10k': {'properties': 10_000, 'users': 5_000, 'interactions': 250_000},
+    '100k': {'properties': 100_000, 'users': 50_000, 'interactions': 5_000_000},
+    '1m': {'properties': 1_000_000, 'users': 500_000, 'interactions': 50_000_000},
+}
+
+FEATURE_NAMES = [
+    'Balcony',
+    'Garden',
+    'Elevator',
+    'Fireplace',
+    'Air conditioning',
+    'Central heating',
+    'Gym',
+    'Doorman',
+    'Storage room',
+    'Sea view',
+    'Solar panels',
+    'Furnished',
+    'Pet friendly',
+    'Laundry room',
+    'Home office',
+    'Wheelchair access',
+]
+
+COUNTRIES = ['Egypt', 'France', 'Germany', 'Italy', 'Spain', 'Portugal', 'Greece']
+
+INTERACTION_TYPES = np.array(['view', 'like', 'save'])
+INTERACTION_SHARES = [0.7, 0.2, 0.1]
+
+
+def _batches(n, batch_size):
+    for start in range(0, n, batch_size):
+        yield start, min(start + batch_size, n)
+
+
+def _skewed(rng, n, size):
+    # Squaring uniform draws concentrates them on the low indices
+    return (n * rng.random(size) ** 2).astype(np.int64)
+
+
+def populate(properties, users, interactions, seed=0, batch_size=10000, log=None):
+    """
+    Insert a synthetic catalog of `properties` properties and about
+    `interactions` interactions from `users` users. Returns the row counts.
+    """
+    log = log or (lambda message: None)
+    rng = np.random.default_rng(seed)
+
+    with transaction.atomic():
+        n_locations = max(10, properties // 1000)
+        Location.objects.bulk_create(
+            (
+                Location(city=f'City {i}', country=COUNTRIES[i % len(COUNTRIES)])
+                for i in range(n_locations)
+            ),
+            ignore_conflicts=True,
+        )
+        Feature.objects.bulk_create(
+            (Feature(name=name) for name in FEATURE_NAMES), ignore_conflicts=True
+        )
+    location_ids = np.array(
+        Location.objects.order_by('id').values_list('id', flat=True)
+    )
+    feature_ids = np.array(Feature.objects.order_by('id').values_list('id', flat=True))
+    log(f"{n_locations} locations, {feature_ids.size} features")
+
+    first_property = RealState.objects.order_by('-id').values_list('id', flat=True)
+    first_property = (first_property.first() or 0) + 1
+    for start, stop in _batches(properties, batch_size):
+        n = stop - start
+        sqft = rng.gamma(4.0, 400.0, n).clip(300, 12000).round()
+        bedrooms = np.clip(np.round(sqft / 500 + rng.normal(0, 0.8, n)), 1, 8)
+        price = (sqft * rng.lognormal(7.4, 0.35, n)).round(-3)
+        bathrooms = np.maximum(1, bedrooms - rng.integers(0, 3, n))
+        year_built = rng.integers(1950, 2025, n)
+        residential = rng.random(n) < 0.85
+        locations = location_ids[_skewed(rng, location_ids.size, n)]
+        parking_spaces = rng.integers(0, 4, n)
+        has_garage = rng.random(n) < 0.4
+        has_pool = rng.random(n) < 0.15
+        with transaction.atomic():
+            RealState.objects.bulk_create(
+                (
+                    RealState(
+                        price=int(price[i]),
+                        bedrooms=int(bedrooms[i]),
+                        bathrooms=int(bathrooms[i]),
+                        sqft=int(sqft[i]),
+                        year_built=int(year_built[i]),
+                        property_type=(
+                            'residential' if residential[i] else 'commercial'
+                        ),
+                        location_id=int(locations[i]),
+                        parking_spaces=int(parking_spaces[i]),
+                        has_garage=bool(has_garage[i]),
+                        has_pool=bool(has_pool[i]),
+                        description=f"Synthetic property {start + i}",
+                    )
+                    for i in range(n)
+                ),
+                batch_size=batch_size,
+            )
+            property_ids = np.array(
+                RealState.objects.filter(id__gte=first_property)
+                .order_by('id')
+                .values_list('id', flat=True)[start:stop]
+            )
+            # Each property gets each feature with probability 0.2
+            has_feature = rng.random((n, feature_ids.size)) < 0.2
+            rows, columns = np.nonzero(has_feature)
+            RealState.features.through.objects.bulk_create(
+                (
+                    RealState.features.through(
+                        realstate_id=int(property_ids[row]),
+                        feature_id=int(feature_ids[column]),
+                    )
+                    for row, column in zip(rows, columns)
+                ),
+                batch_size=batch_size,
+            )
+    property_ids = np.array(
+        RealState.objects.filter(id__gte=first_property)
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+    log(f"{property_ids.size} properties")
+
+    first_user = (
+        User.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    ) + 1
+    for start, stop in _batches(users, batch_size):
+        # Unusable password; these users only authenticate with tokens
+        User.objects.bulk_create(
+            (
+                User(username=f'benchmark-{seed}-{i}', password='!')
+                for i in range(start, stop)
+            ),
+            batch_size=batch_size,
+        )
+    user_ids = np.array(
+        User.objects.filter(id__gte=first_user)
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+    log(f"{user_ids.size} users")
+
+    # Interactions per user are geometric around the requested mean; pairs
+    # are deduplicated per user to respect unique_together
+    mean = max(interactions / max(users, 1), 1.0)
+    written = 0
+    for start, stop in _batches(user_ids.size, max(1, batch_size // int(mean))):
+        counts = np.minimum(rng.geometric(1 / mean, stop - start), property_ids.size)
+        users_of = np.repeat(np.arange(start, stop), counts)
+        keys = np.unique(
+            users_of * property_ids.size
+            + _skewed(rng, property_ids.size, users_of.size)
+        )
+        kinds = rng.choice(INTERACTION_TYPES, keys.size, p=INTERACTION_SHARES)
+        with transaction.atomic():
+            UserInteraction.objects.bulk_create(
+                (
+                    UserInteraction(
+                        user_id=int(user_ids[key // property_ids.size]),
+                        property_id=int(property_ids[key % property_ids.size]),
+                        interaction_type=kind,
+                    )
+                    for key, kind in zip(keys, kinds)
+                ),
+                batch_size=batch_size,
+            )
+        written += keys.size
+    log(f"{written} interactions")
+
+    return {
+        'locations': n_locations,
+        'features': int(feature_ids.size),
+        'properties': int(property_ids.size),
+        'users': int(user_ids.size),
+        'interactions': written,
+    }
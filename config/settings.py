@@ -32,6 +32,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'recommender.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -119,3 +120,90 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Recommender result caches: MAXSIZE entries per worker, TTL in seconds
+
+RECOMMENDER_CACHES = {
+    'content_filtering': {
+        'MAXSIZE': 1024,
+        'TTL': 300,
+    },
+    'property_rows': {
+        'MAXSIZE': 10000,
+        'TTL': 600,
+    },
+    'property_records': {
+        'MAXSIZE': 10000,
+        'TTL': 600,
+    },
+    'ranked_lists': {
+        'MAXSIZE': 4096,
+        'TTL': 600,
+    },
+    # Popularity ranking served while engines are built; TTL only
+    'popular_properties': {
+        'TTL': 300,
+    },
+}
+
+# Django cache holding the per-user interaction versions that invalidate
+# the caches above when a user's interactions change. Point it at a backend
+# shared by all workers (Redis, Memcached, database); with the default
+# per-process cache other workers only notice once their entries' TTL ends.
+RECOMMENDER_VERSION_CACHE = 'default'
+
+# Paginated recommendations: ids ranked and cached per user or preference
+# vector on the first page, and page size limits
+RECOMMENDER_PAGINATION = {
+    'RANKED_LIST_SIZE': 500,
+    'DEFAULT_PAGE_SIZE': 5,
+    'MAX_PAGE_SIZE': 100,
+}
+
+# Directory of the memory-mapped model snapshots loaded by every worker
+RECOMMENDER_MODEL_DIR = BASE_DIR / 'recommender_models'
+
+# Seconds between checks of a worker for a newly published model version
+RECOMMENDER_RELOAD_INTERVAL = 5
+
+# Optional approximate nearest-neighbour search, per engine ('real_state',
+# 'content_filtering'); see recommender.ann.ANN_DEFAULTS for the options
+
+RECOMMENDER_ANN = {
+    'real_state': {
+        'ENABLED': False,
+        'N_PROBE': 8,
+        'QUANTIZE': False,
+    },
+    'content_filtering': {
+        'ENABLED': False,
+        'N_PROBE': 8,
+    },
+}
+
+# Threads per worker running engine scoring for the async views
+RECOMMENDER_SCORING_THREADS = 4
+
+# Build every engine in a background thread when a serving process starts;
+# until an engine is ready its endpoints return popular properties
+RECOMMENDER_WARM_UP = False
+
+# Clients allowed to scrape the Prometheus metrics of a worker
+RECOMMENDER_METRICS_IPS = ['127.0.0.1', '::1']
+
+# Component weights of the hybrid endpoint and how many content-based
+# candidates it adds; see recommender.hybrid.HYBRID_DEFAULTS
+RECOMMENDER_HYBRID = {
+    'WEIGHTS': {'content': 0.2, 'user_cf': 0.4, 'item_cf': 0.4},
+    'CONTENT_CANDIDATES': 100,
+}
+
+# Interactions the collaborative filtering engines learn from: only those
+# of the last WINDOW_DAYS days, and (for matrix factorization only) weights
+# halved every HALF_LIFE_DAYS days of age; None disables either. Changes
+# apply to the next build.
+RECOMMENDER_INTERACTION_WINDOW = {
+    'WINDOW_DAYS': None,
+    'HALF_LIFE_DAYS': None,
+}
@@ -0,0 +1,186 @@
+import numpy as np
+from django.conf import settings
+from scipy.sparse import csr_matrix, issparse
+
+from .ranking import top_n_indices
+
+ANN_DEFAULTS = {
+    'ENABLED': False,
+    # Below this many rows exact search is cheap enough
+    'MIN_ROWS': 50000,
+    # None picks sqrt(rows)
+    'N_LISTS': None,
+    'N_PROBE': 8,
+    'QUANTIZE': False,
+    'RERANK': 16,
+}
+
+
+def ann_options(name):
+    """
+    ANN_DEFAULTS overridden by settings.RECOMMENDER_ANN[name].
+    """
+    return {**ANN_DEFAULTS, **getattr(settings, 'RECOMMENDER_ANN', {}).get(name, {})}
+
+
+def _dense(matrix):
+    return matrix.toarray() if issparse(matrix) else np.asarray(matrix)
+
+
+class IVFIndex:
+    """
+    Inverted-file index for cosine search over unit rows.
+
+    Rows are partitioned by spherical k-means into `n_lists` lists. A query
+    only scores the members of the `n_probe` lists whose centroids are
+    closest to it, so more probes trade speed for recall; n_probe=n_lists
+    is exact. With `quantize`, dense rows are also kept as int8 codes with
+    a per-row scale, candidates are scored on the codes and the best
+    `rerank` x n of them are rescored exactly.
+
+    The index covers the first `n_rows` rows of the matrix it was built
+    on. search() scores rows appended since then exactly, so the matrix
+    may keep growing between rebuilds.
+    """
+
+    def __init__(
+        self,
+        matrix,
+        n_lists=None,
+        n_probe=8,
+        quantize=False,
+        rerank=16,
+        iterations=10,
+        sample_size=100000,
+        block_size=65536,
+        seed=0,
+    ):
+        self.n_rows = matrix.shape[0]
+        self.n_lists = max(1, min(n_lists or int(np.sqrt(self.n_rows)), self.n_rows))
+        self.n_probe = n_probe
+        self.rerank = rerank
+        self.block_size = block_size
+        rng = np.random.default_rng(seed)
+
+        self.centroids = self._train(matrix, iterations, sample_size, rng)
+
+        # Assign every row to its closest centroid, in blocks
+        labels = np.empty(self.n_rows, dtype=np.int32)
+        for start in range(0, self.n_rows, block_size):
+            block = matrix[start : start + block_size]
+            labels[start : start + block_size] = np.argmax(
+                _dense(block @ self.centroids.T), axis=1
+            )
+
+        # Members of list k are order[offsets[k]:offsets[k + 1]]
+        self.order = np.argsort(labels, kind='stable').astype(np.int64)
+        self.offsets = np.searchsorted(labels[self.order], np.arange(self.n_lists + 1))
+
+        self.codes = self.scales = None
+        if quantize and not issparse(matrix):
+            peaks = np.abs(matrix).max(axis=1)
+            self.scales = np.where(peaks > 0, peaks / 127.0, 1.0).astype(np.float32)
+            self.codes = np.round(matrix / self.scales[:, None]).astype(np.int8)
+
+    @classmethod
+    def from_settings(cls, name, matrix):
+        """
+        An index configured by settings.RECOMMENDER_ANN[name], or None when
+        it is disabled or the matrix is too small to need one.
+        """
+        options = ann_options(name)
+        if not options['ENABLED'] or matrix.shape[0] < options['MIN_ROWS']:
+            return None
+        return cls(
+            matrix,
+            n_lists=options['N_LISTS'],
+            n_probe=options['N_PROBE'],
+            quantize=options['QUANTIZE'],
+            rerank=options['RERANK'],
+        )
+
+    def _train(self, matrix, iterations, sample_size, rng):
+        """
+        Spherical k-means on a sample of the rows.
+        """
+        sample_rows = np.sort(
+            rng.choice(self.n_rows, min(sample_size, self.n_rows), replace=False)
+        )
+        sample = matrix[sample_rows]
+        seeds = rng.choice(sample.shape[0], self.n_lists, replace=False)
+        centroids = _dense(sample[seeds]).astype(np.float32)
+
+        for _ in range(iterations):
+            labels = np.argmax(_dense(sample @ centroids.T), axis=1)
+            membership = csr_matrix(
+                (
+                    np.ones(labels.size, dtype=np.float32),
+                    (labels, np.arange(labels.size)),
+                ),
+                shape=(self.n_lists, labels.size),
+            )
+            sums = _dense(membership @ sample).astype(np.float32)
+            norms = np.linalg.norm(sums, axis=1)
+            # Empty lists are reseeded with a random sample row
+            empty = np.flatnonzero(norms == 0)
+            if empty.size:
+                sums[empty] = _dense(sample[rng.choice(sample.shape[0], empty.size)])
+                norms[empty] = np.linalg.norm(sums[empty], axis=1)
+            centroids = sums / np.where(norms > 0, norms, 1.0)[:, None]
+        return centroids
+
+    def candidates(self, query, n_probe=None):
+        """
+        Rows in the lists probed for `query`.
+        """
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        lists = top_n_indices(self.centroids @ query, n_probe)
+        return np.concatenate(
+            [self.order[self.offsets[k] : self.offsets[k + 1]] for k in lists]
+        )
+
+    def _exact(self, matrix, query, rows):
+        if rows.size == 0:
+            return np.empty(0, dtype=np.float32)
+        return np.asarray(matrix[rows] @ query).ravel()
+
+    def search(self, matrix, query, n, allowed=None, n_probe=None):
+        """
+        Approximate top-n rows of `matrix` for the unit `query`, as
+        (rows, scores) best first. `allowed` optionally masks the rows that
+        may be returned.
+
+        Returns None when the probed lists hold fewer than n allowed rows;
+        callers then fall back to exact search.
+        """
+        rows = self.candidates(query, n_probe)
+        # Rows appended after the build are always scored exactly
+        tail = np.arange(self.n_rows, matrix.shape[0])
+        if allowed is not None:
+            rows = rows[allowed[rows]]
+            tail = tail[allowed[tail]]
+        if rows.size + tail.size < n:
+            return None
+
+        if self.codes is not None:
+            approximate = (self.codes[rows] @ query) * self.scales[rows]
+            rows = rows[top_n_indices(approximate, self.rerank * n)]
+
+        rows = np.concatenate([rows, tail])
+        scores = self._exact(matrix, query, rows)
+        best = top_n_indices(scores, n)
+        return rows[best], scores[best]
+
+    def worthwhile(self, n_candidates, n_probe=None):
+        """
+        Whether probing is expected to score fewer rows than an exact scan
+        of `n_candidates` rows.
+        """
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        return n_candidates * self.n_lists > self.n_rows * n_probe
+
+    def stale(self, n_rows, rebuild_ratio=0.2):
+        """
+        Whether enough rows were appended since the build to rebuild.
+        """
+        return n_rows - self.n_rows > rebuild_ratio * max(self.n_rows, 1)
@@ -1,4 +1,21 @@
+import os
+import sys
+
 from django.apps import AppConfig
+from django.conf import settings
+
+
+def _serving():
+    """
+    Whether this process serves requests: not a management command other
+    than runserver, and not runserver's autoreloader parent process.
+    """
+    command = os.path.basename(sys.argv[0])
+    if command == 'manage.py' or command == 'django-admin':
+        if sys.argv[1:2] != ['runserver']:
+            return False
+        return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv
+    return True
 
 
 class RecommenderConfig(AppConfig):
@@ -7,3 +24,8 @@ class RecommenderConfig(AppConfig):
 
     def ready(self):
         import recommender.signals
+
+        if getattr(settings, 'RECOMMENDER_WARM_UP', False) and _serving():
+            from recommender import registry
+
+            registry.warm_up()
@@ -0,0 +1,204 @@
+"""
+Async variants of the recommendation endpoints for the ASGI entry point.
+
+Engine scoring is CPU-bound (NumPy releases the GIL while it works), so it
+runs in a bounded thread pool instead of on the event loop; hydration and
+table lookups use Django's async ORM. A slow request therefore only holds
+one scoring thread while the worker keeps serving other requests.
+"""
+
+import asyncio
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from .metrics import record_error
+from .pagination import InvalidPage, paginated
+from .precomputed import PRECOMPUTED_ENGINES, aprecomputed_ids
+from .serializers import aserialize_properties
+from .views import (
+    RANKINGS,
+    cosine_page,
+    cosine_recommendations,
+    parse_preferences,
+    user_page,
+)
+
+logger = logging.getLogger(__name__)
+
+# Threads scoring requests; waiting requests queue behind them
+scoring_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'RECOMMENDER_SCORING_THREADS', 4),
+    thread_name_prefix='recommender-scoring',
+)
+
+
+def _score(function, *args):
+    # Executor threads are not request threads, so drop their connection
+    # the way Django does at the end of a request
+    close_old_connections()
+    try:
+        return function(*args)
+    finally:
+        close_old_connections()
+
+
+async def run_scoring(function, *args):
+    """
+    Run function(*args) in the scoring executor.
+    """
+    loop = asyncio.get_running_loop()
+    # Run in a copy of the request's context so the engine's stages are
+    # reported to the request's metrics
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        scoring_executor, context.run, _score, function, *args
+    )
+
+
+def _authenticators():
+    # The authentication classes of the DRF views, so both kinds of
+    # endpoint accept the same credentials
+    return [
+        authentication()
+        for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    ]
+
+
+async def authenticated_user(request):
+    """
+    The request's user as the DRF views authenticate it, or None for an
+    anonymous request. Raises AuthenticationFailed for bad credentials.
+    """
+    drf_request = Request(request, authenticators=_authenticators())
+    user = await sync_to_async(lambda: drf_request.user)()
+    return user if user.is_authenticated else None
+
+
+def unauthorized_response(request, detail):
+    """
+    401 with the challenge of the first authentication class, as DRF
+    answers.
+    """
+    response = json_response(
+        {"detail": detail}, status_code=status.HTTP_401_UNAUTHORIZED
+    )
+    authenticators = _authenticators()
+    if authenticators:
+        response['WWW-Authenticate'] = authenticators[0].authenticate_header(request)
+    return response
+
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    return JsonResponse(data, status=status_code, encoder=JSONEncoder, safe=False)
+
+
+def invalid_page_response(error):
+    return json_response({"error": str(error)}, status_code=status.HTTP_400_BAD_REQUEST)
+
+
+def page_response(recommendations, next_cursor):
+    return json_response(
+        {'recommendations': recommendations, 'next_cursor': next_cursor}
+    )
+
+
+@require_GET
+async def cosine_similarity_recommendations(request):
+    try:
+        user_preferences = parse_preferences(request.GET)
+        if paginated(request.GET):
+            try:
+                return page_response(
+                    *await run_scoring(cosine_page, user_preferences, request.GET)
+                )
+            except InvalidPage as error:
+                return invalid_page_response(error)
+        num_recommendations = int(request.GET.get("num_recommendations", 5))
+
+        return json_response(
+            await run_scoring(
+                cosine_recommendations, user_preferences, num_recommendations
+            )
+        )
+    except Exception:
+        logger.exception("Computing cosine recommendations failed")
+        record_error(request)
+        return json_response(None, status_code=status.HTTP_409_CONFLICT)
+
+
+async def _user_recommendations(request, ranking):
+    """
+    Shared body of the per-user endpoints: the requested page of the
+    cached ranking, or precomputed rows first (for rankings that have
+    them), then the ranking's function in the scoring executor. Rows are
+    hydrated through the async ORM.
+    """
+    try:
+        user = await authenticated_user(request)
+    except AuthenticationFailed as error:
+        return unauthorized_response(request, error.detail)
+    if user is None:
+        return unauthorized_response(request, NotAuthenticated.default_detail)
+    try:
+        if paginated(request.GET):
+            try:
+                property_ids, next_cursor = await run_scoring(
+                    user_page, user.id, ranking, request.GET
+                )
+            except InvalidPage as error:
+                return invalid_page_response(error)
+            # Only the rows of this page are hydrated
+            return page_response(await aserialize_properties(property_ids), next_cursor)
+
+        property_ids = None
+        if ranking in PRECOMPUTED_ENGINES:
+            property_ids = await aprecomputed_ids(user.id, ranking, 5)
+        if property_ids is None:
+            _, recommend = RANKINGS[ranking]
+            property_ids = await run_scoring(recommend, user.id)
+
+        # Serialize the recommended properties in rank order
+        recommendations = await aserialize_properties(property_ids)
+
+        return json_response({'recommendations': recommendations})
+    except Exception:
+        logger.exception("Computing %s recommendations failed", ranking)
+        record_error(request)
+        return json_response(None, status_code=status.HTTP_409_CONFLICT)
+
+
+@require_GET
+async def content_based_recommendations(request):
+    return await _user_recommendations(request, 'content')
+
+
+@require_GET
+async def user_based_recommend_properties_cf(request):
+    return await _user_recommendations(request, 'user_cf')
+
+
+@require_GET
+async def item_based_recommend_properties_cf(request):
+    return await _user_recommendations(request, 'item_cf')
+
+
+@require_GET
+async def matrix_factorization_recommendations(request):
+    return await _user_recommendations(request, 'mf')
+
+
+@require_GET
+async def hybrid_recommendations(request):
+    return await _user_recommendations(request, 'hybrid')
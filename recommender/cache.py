@@ -0,0 +1,238 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class InteractionVersions:
+    """
+    Per-user counters bumped whenever a user's interactions change.
+
+    Cached results remember the version they were computed under and are
+    ignored once the user's version moves on. The counters live in the
+    Django cache named by settings.RECOMMENDER_VERSION_CACHE, so with a
+    backend shared by all workers (Redis, Memcached, database) a change
+    invalidates the results of every worker at once. With a per-process
+    backend such as the default LocMemCache only the worker that handled
+    the change sees it, and the TTL of the result caches bounds how long
+    the others serve stale results; so does the eviction of a counter.
+    Precomputed rows, which have no TTL, are checked against the
+    InteractionVersion table instead.
+    """
+
+    def __init__(self, alias=None):
+        self.alias = alias
+
+    @property
+    def _cache(self):
+        return caches[
+            self.alias or getattr(settings, 'RECOMMENDER_VERSION_CACHE', 'default')
+        ]
+
+    def _key(self, user_id):
+        return f'recommender:interactions:{user_id}'
+
+    def get(self, user_id):
+        if user_id is None:
+            return 0
+        return self._cache.get(self._key(user_id), 0)
+
+    async def aget(self, user_id):
+        if user_id is None:
+            return 0
+        return await self._cache.aget(self._key(user_id), 0)
+
+    def get_many(self, user_ids):
+        """
+        Versions of `user_ids`, in order.
+        """
+        found = self._cache.get_many([self._key(user_id) for user_id in user_ids])
+        return [found.get(self._key(user_id), 0) for user_id in user_ids]
+
+    def bump(self, user_id):
+        key = self._key(user_id)
+        try:
+            self._cache.incr(key)
+        except ValueError:
+            # First change of the user; another worker may add it first
+            if not self._cache.add(key, 1, timeout=None):
+                self._cache.incr(key)
+
+
+interaction_versions = InteractionVersions()
+
+
+class RecommendationCache:
+    """
+    Thread-safe LRU cache of per-user results with a TTL.
+
+    Keys start with the user id; each entry stores the user's interaction
+    version at compute time and counts as a miss once that version is
+    outdated. Concurrent misses for the same key are single-flighted: one
+    thread computes while the others wait for its result.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, versions=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.versions = versions or interaction_versions
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_settings(cls, name):
+        """
+        Build a cache configured by settings.RECOMMENDER_CACHES[name], a
+        dict with optional MAXSIZE and TTL (seconds) keys.
+        """
+        options = getattr(settings, 'RECOMMENDER_CACHES', {}).get(name, {})
+        return cls(maxsize=options.get('MAXSIZE', 1024), ttl=options.get('TTL', 300))
+
+    def _lookup(self, key, version):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, entry_version, expires_at = entry
+        if entry_version != version or expires_at <= self.clock():
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, value, version):
+        self._entries[key] = (value, version, self.clock() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached value for `key`, calling compute() on a miss.
+
+        key[0] must be the user id whose interaction version guards the
+        entry.
+        """
+        version = self.versions.get(key[0])
+        with self._lock:
+            entry = self._lookup(key, version)
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            future = self._inflight.get((key, version))
+            owner = future is None
+            if owner:
+                future = self._inflight[(key, version)] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(value)
+            with self._lock:
+                self._store(key, value, version)
+            return value
+        finally:
+            with self._lock:
+                del self._inflight[(key, version)]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+
+class RowCache:
+    """
+    Thread-safe LRU cache of serialized rows keyed by primary key, with a
+    TTL as a safety net for changes made outside the ORM.
+    """
+
+    def __init__(self, maxsize=10000, ttl=600, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_settings(cls, name):
+        """
+        Build a cache configured by settings.RECOMMENDER_CACHES[name].
+        """
+        options = getattr(settings, 'RECOMMENDER_CACHES', {}).get(name, {})
+        return cls(maxsize=options.get('MAXSIZE', 10000), ttl=options.get('TTL', 600))
+
+    def get_many(self, keys):
+        """
+        Return {key: row} for the keys that are cached and fresh.
+        """
+        found = {}
+        now = self.clock()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(key)
+                    found[key] = entry[0]
+                elif entry is not None:
+                    del self._entries[key]
+                    self.evictions += 1
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, rows):
+        expires_at = self.clock() + self.ttl
+        with self._lock:
+            for key, row in rows.items():
+                self._entries[key] = (row, expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
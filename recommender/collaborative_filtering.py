@@ -1,265 +1,764 @@
+import logging
+import threading
+import time
+
 import numpy as np
-from collections import defaultdict
 from sklearn.metrics.pairwise import cosine_similarity
 from scipy.sparse import csr_matrix
 
-from real_state.models import RealState, UserInteraction
+from real_state.models import RealState
+
+from .interaction_loader import change_mark, changes_since
+from .interaction_matrix import InteractionMatrix, UpdateTimer, grow
+from .interaction_window import InteractionWindow, load_window_interactions
+from .metrics import laps
+from .ranking import top_n_indices
+from .snapshots import EngineSlot, load_array, load_meta, save_arrays
+
+logger = logging.getLogger(__name__)
+
+# Decimals user-based CF scores are rounded to before ranking, so equal
+# averages summed in a different order still tie
+SCORE_DECIMALS = 10
+
+
+def _batch_rows(interactions, users):
+    """
+    Positions into `users` of the known users and their rows of the merged
+    matrix, as (positions, matrix rows, batch matrix).
+    """
+    user_rows = [interactions.user_row(getattr(user, 'id', user)) for user in users]
+    positions = [i for i, row in enumerate(user_rows) if row is not None]
+    rows = np.array([user_rows[i] for i in positions], dtype=np.int64)
+    matrix = interactions.to_csr()
+    return positions, rows, matrix, matrix[rows]
+
+
+def _rank_batch(
+    interactions, users, positions, batch, scores, fallback, top_n, with_scores
+):
+    """
+    Turn a sparse (batch users x properties) score matrix into ranked id
+    lists in the order of `users`, or (ids, scores) pairs if
+    `with_scores`. A user whose row has no unseen candidate is ranked by
+    fallback(seen) -> (columns, scores); unknown users and users without
+    interactions get nothing.
+    """
+    results = [([], []) if with_scores else [] for _ in users]
+    scores = scores.tocsr()
+    scores.sort_indices()
+    for i, position in enumerate(positions):
+        items = batch.indices[batch.indptr[i] : batch.indptr[i + 1]]
+        if items.size == 0:
+            continue
+        seen = np.zeros(interactions.n_properties, dtype=bool)
+        seen[items] = True
+
+        start, stop = scores.indptr[i], scores.indptr[i + 1]
+        item_cols, item_scores = scores.indices[start:stop], scores.data[start:stop]
+        unseen = ~seen[item_cols]
+        item_cols, item_scores = item_cols[unseen], item_scores[unseen]
+        if item_cols.size == 0:
+            item_cols, item_scores = fallback(seen)
+        if item_cols.size == 0:
+            continue
+        # Ties rank by property id, as in get_recommended_ids
+        ids = interactions.property_ids[item_cols]
+        best = top_n_indices(item_scores, top_n, ids)
+        ids = ids[best].tolist()
+        results[position] = (ids, item_scores[best].tolist()) if with_scores else ids
+    return results
 
 
 class UserBasedCF:
-    def __init__(self):
-        self.user_item_matrix = self._create_matrix()
+    """
+    User-based collaborative filtering over a sparse user x property matrix.
 
-    def _create_matrix(self):
-        interactions = UserInteraction.objects.all()
-        matrix = defaultdict(dict)
-
-        for interaction in interactions:
-            user_id = interaction.user.id
-            property_id = interaction.property.id
-            weight = {'view': 1, 'like': 2, 'save': 3}.get(
-                interaction.interaction_type, 0
-            )
-            matrix[user_id][property_id] = weight
+    similarity selects how neighbours are scored:
+        - 'agreement': share of co-rated properties whose weights are
+          within 1 point of each other (the original behaviour)
+        - 'cosine': cosine of the two users' weight vectors
+    """
 
-        return matrix
+    SIMILARITY_MODES = ('agreement', 'cosine')
 
-    def get_recommendations(self, user, top_n=10):
-        target_user_id = user.id
-        user_interactions = self.user_item_matrix.get(target_user_id, {})
-
-        if not user_interactions:
-            return RealState.objects.none()
-
-        # Find users who have rated any of the same properties
-        similar_users = []
-        target_items = set(user_interactions.keys())
-
-        property_user_map = defaultdict(list)
-        # First, build a map of properties to users who rated them
-        for other_user_id, other_interactions in self.user_item_matrix.items():
-            if other_user_id != target_user_id:
-                for prop_id in other_interactions:
-                    property_user_map[prop_id].append(other_user_id)
-
-        # Find users who rated any of the same properties
-        candidate_users = set()
-        for prop_id in target_items:
-            candidate_users.update(property_user_map[prop_id])
-
-        for other_user_id in candidate_users:
-            other_interactions = self.user_item_matrix[other_user_id]
-            other_items = set(other_interactions.keys())
-
-            # Calculate overlap
-            common_items = target_items & other_items
-            if not common_items:
-                continue
-
-            # Calculate simple similarity based on rating agreement
-            rating_agreements = 0
-            for item in common_items:
-                rating_diff = abs(user_interactions[item] - other_interactions[item])
-                if rating_diff <= 1:  # Consider ratings within 1 point as agreement
-                    rating_agreements += 1
-
-            # Calculate similarity score
-            similarity = rating_agreements / len(common_items)
-
-            # Accept any user with any positive similarity
-            if similarity > 0:
-                similar_users.append((other_user_id, similarity))
-
-        # Get recommendations
-        recommendations = defaultdict(list)  # Changed to store all ratings
-
-        for other_user_id, similarity in similar_users:
-            other_interactions = self.user_item_matrix[other_user_id]
-
-            # Recommend properties this user hasn't seen
-            for prop_id, rating in other_interactions.items():
-                if prop_id not in user_interactions:
-                    recommendations[prop_id].append((float(rating), similarity))
-
-        # Score properties by weighted average rating
-        scored_items = []
-        for prop_id, ratings_and_sims in recommendations.items():
-            ratings = [r for r, _ in ratings_and_sims]
-            sims = [s for _, s in ratings_and_sims]
-            avg_rating = sum(r * s for r, s in ratings_and_sims) / sum(sims)
-            scored_items.append((prop_id, avg_rating))
-
-        if not scored_items:
-            # Fallback: recommend most popular properties user hasn't seen
-            property_ratings = defaultdict(list)
+    def __init__(self, similarity='agreement'):
+        if similarity not in self.SIMILARITY_MODES:
+            raise ValueError(f"Unknown similarity mode: {similarity}")
+        self.similarity = similarity
+        self._update_lock = threading.Lock()
+        self._create_matrix()
 
-            for interactions in self.user_item_matrix.values():
-                for prop_id, rating in interactions.items():
-                    if prop_id not in user_interactions:
-                        property_ratings[prop_id].append(float(rating))
-
-            scored_items = [
-                (prop_id, sum(ratings) / len(ratings))
-                for prop_id, ratings in property_ratings.items()
-                if len(ratings) >= 2  # Require at least 2 ratings
-            ]
+    def _create_matrix(self):
+        # Changes logged from here on are replayed onto loaded snapshots
+        self.changes_mark = change_mark()
+        interactions, self.window = load_window_interactions()
+        self.interactions = InteractionMatrix.from_interactions(interactions)
+        self.update_timer = UpdateTimer('user_based_cf')
+
+    def save(self, path):
+        with self._update_lock:
+            save_arrays(
+                path,
+                {
+                    **self.interactions.snapshot_arrays(),
+                    **self.window.snapshot_arrays(),
+                },
+                {
+                    'similarity': self.similarity,
+                    'window': self.window.meta(),
+                    'changes_mark': self.changes_mark,
+                },
+            )
 
-        if not scored_items:
-            return RealState.objects.none()
+    @classmethod
+    def load(cls, path):
+        """
+        Map a snapshot written by save(), then apply the interaction changes
+        made since it was built.
+        """
+        meta = load_meta(path)
+        if meta['window']['half_life_days'] is not None:
+            # Decayed weights break the agreement rules over rating levels
+            raise ValueError(f"Decayed interaction weights in {path}")
+        recommender = cls.__new__(cls)
+        recommender.similarity = meta['similarity']
+        recommender._update_lock = threading.Lock()
+        recommender.interactions = InteractionMatrix.load(path)
+        recommender.window = InteractionWindow.load(path, meta['window'])
+        recommender.update_timer = UpdateTimer('user_based_cf')
+        recommender.changes_mark, changes = changes_since(meta['changes_mark'])
+        for change in changes:
+            recommender.apply_interaction(*change)
+        recommender.expire_interactions()
+        return recommender
+
+    def apply_interaction(self, user_id, property_id, weight, created=None):
+        """
+        Set (or with weight 0, delete) a user -> property cell in place;
+        `created` is the interaction's creation time (default: now).
+        """
+        with self.update_timer.measure(), self._update_lock:
+            weight = self.window.record(user_id, property_id, weight, created)
+            self.interactions.set(user_id, property_id, weight)
+
+    def expire_interactions(self, now=None):
+        """
+        Delete the cells that have left the interaction window.
+        """
+        for user_id, property_id in self.window.expired(now):
+            self.apply_interaction(user_id, property_id, 0)
+
+    def _user_similarities(self, user_row, items, ratings):
+        """
+        Score every user who shares at least one property with the target.
+
+        Returns (neighbour rows, similarities) for neighbours with a
+        positive similarity, excluding the target user.
+        """
+        overlap_rows, overlap_cols, overlap_weights = self.interactions.columns(items)
+        other_rows, inverse = np.unique(overlap_rows, return_inverse=True)
+        target_ratings = ratings[overlap_cols]
+
+        if self.similarity == 'agreement':
+            common = np.bincount(inverse, minlength=other_rows.size)
+            # Consider ratings within 1 point as agreement
+            agreed = np.abs(overlap_weights - target_ratings) <= 1
+            agreements = np.bincount(inverse, weights=agreed, minlength=other_rows.size)
+            similarities = agreements / common
+        else:
+            dots = np.bincount(
+                inverse,
+                weights=overlap_weights * target_ratings,
+                minlength=other_rows.size,
+            )
+            similarities = dots / (
+                self.interactions.user_norms[other_rows] * np.linalg.norm(ratings)
+            )
 
-        scored_items.sort(key=lambda x: x[1], reverse=True)
-        recommended_ids = [item[0] for item in scored_items[:top_n]]
+        # Accept any user with any positive similarity
+        keep = (other_rows != user_row) & (similarities > 0)
+        return other_rows[keep], similarities[keep]
 
+    def get_recommendations(self, user, top_n=10):
+        recommended_ids = self.get_recommended_ids(user, top_n)
         return RealState.objects.filter(id__in=recommended_ids)
 
-
-class ItemBasedCF:
-    def __init__(self):
-        self.item_user_matrix = self._create_matrix()
-        self.item_similarities = {}
-        self.item_popularity = self._calculate_item_popularity()
-
-    def _create_matrix(self):
-        interactions = UserInteraction.objects.all()
-        matrix = defaultdict(dict)
-
-        interaction_count = 0
-
-        for interaction in interactions:
-            property_id = interaction.property.id
-            user_id = interaction.user.id
-            weight = {'view': 1, 'like': 2, 'save': 3}.get(
-                interaction.interaction_type, 0
+    def predicted_ratings(self, user_row, items, ratings, seen):
+        """
+        (columns, scores) of the unseen properties rated by the neighbours of
+        the user with interactions (items, ratings): the similarity-weighted
+        average of the neighbours' ratings.
+        """
+        neighbours, similarities = self._user_similarities(user_row, items, ratings)
+
+        # Score unseen properties by the similarity-weighted average rating;
+        # properties added since `seen` was sized are left for later requests
+        positions, cols, ratings = self.interactions.rows(neighbours)
+        unseen = cols < seen.size
+        unseen[unseen] = ~seen[cols[unseen]]
+        weights = similarities[positions[unseen]]
+        item_cols, inverse = np.unique(cols[unseen], return_inverse=True)
+        scores = np.bincount(
+            inverse,
+            weights=ratings[unseen] * weights,
+            minlength=item_cols.size,
+        ) / np.bincount(inverse, weights=weights, minlength=item_cols.size)
+        return item_cols, np.round(scores, SCORE_DECIMALS)
+
+    def get_recommended_ids(self, user, top_n=10):
+        """
+        Ids of the top_n recommended properties, best first.
+        """
+        user_row = self.interactions.user_row(getattr(user, 'id', user))
+        if user_row is None:
+            return []
+
+        items, ratings = self.interactions.row(user_row)
+        if items.size == 0:
+            return []
+
+        seen = np.zeros(self.interactions.n_properties, dtype=bool)
+        seen[items] = True
+
+        lap = laps()
+        item_cols, scores = self.predicted_ratings(user_row, items, ratings, seen)
+        lap('similarity')
+
+        if item_cols.size == 0:
+            # Fallback: recommend most popular properties user hasn't seen
+            # (require at least 2 ratings)
+            item_counts = self.interactions.item_counts[: seen.size]
+            item_cols = np.flatnonzero((item_counts >= 2) & ~seen)
+            scores = (
+                self.interactions.item_weight_sums[item_cols] / item_counts[item_cols]
             )
-            matrix[property_id][user_id] = weight
-            interaction_count += 1
 
-        return matrix
-
-    def _calculate_item_popularity(self):
-        """Calculate popularity scores for items."""
-        popularity = defaultdict(lambda: {'count': 0, 'avg_weight': 0.0})
+        if item_cols.size == 0:
+            return []
+
+        # Ties rank by property id: columns added since the build are not in
+        # id order, and a rebuild must rank the same
+        candidate_ids = self.interactions.property_ids[item_cols]
+        recommended_ids = candidate_ids[top_n_indices(scores, top_n, candidate_ids)]
+        lap('rank')
+
+        return recommended_ids.tolist()
+
+    def _batch_user_similarities(self, rows, matrix, batch):
+        """
+        Sparse (batch users x users) similarities, computed for the whole
+        batch with sparse products; same values as _user_similarities.
+        """
+        binary = matrix.copy()
+        binary.data[:] = 1.0
+        batch_binary = binary[rows]
+
+        if self.similarity == 'agreement':
+            common = (batch_binary @ binary.T).tocsr()
+            # Co-rated pairs whose weights are more than 1 point apart
+            levels = np.unique(matrix.data)
+            indicators = {}
+            for level in levels:
+                indicator = matrix.copy()
+                indicator.data = (indicator.data == level).astype(np.float64)
+                indicator.eliminate_zeros()
+                indicators[level] = indicator
+            disagreements = csr_matrix(common.shape)
+            for level in levels:
+                for other in levels[np.abs(levels - level) > 1]:
+                    disagreements = disagreements + (
+                        indicators[level][rows] @ indicators[other].T
+                    )
+            similarities = (common - disagreements).multiply(common.power(-1))
+        else:
+            # Users added since `matrix` was read have no column in it
+            norms = self.interactions.user_norms[: matrix.shape[0]]
+            similarities = (batch @ matrix.T).multiply(
+                np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)[
+                    None, :
+                ]
+            )
+            similarities = similarities.multiply(1.0 / norms[rows][:, None])
+
+        # Same neighbours as _user_similarities: positive, not the user
+        similarities = similarities.tocoo()
+        keep = (similarities.col != rows[similarities.row]) & (similarities.data > 0)
+        return csr_matrix(
+            (similarities.data[keep], (similarities.row[keep], similarities.col[keep])),
+            shape=similarities.shape,
+        )
+
+    def get_batch_recommended_ids(self, users, top_n=10, with_scores=False):
+        """
+        get_recommended_ids for many users (or ids) at once, in order;
+        with_scores=True returns (ids, scores) pairs.
+
+        Neighbour similarities and predicted ratings of the whole batch come
+        from a few sparse matrix products instead of one pass per user.
+        """
+        positions, rows, matrix, batch = _batch_rows(self.interactions, users)
+        if not positions:
+            return [([], []) if with_scores else [] for _ in users]
+
+        similarities = self._batch_user_similarities(rows, matrix, batch)
+        binary = matrix.copy()
+        binary.data[:] = 1.0
+
+        # Similarity-weighted average rating of every neighbour property
+        weighted = (similarities @ matrix).tocsr()
+        totals = (similarities @ binary).tocsr()
+        weighted.sort_indices()
+        totals.sort_indices()
+        scores = weighted.copy()
+        scores.data = np.round(weighted.data / totals.data, SCORE_DECIMALS)
+
+        def popular(seen):
+            # Most popular unseen properties, with at least 2 ratings
+            item_counts = self.interactions.item_counts[: seen.size]
+            item_cols = np.flatnonzero((item_counts >= 2) & ~seen)
+            return (
+                item_cols,
+                self.interactions.item_weight_sums[item_cols] / item_counts[item_cols],
+            )
 
-        for item_id, users in self.item_user_matrix.items():
-            popularity[item_id]['count'] = len(users)
-            popularity[item_id]['avg_weight'] = sum(users.values()) / len(users)
+        return _rank_batch(
+            self.interactions,
+            users,
+            positions,
+            batch,
+            scores,
+            popular,
+            top_n,
+            with_scores,
+        )
 
-        return popularity
 
-    def _compute_item_similarity(self, item1_id, item2_id):
-        """Compute similarity between two items using multiple metrics."""
-        item1_users = self.item_user_matrix.get(item1_id, {})
-        item2_users = self.item_user_matrix.get(item2_id, {})
+class ItemBasedCF:
+    """
+    Item-based collaborative filtering served from a precomputed top-K
+    neighbour index.
+
+    For every property the `neighbours` most similar properties are kept in
+    two (properties x neighbours) arrays, so memory is bounded by
+    K x properties and a request only merges the K-length lists of the
+    properties the user interacted with. The index is built in blocks of
+    `block_size` properties using sparse matrix products.
+    """
+
+    def __init__(self, neighbours=100, block_size=1024):
+        self.neighbours = neighbours
+        self.block_size = block_size
+        self._update_lock = threading.Lock()
+        self._create_matrix()
+        self._build_neighbour_index()
 
-        # Get common users
-        common_users = set(item1_users.keys()) & set(item2_users.keys())
-        if not common_users:
-            return 0.0
+    def _create_matrix(self):
+        # Changes logged from here on are replayed onto loaded snapshots
+        self.changes_mark = change_mark()
+        interactions, self.window = load_window_interactions()
+        self.interactions = InteractionMatrix.from_interactions(interactions)
+        self.update_timer = UpdateTimer('item_based_cf')
+
+    def save(self, path):
+        with self._update_lock:
+            save_arrays(
+                path,
+                {
+                    **self.interactions.snapshot_arrays(),
+                    **self.window.snapshot_arrays(),
+                    'neighbour_indices': self.neighbour_indices[
+                        : self.interactions.n_properties
+                    ],
+                    'neighbour_scores': self.neighbour_scores[
+                        : self.interactions.n_properties
+                    ],
+                },
+                {
+                    'neighbours': self.neighbours,
+                    'block_size': self.block_size,
+                    'build_seconds': self.build_seconds,
+                    'window': self.window.meta(),
+                    'changes_mark': self.changes_mark,
+                },
+            )
 
-        # Calculate Jaccard similarity
-        all_users = set(item1_users.keys()) | set(item2_users.keys())
-        jaccard_sim = len(common_users) / len(all_users)
+    @classmethod
+    def load(cls, path):
+        """
+        Map a snapshot written by save(), then apply the interaction changes
+        made since it was built.
+        """
+        meta = load_meta(path)
+        if meta['window']['half_life_days'] is not None:
+            # Decayed weights break the agreement rules over rating levels
+            raise ValueError(f"Decayed interaction weights in {path}")
+        recommender = cls.__new__(cls)
+        recommender.neighbours = meta['neighbours']
+        recommender.block_size = meta['block_size']
+        recommender.build_seconds = meta['build_seconds']
+        recommender._update_lock = threading.Lock()
+        recommender.interactions = InteractionMatrix.load(path)
+        recommender.window = InteractionWindow.load(path, meta['window'])
+        recommender.update_timer = UpdateTimer('item_based_cf')
+        recommender.neighbour_indices = load_array(path, 'neighbour_indices')
+        recommender.neighbour_scores = load_array(path, 'neighbour_scores')
+        recommender.changes_mark, changes = changes_since(meta['changes_mark'])
+        for change in changes:
+            recommender.apply_interaction(*change)
+        recommender.expire_interactions()
+        return recommender
+
+    def _item_avg_weights(self, item_cols):
+        """Average interaction weight of each item, used as its popularity."""
+        counts = self.interactions.item_counts[item_cols]
+        weight_sums = self.interactions.item_weight_sums[item_cols]
+        return np.divide(
+            weight_sums,
+            counts,
+            out=np.zeros_like(weight_sums),
+            where=counts > 0,
+        )
+
+    def _compute_item_similarities(self, items):
+        """
+        Compute the similarity of each property in `items` to every property.
+
+        The similarity blends Jaccard overlap of the two user sets (0.4) with
+        the mean rating agreement over common users (0.6), where two ratings
+        agree by 1 - |r1 - r2| / 3. Returns a sparse (len(items) x properties)
+        matrix holding only pairs with at least one common user.
+        """
+        # Only users who interacted with one of `items` can contribute, so
+        # work on their rows alone.
+        users = np.unique(self.interactions.columns(items)[0])
+        matrix = self.interactions.rows_csr(users)
+        block = matrix[:, items]
+        binary = matrix.copy()
+        binary.data[:] = 1.0
+        block_binary = binary[:, items]
+
+        # Number of users who interacted with both properties
+        common = (block_binary.T @ binary).tocsr()
+
+        # sum |r1 - r2| = sum r1 + sum r2 - 2 * sum min(r1, r2), and
+        # min(r1, r2) decomposes into indicator products over weight levels.
+        rating_sums = block.T @ binary + block_binary.T @ matrix
+        min_sums = csr_matrix(common.shape)
+        previous_level = 0.0
+        for level in np.unique(matrix.data):
+            at_least = matrix.copy()
+            at_least.data = (at_least.data >= level).astype(np.float64)
+            at_least.eliminate_zeros()
+            min_sums = min_sums + (level - previous_level) * (
+                at_least[:, items].T @ at_least
+            )
+            previous_level = level
 
-        # Calculate rating similarity
-        rating_similarities = []
-        for user_id in common_users:
-            rating1 = item1_users[user_id]
-            rating2 = item2_users[user_id]
-            # Consider ratings similar if they're within 1 point
-            rating_sim = 1.0 - (
-                abs(rating1 - rating2) / 3.0
-            )  # 3.0 is max possible difference
-            rating_similarities.append(rating_sim)
+        # 3.0 is max possible difference
+        agreement = common - (rating_sums - 2 * min_sums) / 3.0
+        rating_sim = agreement.multiply(common.power(-1))
 
-        rating_sim = sum(rating_similarities) / len(rating_similarities)
+        item_counts = self.interactions.item_counts
+        jaccard = common.tocoo()
+        jaccard.data = jaccard.data / (
+            item_counts[items][jaccard.row] + item_counts[jaccard.col] - jaccard.data
+        )
 
         # Combine similarities with weights
-        combined_sim = (jaccard_sim * 0.4) + (rating_sim * 0.6)
-        return combined_sim
+        return (jaccard.tocsr() * 0.4 + rating_sim * 0.6).tocoo()
+
+    def _top_k_neighbours(self, items, similarities=None):
+        """
+        Return (indices, scores) arrays of shape (len(items), neighbours) for
+        the given properties, padded with -1 / 0.
+        """
+        if similarities is None:
+            similarities = self._compute_item_similarities(items)
+        rows, cols, scores = similarities.row, similarities.col, similarities.data
+
+        # A property is not its own neighbour
+        keep = (cols != items[rows]) & (scores > 0)
+        rows, cols, scores = rows[keep], cols[keep], scores[keep]
+
+        # Rank each row's entries by descending stored score, then by
+        # property id (columns added since the build are not in id order),
+        # and keep the first K
+        scores = scores.astype(np.float32)
+        order = np.lexsort((self.interactions.property_ids[cols], -scores, rows))
+        rows, cols, scores = rows[order], cols[order], scores[order]
+        row_starts = np.searchsorted(rows, np.arange(len(items)))
+        ranks = np.arange(rows.size) - row_starts[rows]
+        keep = ranks < self.neighbours
+
+        indices = np.full((len(items), self.neighbours), -1, dtype=np.int32)
+        values = np.zeros((len(items), self.neighbours), dtype=np.float32)
+        indices[rows[keep], ranks[keep]] = cols[keep]
+        values[rows[keep], ranks[keep]] = scores[keep]
+        return indices, values
+
+    def _build_neighbour_index(self):
+        start = time.perf_counter()
+        n_items = self.interactions.n_properties
+        self.neighbour_indices = np.full((n_items, self.neighbours), -1, dtype=np.int32)
+        self.neighbour_scores = np.zeros((n_items, self.neighbours), dtype=np.float32)
+
+        for block_start in range(0, n_items, self.block_size):
+            items = np.arange(block_start, min(block_start + self.block_size, n_items))
+            indices, scores = self._top_k_neighbours(items)
+            self.neighbour_indices[items] = indices
+            self.neighbour_scores[items] = scores
+
+        self.build_seconds = time.perf_counter() - start
+        logger.info(
+            "Built item neighbour index for %d properties (k=%d) in %.2fs",
+            n_items,
+            self.neighbours,
+            self.build_seconds,
+        )
+
+    def _upsert_neighbour(self, item, neighbour, score):
+        """
+        Set `neighbour`'s score in the top-K list of `item`, evicting the
+        weakest entry if the list is full.
+
+        Returns False, leaving the list alone, when the list is full and
+        `neighbour` loses score in it: a property outside the list may now
+        rank above it, so the list has to be recomputed.
+        """
+        indices = self.neighbour_indices[item]
+        scores = self.neighbour_scores[item]
+        score = np.float32(max(score, 0.0))
+        slot = np.flatnonzero(indices == neighbour)
+        free = np.flatnonzero(indices < 0)
+        if slot.size:
+            slot = slot[0]
+            if score < scores[slot] and not free.size:
+                return False
+            indices[slot] = neighbour if score > 0 else -1
+            scores[slot] = score
+        elif score > 0:
+            if free.size:
+                slot = free[0]
+            else:
+                # The weakest entry goes, the highest property id on a tie,
+                # as in the ranking of _top_k_neighbours
+                property_ids = self.interactions.property_ids
+                slot = np.lexsort((-property_ids[indices], scores))[0]
+                if (score, -property_ids[neighbour]) <= (
+                    scores[slot],
+                    -property_ids[indices[slot]],
+                ):
+                    return True
+            indices[slot] = neighbour
+            scores[slot] = score
+        return True
+
+    def apply_interaction(self, user_id, property_id, weight, created=None):
+        """
+        Set (or with weight 0, delete) a user -> property cell in place;
+        `created` is the interaction's creation time (default: now).
+
+        Only the similarities of pairs with the property change, so its own
+        neighbour list is recomputed and its entry refreshed in the lists of
+        every property sharing a user with it (and of the user's other
+        properties, which may have lost their only common user). Full lists
+        in which it loses score are recomputed. The index then equals a
+        full rebuild's.
+        """
+        with self.update_timer.measure(), self._update_lock:
+            weight = self.window.record(user_id, property_id, weight, created)
+            user_row, col, previous = self.interactions.set(
+                user_id, property_id, weight
+            )
+            if col is None or previous == weight:
+                return
+
+            n_items = self.interactions.n_properties
+            self.neighbour_indices = grow(self.neighbour_indices, n_items, fill=-1)
+            self.neighbour_scores = grow(self.neighbour_scores, n_items)
+
+            items = np.array([col])
+            similarities = self._compute_item_similarities(items)
+            indices, scores = self._top_k_neighbours(items, similarities)
+            self.neighbour_indices[col] = indices[0]
+            self.neighbour_scores[col] = scores[0]
+
+            similarity_to = dict(zip(similarities.col.tolist(), similarities.data))
+            user_items, _ = self.interactions.row(user_row)
+            changed = set(similarity_to) | set(user_items.tolist())
+            changed.discard(col)
+            stale = np.array(
+                [
+                    item
+                    for item in sorted(changed)
+                    if not self._upsert_neighbour(
+                        item, col, similarity_to.get(item, 0.0)
+                    )
+                ],
+                dtype=np.int64,
+            )
+            if stale.size:
+                indices, scores = self._top_k_neighbours(stale)
+                self.neighbour_indices[stale] = indices
+                self.neighbour_scores[stale] = scores
+
+    def expire_interactions(self, now=None):
+        """
+        Delete the cells that have left the interaction window.
+        """
+        for user_id, property_id in self.window.expired(now):
+            self.apply_interaction(user_id, property_id, 0)
 
     def get_recommendations(self, user, top_n=10):
-        target_user_id = user.id
-        user_interactions = defaultdict(dict)
+        recommended_ids = self.get_recommended_ids(user, top_n)
+        return RealState.objects.filter(id__in=recommended_ids)
+
+    def predicted_scores(self, items, ratings, seen):
+        """
+        (columns, scores) of the unseen neighbours of the properties `items`
+        the user rated with `ratings`.
+        """
+        # Merge the neighbour lists of every item the user interacted with
+        neighbours = self.neighbour_indices[items]
+        similarities = self.neighbour_scores[items]
+        user_ratings = np.broadcast_to(ratings[:, None], neighbours.shape)
+
+        # Only consider unseen items (known when `seen` was sized); lowered
+        # threshold for sparse data
+        mask = (neighbours >= 0) & (neighbours < seen.size) & (similarities > 0.1)
+        mask[mask] = ~seen[neighbours[mask]]
+
+        similarities = similarities[mask].astype(np.float64)
+        item_cols, inverse = np.unique(neighbours[mask], return_inverse=True)
+        normalized_scores = np.bincount(
+            inverse,
+            weights=similarities * user_ratings[mask],
+            minlength=item_cols.size,
+        ) / np.bincount(inverse, weights=similarities, minlength=item_cols.size)
+
+        # Boost score with item popularity, normalized to [0,1]
+        popularity_boost = self._item_avg_weights(item_cols) / 3.0
+        return item_cols, (normalized_scores * 0.7) + (popularity_boost * 0.3)
+
+    def get_recommended_ids(self, user, top_n=10):
+        """
+        Ids of the top_n recommended properties, best first.
+        """
+        user_row = self.interactions.user_row(getattr(user, 'id', user))
+        if user_row is None:
+            return []
 
         # Get user's interactions
-        for item_id, users in self.item_user_matrix.items():
-            if target_user_id in users:
-                user_interactions[item_id] = users[target_user_id]
-
-        if not user_interactions:
-            return RealState.objects.none()
-
-        # Calculate recommendations
-        recommendations = defaultdict(float)
-        similarity_sums = defaultdict(float)
-        similar_items_found = 0
-
-        # For each item the user has interacted with
-        for user_item_id, user_rating in user_interactions.items():
-            similar_items = 0
-
-            # Compare with all other items
-            for other_item_id in self.item_user_matrix:
-                if other_item_id not in user_interactions:  # Only consider unseen items
-                    # Get or compute similarity
-                    sim_pair = tuple(sorted([user_item_id, other_item_id]))
-                    if sim_pair not in self.item_similarities:
-                        self.item_similarities[sim_pair] = (
-                            self._compute_item_similarity(sim_pair[0], sim_pair[1])
-                        )
-
-                    similarity = self.item_similarities[sim_pair]
-                    if similarity > 0.1:  # Lowered threshold for sparse data
-                        similar_items += 1
-                        recommendations[other_item_id] += similarity * user_rating
-                        similarity_sums[other_item_id] += similarity
-
-            similar_items_found += similar_items
-
-        # Normalize and sort recommendations
-        scored_items = []
-        for item_id, score in recommendations.items():
-            if similarity_sums[item_id] > 0:
-                normalized_score = score / similarity_sums[item_id]
-                # Boost score with item popularity
-                popularity_boost = (
-                    self.item_popularity[item_id]['avg_weight'] / 3.0
-                )  # Normalize to [0,1]
-                final_score = (normalized_score * 0.7) + (popularity_boost * 0.3)
-                scored_items.append((item_id, final_score))
-
-        if not scored_items:
-            # Fallback: recommend popular items the user hasn't interacted with
-            for item_id, pop_data in self.item_popularity.items():
-                if item_id not in user_interactions and pop_data['count'] >= 2:
-                    popularity_score = (
-                        pop_data['count'] * pop_data['avg_weight']
-                    ) / 3.0
-                    scored_items.append((item_id, popularity_score))
+        items, ratings = self.interactions.row(user_row)
+        if items.size == 0:
+            return []
 
-        if not scored_items:
-            return RealState.objects.none()
+        seen = np.zeros(self.interactions.n_properties, dtype=bool)
+        seen[items] = True
 
-        scored_items.sort(key=lambda x: x[1], reverse=True)
-        recommended_ids = [item[0] for item in scored_items[:top_n]]
+        lap = laps()
+        item_cols, scores = self.predicted_scores(items, ratings, seen)
+        lap('similarity')
 
-        return RealState.objects.filter(id__in=recommended_ids)
+        if item_cols.size == 0:
+            # Fallback: recommend popular items the user hasn't interacted with
+            item_counts = self.interactions.item_counts[: seen.size]
+            item_cols = np.flatnonzero((item_counts >= 2) & ~seen)
+            scores = (item_counts[item_cols] * self._item_avg_weights(item_cols)) / 3.0
+
+        if item_cols.size == 0:
+            return []
+
+        # Ties rank by property id: columns added since the build are not in
+        # id order, and a rebuild must rank the same
+        candidate_ids = self.interactions.property_ids[item_cols]
+        recommended_ids = candidate_ids[top_n_indices(scores, top_n, candidate_ids)]
+        lap('rank')
+
+        return recommended_ids.tolist()
+
+    def get_batch_recommended_ids(self, users, top_n=10, with_scores=False):
+        """
+        get_recommended_ids for many users (or ids) at once, in order;
+        with_scores=True returns (ids, scores) pairs.
+
+        The neighbour index is turned into a sparse property x property
+        matrix so the whole batch is scored with two sparse products.
+        """
+        positions, rows, matrix, batch = _batch_rows(self.interactions, users)
+        if not positions:
+            return [([], []) if with_scores else [] for _ in users]
+
+        # Properties added since `matrix` was read wait for later requests
+        n_items = matrix.shape[1]
+        indices = self.neighbour_indices[:n_items]
+        similarities = self.neighbour_scores[:n_items]
+        # Lowered threshold for sparse data
+        rows, slots = np.nonzero((indices >= 0) & (similarities > 0.1))
+        # Concurrent updates write the index in place, so read each entry
+        # once and check it again
+        cols, values = indices[rows, slots], similarities[rows, slots]
+        keep = (cols >= 0) & (cols < n_items) & (values > 0.1)
+        neighbours = csr_matrix(
+            (values[keep].astype(np.float64), (rows[keep], cols[keep])),
+            shape=(n_items, n_items),
+        )
+        binary = batch.copy()
+        binary.data[:] = 1.0
+
+        weighted = (batch @ neighbours).tocsr()
+        totals = (binary @ neighbours).tocsr()
+        weighted.sort_indices()
+        totals.sort_indices()
+
+        # Boost score with item popularity, normalized to [0,1]
+        scores = weighted.copy()
+        popularity_boost = self._item_avg_weights(weighted.indices) / 3.0
+        scores.data = (weighted.data / totals.data) * 0.7 + popularity_boost * 0.3
+
+        def popular(seen):
+            # Popular items the user hasn't interacted with
+            item_counts = self.interactions.item_counts[: seen.size]
+            item_cols = np.flatnonzero((item_counts >= 2) & ~seen)
+            return (
+                item_cols,
+                (item_counts[item_cols] * self._item_avg_weights(item_cols)) / 3.0,
+            )
+
+        return _rank_batch(
+            self.interactions,
+            users,
+            positions,
+            batch,
+            scores,
+            popular,
+            top_n,
+            with_scores,
+        )
 
 
 # Singleton instances
 user_based_recommender = None
 item_based_recommender = None
 
+user_based_slot = EngineSlot('user_based_cf', UserBasedCF)
+item_based_slot = EngineSlot('item_based_cf', ItemBasedCF)
+
 
-def get_user_based_recommender():
+def get_user_based_recommender(wait=True):
+    """
+    The process's engine; with wait=False None until it has been built.
+    """
     global user_based_recommender
-    if user_based_recommender is None:
-        user_based_recommender = UserBasedCF()
+    user_based_recommender = user_based_slot.get(wait)
     return user_based_recommender
 
 
-def get_item_based_recommender():
+def get_item_based_recommender(wait=True):
+    """
+    The process's engine; with wait=False None until it has been built.
+    """
     global item_based_recommender
-    if item_based_recommender is None:
-        item_based_recommender = ItemBasedCF()
+    item_based_recommender = item_based_slot.get(wait)
     return item_based_recommender
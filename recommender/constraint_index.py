@@ -0,0 +1,88 @@
+import numpy as np
+
+
+class ConstraintIndex:
+    """
+    Narrows a PropertySnapshot to the rows meeting the hard constraints
+    (price <= budget, bedrooms >= min, bathrooms >= min) before scoring.
+
+    Rows are ordered by price so a budget selects a prefix found with
+    searchsorted. For every distinct bedroom and bathroom count a bitset
+    over that order marks the rows with at least that many, so the room
+    constraints are two AND-ed bitset prefixes.
+
+    Rows appended to the store after the build are checked directly as a
+    tail; stale() reports when the tail has grown enough, or the store
+    has been compacted, to warrant a rebuild.
+    """
+
+    def __init__(self, snapshot, rebuild_ratio=0.1):
+        self.rebuild_ratio = rebuild_ratio
+        self.generation = snapshot.generation
+        self.n_rows = snapshot.ids.size
+
+        columns = snapshot.columns
+        price, bedrooms, bathrooms = (
+            columns['price'],
+            columns['bedrooms'],
+            columns['bathrooms'],
+        )
+        self.order = np.argsort(price, kind='stable')
+        self.sorted_prices = price[self.order]
+        self.bedroom_levels, self.bedroom_bits = self._bitsets(bedrooms[self.order])
+        self.bathroom_levels, self.bathroom_bits = self._bitsets(bathrooms[self.order])
+
+    @staticmethod
+    def _bitsets(values):
+        levels = np.unique(values)
+        bits = np.zeros((levels.size, (values.size + 7) // 8), dtype=np.uint8)
+        for i, level in enumerate(levels):
+            bits[i] = np.packbits(values >= level)
+        return levels, bits
+
+    @staticmethod
+    def _at_least(levels, bits, minimum, n_bytes):
+        """
+        Packed bitset prefix of rows whose value is >= minimum.
+        """
+        level = np.searchsorted(levels, minimum, side='left')
+        if level == levels.size:
+            return np.zeros(n_bytes, dtype=np.uint8)
+        return bits[level, :n_bytes]
+
+    def stale(self, snapshot):
+        return (
+            snapshot.generation != self.generation
+            or snapshot.ids.size - self.n_rows > self.rebuild_ratio * self.n_rows
+        )
+
+    def candidates(self, snapshot, budget, min_bedrooms, min_bathrooms):
+        """
+        Return the snapshot rows satisfying every hard constraint.
+        """
+        within_budget = int(np.searchsorted(self.sorted_prices, budget, side='right'))
+        n_bytes = (within_budget + 7) // 8
+        matches = self._at_least(
+            self.bedroom_levels, self.bedroom_bits, min_bedrooms, n_bytes
+        ) & self._at_least(
+            self.bathroom_levels, self.bathroom_bits, min_bathrooms, n_bytes
+        )
+        positions = np.flatnonzero(np.unpackbits(matches, count=within_budget))
+        rows = self.order[positions]
+
+        # Rows added since the index was built
+        tail = np.arange(self.n_rows, snapshot.ids.size)
+        columns = snapshot.columns
+        price, bedrooms, bathrooms = (
+            columns['price'][tail],
+            columns['bedrooms'][tail],
+            columns['bathrooms'][tail],
+        )
+        tail = tail[
+            (price <= budget)
+            & (bedrooms >= min_bedrooms)
+            & (bathrooms >= min_bathrooms)
+        ]
+
+        rows = np.concatenate([rows, tail])
+        return rows[snapshot.alive[rows]]
@@ -1,102 +1,365 @@
 from sklearn.preprocessing import MinMaxScaler
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
-from django.db.models import Prefetch
+from scipy.sparse import csr_matrix, diags, hstack
 from real_state.models import RealState, UserInteraction, Feature
-from functools import lru_cache
+
+from .ann import IVFIndex, ann_options
+from .cache import RecommendationCache
+from .metrics import laps
+from .ranking import top_n_indices
+from .snapshots import (
+    EngineSlot,
+    load_array,
+    load_meta,
+    load_scaler,
+    load_sparse,
+    save_arrays,
+    scaler_arrays,
+    scaler_meta,
+    sparse_arrays,
+)
+
+NUMERICAL_FEATURES = ['price', 'bedrooms', 'bathrooms', 'sqft']
+
+
+def _one_hot(values, n_rows):
+    """
+    Sparse (n_rows x categories) indicator block for one categorical value
+    per row; None leaves the row empty.
+    """
+    categories = sorted({value for value in values if value is not None})
+    column = {category: col for col, category in enumerate(categories)}
+    rows = [row for row, value in enumerate(values) if value in column]
+    cols = [column[values[row]] for row in rows]
+    return csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+        shape=(n_rows, len(categories)),
+    )
 
 
 class ContentFiltering:
+    """
+    Content-based recommendations over a sparse hybrid property vector.
+
+    Each property's vector is the MinMax-scaled numerical block followed by
+    sparse blocks for amenities (pool, garage), property type, location and
+    the Feature M2M. Each block is multiplied by its BLOCK_WEIGHTS entry, so
+    memory scales with the number of non-zeros rather than with properties
+    x vocabulary.
+    """
+
+    BLOCK_WEIGHTS = {
+        'numerical': 1.0,
+        'amenities': 1.0,
+        'property_type': 1.0,
+        'location': 1.0,
+        'features': 1.0,
+    }
+
+    # Users scored together by get_batch_similar_property_ids; bounds the
+    # dense (properties x users) similarity block
+    BATCH_BLOCK_SIZE = 256
+
+    # Least similarity to the profile of a recommended property
+    SIMILARITY_THRESHOLD = 0.7
+
     def __init__(self):
-        # Fetch all properties with their features in a single query
-        self.all_properties = RealState.objects.only(
-            "id",
-            "price",
-            "bedrooms",
-            "bathrooms",
-            "sqft",
-        ).all()
+        # Fetch the scoring columns of every property in a single query
+        rows = list(
+            RealState.objects.values_list(
+                'id',
+                *NUMERICAL_FEATURES,
+                'has_pool',
+                'has_garage',
+                'property_type',
+                'location_id',
+            )
+        )
         # Check if properties exist
-        if not self.all_properties:
+        if not rows:
             raise ValueError("No properties found in the database.")
 
-        # Precompute all feature names for one-hot encoding
-        self.all_feature_names = list(Feature.objects.values_list('name', flat=True))
+        ids, *numerical, has_pool, has_garage, property_types, location_ids = zip(*rows)
+        self.property_ids = np.array(ids, dtype=np.int64)
+        self.property_index = {property_id: row for row, property_id in enumerate(ids)}
 
-        # Extract numerical features and scale them
-        numerical_features = np.array(
-            [
-                [
-                    prop.price,
-                    prop.bedrooms,
-                    prop.bathrooms,
-                    prop.sqft,
-                ]
-                for prop in self.all_properties
-            ]
+        # Feature vocabulary for the one-hot block
+        features = list(Feature.objects.values_list('id', 'name'))
+        self.all_feature_names = [name for _, name in features]
+        feature_ids = [feature_id for feature_id, _ in features]
+
+        # Scale every property in one batch
+        self.scaler = MinMaxScaler()
+        numerical_block = self.scaler.fit_transform(
+            np.array(numerical, dtype=np.float64).T
         )
-        self.scaler = MinMaxScaler().fit(numerical_features)
 
-        # Precompute and cache feature vectors
-        self.property_vectors = {
-            prop.id: self.property_to_feature_vector(prop)
-            for prop in self.all_properties
+        blocks = {
+            'numerical': csr_matrix(numerical_block, dtype=np.float32),
+            'amenities': csr_matrix(
+                np.array([has_pool, has_garage], dtype=np.float32).T
+            ),
+            'property_type': _one_hot(property_types, len(ids)),
+            'location': _one_hot(location_ids, len(ids)),
+            'features': self._feature_block(feature_ids),
         }
+        self.content_matrix = hstack(
+            [blocks[name] * weight for name, weight in self.BLOCK_WEIGHTS.items()],
+            format='csr',
+            dtype=np.float32,
+        )
+        self.content_matrix.eliminate_zeros()
+
+        norms = np.sqrt(
+            np.asarray(self.content_matrix.multiply(self.content_matrix).sum(axis=1))
+        ).ravel()
+        self.inverse_norms = np.divide(
+            1.0, norms, out=np.zeros_like(norms), where=norms > 0
+        )
+
+        self._build_ann_index()
+
+        # Results per user, invalidated when the user's interactions change
+        self.cache = RecommendationCache.from_settings('content_filtering')
+
+    def save(self, path):
+        save_arrays(
+            path,
+            {
+                'property_ids': self.property_ids,
+                'inverse_norms': self.inverse_norms,
+                **sparse_arrays('content', self.content_matrix),
+                **scaler_arrays('scaler', self.scaler),
+            },
+            {
+                'feature_names': self.all_feature_names,
+                'scaler': scaler_meta(self.scaler),
+            },
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Map a snapshot written by save().
+        """
+        meta = load_meta(path)
+        recommender = cls.__new__(cls)
+        recommender.property_ids = load_array(path, 'property_ids')
+        recommender.property_index = {
+            property_id: row
+            for row, property_id in enumerate(recommender.property_ids.tolist())
+        }
+        recommender.all_feature_names = meta['feature_names']
+        recommender.scaler = load_scaler(path, 'scaler', meta['scaler'])
+        recommender.content_matrix = load_sparse(path, 'content')
+        recommender.inverse_norms = load_array(path, 'inverse_norms')
+        recommender._build_ann_index()
+        recommender.cache = RecommendationCache.from_settings('content_filtering')
+        return recommender
+
+    def _build_ann_index(self):
+        """
+        Optional approximate index over the unit content vectors, see
+        settings.RECOMMENDER_ANN.
+        """
+        self.ann_index = self.unit_matrix = None
+        if ann_options('content_filtering')['ENABLED']:
+            self.unit_matrix = (
+                (diags(self.inverse_norms) @ self.content_matrix)
+                .tocsr()
+                .astype(np.float32)
+            )
+            self.ann_index = IVFIndex.from_settings(
+                'content_filtering', self.unit_matrix
+            )
 
-    def property_to_feature_vector(self, property):
-        # Numerical features
-        numerical_features = np.array(
+    def _feature_block(self, feature_ids):
+        """
+        Multi-hot Feature block loaded from the M2M through table in a
+        single query.
+        """
+        feature_col = {feature_id: col for col, feature_id in enumerate(feature_ids)}
+        links = RealState.features.through.objects.values_list(
+            'realstate_id', 'feature_id'
+        )
+        rows, cols = [], []
+        for property_id, feature_id in links.iterator(chunk_size=20000):
+            row = self.property_index.get(property_id)
+            if row is not None and feature_id in feature_col:
+                rows.append(row)
+                cols.append(feature_col[feature_id])
+        return csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(self.property_ids.size, len(feature_ids)),
+        )
+
+    def get_similar_property_ids(self, user, top_n=10):
+        """
+        Ids of the top_n properties most similar to the user's profile, best
+        first.
+        """
+        user_id = getattr(user, 'id', user)
+        return self.cache.get_or_compute(
+            (user_id, top_n),
+            lambda: self._compute_similar_property_ids(user_id, top_n),
+        )
+
+    def get_similar_properties(self, user, top_n=10):
+        ids = self.get_similar_property_ids(user, top_n)
+        properties = RealState.objects.in_bulk(ids)
+        return [properties[id] for id in ids if id in properties]
+
+    def _profile(self, seen_rows):
+        # Average content vector of the user's properties, and its norm
+        user_avg_vector = np.asarray(
+            self.content_matrix[seen_rows].mean(axis=0)
+        ).ravel()
+        return user_avg_vector, np.linalg.norm(user_avg_vector)
+
+    def _similarities(self, user_avg_vector, user_norm):
+        return (self.content_matrix @ user_avg_vector) * (
+            self.inverse_norms / user_norm
+        )
+
+    def profile_similarities(self, seen_property_ids):
+        """
+        Cosine similarity of every property (in self.property_ids order) to
+        the average content vector of `seen_property_ids`, or None when
+        they give no profile.
+        """
+        seen_rows = np.array(
+            [
+                self.property_index[property_id]
+                for property_id in seen_property_ids
+                if property_id in self.property_index
+            ],
+            dtype=np.intp,
+        )
+        if seen_rows.size == 0:
+            return None
+        user_avg_vector, user_norm = self._profile(seen_rows)
+        if user_norm == 0:
+            return None
+        return self._similarities(user_avg_vector, user_norm)
+
+    def _compute_similar_property_ids(self, user_id, top_n):
+        lap = laps()
+        # Rows of the properties the user interacted with
+        seen_rows = np.array(
             [
-                property.price,
-                property.bedrooms,
-                property.bathrooms,
-                property.sqft,
-            ]
-        ).reshape(1, -1)
-        numerical_features = self.scaler.transform(numerical_features).flatten()
-
-        # Combine all features into a single vector
-        return numerical_features
-
-    @lru_cache(maxsize=128)  # Cache results for frequently accessed users
-    def get_similar_properties(self, user_id, top_n=10):
-        # Fetch user interactions in a single query
-        user_interactions = UserInteraction.objects.filter(
-            user_id=user_id
-        ).select_related('property')
-        user_properties = [interaction.property for interaction in user_interactions]
-
-        if not user_properties:
-            return RealState.objects.none()
-
-        # Compute average feature vector for user's interacted properties
-        user_feature_vectors = np.array(
-            [self.property_vectors[prop.id] for prop in user_properties]
+                self.property_index[property_id]
+                for property_id in UserInteraction.objects.filter(
+                    user_id=user_id
+                ).values_list('property_id', flat=True)
+                if property_id in self.property_index
+            ],
+            dtype=np.intp,
         )
-        user_avg_vector = np.mean(user_feature_vectors, axis=0)
+        lap('fetch')
 
-        # Compute similarity in bulk
-        all_vectors = np.array(list(self.property_vectors.values()))
-        similarities = cosine_similarity([user_avg_vector], all_vectors)[0]
+        if seen_rows.size == 0:
+            return []
 
-        # Attach similarity scores to properties
-        properties_with_similarity = [
-            (prop, similarities[idx])
-            for idx, prop in enumerate(self.all_properties)
-            if similarities[idx] >= 0.7  # Adjust threshold as needed
-        ]
+        user_avg_vector, user_norm = self._profile(seen_rows)
+        if user_norm == 0:
+            return []
 
-        # Sort by similarity and return top N properties
-        properties_with_similarity.sort(key=lambda x: x[1], reverse=True)
-        return [prop for prop, _ in properties_with_similarity[:top_n]]
+        if self.ann_index is not None:
+            unseen = np.ones(self.property_ids.size, dtype=bool)
+            unseen[seen_rows] = False
+            found = self.ann_index.search(
+                self.unit_matrix, user_avg_vector / user_norm, top_n, unseen
+            )
+            lap('similarity')
+            if found is not None:
+                rows, similarities = found
+                return self.property_ids[
+                    rows[similarities >= self.SIMILARITY_THRESHOLD]
+                ].tolist()
+
+        # Cosine similarity as one sparse-dense product
+        similarities = self._similarities(user_avg_vector, user_norm)
+        lap('similarity')
+
+        # Unseen properties above the similarity threshold
+        mask = similarities >= self.SIMILARITY_THRESHOLD
+        mask[seen_rows] = False
+        candidates = np.flatnonzero(mask)
+
+        best = candidates[top_n_indices(similarities[candidates], top_n)]
+        lap('rank')
+        return self.property_ids[best].tolist()
+
+    def get_batch_similar_property_ids(self, user_ids, top_n=10, with_scores=False):
+        """
+        get_similar_property_ids for many users at once, in the order of
+        `user_ids`; with_scores=True returns (ids, scores) pairs.
+
+        The users' interactions are read in one query and their profiles
+        are scored against every property with one sparse-dense product
+        per block of BATCH_BLOCK_SIZE users.
+        """
+        requested = list(user_ids)
+        user_ids = list(dict.fromkeys(requested))
+        position = {user_id: row for row, user_id in enumerate(user_ids)}
+        rows, cols = [], []
+        interactions = UserInteraction.objects.filter(user_id__in=user_ids)
+        for user_id, property_id in interactions.values_list('user_id', 'property_id'):
+            col = self.property_index.get(property_id)
+            if col is not None:
+                rows.append(position[user_id])
+                cols.append(col)
+        seen = csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(len(user_ids), self.property_ids.size),
+        )
+        seen.sort_indices()
+
+        # Average content vector of each user's properties
+        counts = np.diff(seen.indptr)
+        averages = diags(
+            np.divide(1.0, counts, out=np.zeros(counts.size), where=counts > 0)
+        )
+        profiles = (averages @ seen @ self.content_matrix).toarray()
+        profile_norms = np.linalg.norm(profiles, axis=1)
+
+        results = []
+        for start in range(0, len(user_ids), self.BATCH_BLOCK_SIZE):
+            block = slice(start, start + self.BATCH_BLOCK_SIZE)
+            # (properties x users) cosine similarities
+            similarities = (self.content_matrix @ profiles[block].T) * (
+                self.inverse_norms[:, None]
+                / np.where(profile_norms[block] > 0, profile_norms[block], np.inf)
+            )
+            for column, row in enumerate(range(len(user_ids))[block]):
+                if profile_norms[row] == 0:
+                    results.append(([], []) if with_scores else [])
+                    continue
+                mask = similarities[:, column] >= self.SIMILARITY_THRESHOLD
+                mask[seen.indices[seen.indptr[row] : seen.indptr[row + 1]]] = False
+                candidates = np.flatnonzero(mask)
+                best = candidates[
+                    top_n_indices(similarities[candidates, column], top_n)
+                ]
+                ids = self.property_ids[best].tolist()
+                if with_scores:
+                    results.append((ids, similarities[best, column].tolist()))
+                else:
+                    results.append(ids)
+        by_user = dict(zip(user_ids, results))
+        return [by_user[user_id] for user_id in requested]
 
 
 # Singleton pattern for the recommender
 content_filtering_recommender = None
 
+content_filtering_slot = EngineSlot('content_filtering', ContentFiltering)
+
 
-def get_content_filtering_recommender():
+def get_content_filtering_recommender(wait=True):
+    """
+    The process's engine; with wait=False None until it has been built.
+    """
     global content_filtering_recommender
-    if content_filtering_recommender is None:
-        content_filtering_recommender = ContentFiltering()
+    content_filtering_recommender = content_filtering_slot.get(wait)
     return content_filtering_recommender
@@ -1,77 +1,172 @@
-import pandas as pd
+import threading
+
 import numpy as np
+import pandas as pd
 from sklearn.preprocessing import MinMaxScaler
-from sklearn.metrics.pairwise import cosine_similarity
 
 from real_state.models import RealState
 
+from .ann import IVFIndex
+from .cache import RowCache
+from .constraint_index import ConstraintIndex
+from .metrics import laps
+from .property_store import PropertyStore
+from .ranking import top_n_indices
+from .scoring import cosine_scores, unit_rows
+from .snapshots import (
+    EngineSlot,
+    load_meta,
+    load_scaler,
+    save_arrays,
+    scaler_arrays,
+    scaler_meta,
+)
+
+# Columns kept in memory, with their types; prices and areas stay float64
+# so budgets are compared with the exact stored value (float32 rounds to
+# even units above 2 ** 24)
+COLUMN_DTYPES = {
+    'price': np.float64,
+    'bedrooms': np.int32,
+    'bathrooms': np.int32,
+    'sqft': np.float64,
+    'year_built': np.int32,
+    'parking_spaces': np.int32,
+}
+
+FEATURE_COLUMNS = list(COLUMN_DTYPES)
+
+# Full records of recently recommended properties
+record_cache = RowCache.from_settings('property_records')
+
+# Preference keys, in the order of FEATURE_COLUMNS
+PREFERENCE_KEYS = [
+    'budget',
+    'min_bedrooms',
+    'min_bathrooms',
+    'preferred_sqft',
+    'min_year_built',
+    'parking_spaces',
+]
+
+
+def property_records(property_ids):
+    """
+    RealState.objects.values() records of the given properties as a
+    DataFrame, in order; unknown ids are skipped. Records missing from the
+    hot-record cache are fetched together in one query.
+    """
+    property_ids = list(property_ids)
+    rows = record_cache.get_many(property_ids)
+    missing = [property_id for property_id in property_ids if property_id not in rows]
+    if missing:
+        fetched = {
+            row['id']: row for row in RealState.objects.filter(id__in=missing).values()
+        }
+        record_cache.set_many(fetched)
+        rows.update(fetched)
+    return pd.DataFrame(
+        [rows[property_id] for property_id in property_ids if property_id in rows]
+    )
+
 
 class RealEstateRecommender:
     def __init__(self):
         self.scaler = MinMaxScaler()
-        self.properties_df = None
-        self.features_matrix = None
+        self.store = None
+        self.constraint_index = None
+        self._index_lock = threading.Lock()
         self.load_properties()
 
     def load_properties(self):
         """
         Load and preprocess property data
         """
-        queryset = RealState.objects.all()
-
-        # Convert the queryset to a Pandas DataFrame
-        properties_data = pd.DataFrame(list(queryset.values()))
+        # Only the id and the numerical columns; full records are fetched
+        # for the recommended properties alone
+        rows = list(RealState.objects.values_list('id', *FEATURE_COLUMNS))
 
-        # Ensure the DataFrame is not empty
-        if properties_data.empty:
+        # Ensure the queryset is not empty
+        if not rows:
             raise ValueError("No property data found in the database.")
 
-        # Store the properties DataFrame
-        self.properties_df = properties_data
-
-        # Select numerical features for similarity calculation
-        feature_columns = [
-            'price',
-            'bedrooms',
-            'bathrooms',
-            'sqft',
-            'year_built',
-            'parking_spaces',
-        ]
+        ids, *columns = zip(*rows)
+        raw_features = np.array(columns, dtype=np.float64).T
+
+        # Normalize features to 0-1 range, then to unit rows so scoring is a
+        # plain dot product
+        features = unit_rows(self.scaler.fit_transform(raw_features))
 
-        # Normalize features to 0-1 range
-        self.features_matrix = self.scaler.fit_transform(
-            self.properties_df[feature_columns]
+        self.store = PropertyStore(
+            COLUMN_DTYPES, len(FEATURE_COLUMNS), feature_dtype=np.float32
+        )
+        self.store.extend(
+            np.array(ids, dtype=np.int64),
+            dict(zip(FEATURE_COLUMNS, raw_features.T)),
+            features,
+        )
+        self.constraint_index = ConstraintIndex(self.store.snapshot())
+        self._build_ann_index(self.store.snapshot())
+
+    def save(self, path):
+        save_arrays(
+            path,
+            {**self.store.snapshot_arrays(), **scaler_arrays('scaler', self.scaler)},
+            {'scaler': scaler_meta(self.scaler)},
         )
 
+    @classmethod
+    def load(cls, path):
+        """
+        Map a snapshot written by save(), then apply properties added or
+        deleted in the database since.
+        """
+        meta = load_meta(path)
+        recommender = cls.__new__(cls)
+        recommender.scaler = load_scaler(path, 'scaler', meta['scaler'])
+        recommender.store = PropertyStore.load(
+            path, COLUMN_DTYPES, len(FEATURE_COLUMNS), feature_dtype=np.float32
+        )
+        recommender._index_lock = threading.Lock()
+        recommender._sync_property_ids()
+        recommender.constraint_index = ConstraintIndex(recommender.store.snapshot())
+        recommender._build_ann_index(recommender.store.snapshot())
+        return recommender
+
+    def _sync_property_ids(self):
+        # RealState has no modification time, so only additions and
+        # deletions can be detected; edits wait for the next build.
+        stored_ids = set(self.store.snapshot().ids.tolist())
+        current_ids = set(RealState.objects.values_list('id', flat=True))
+        for property_id in stored_ids - current_ids:
+            self.store.remove(property_id)
+        added_ids = current_ids - stored_ids
+        if added_ids:
+            for property_data in RealState.objects.filter(id__in=added_ids).values(
+                'id', *FEATURE_COLUMNS
+            ):
+                self.add_property(property_data)
+
     def add_property(self, property_data):
         """
-        Add a new property to the recommendation system.
+        Add a new property to the recommendation system, replacing any
+        existing entry with the same id.
 
         Parameters:
-        property_data: dict with keys matching RealState fields
+        property_data: dict with the id and FEATURE_COLUMNS of the property;
+        other RealState fields are ignored
         """
-        # Convert the property data to a DataFrame
-        new_property_df = pd.DataFrame([property_data])
-
-        # Append to properties DataFrame
-        self.properties_df = pd.concat(
-            [self.properties_df, new_property_df], ignore_index=True
+        raw_features = np.array(
+            [[property_data[column] for column in FEATURE_COLUMNS]],
+            dtype=np.float64,
         )
 
         # Normalize features of the new property
-        feature_columns = [
-            'price',
-            'bedrooms',
-            'bathrooms',
-            'sqft',
-            'year_built',
-            'parking_spaces',
-        ]
-        new_features = self.scaler.transform(new_property_df[feature_columns])
+        features = unit_rows(self.scaler.transform(raw_features))
 
-        # Append normalized features to the features matrix
-        self.features_matrix = np.vstack([self.features_matrix, new_features])
+        self.store.add(
+            property_data['id'], dict(zip(FEATURE_COLUMNS, raw_features[0])), features
+        )
 
     def remove_property(self, property_id):
         """
@@ -80,23 +175,63 @@ class RealEstateRecommender:
         Parameters:
         property_id: int, unique identifier of the property
         """
-        # Find the index of the property to remove
-        index_to_remove = self.properties_df[
-            self.properties_df['id'] == property_id
-        ].index
-
-        if not index_to_remove.empty:
-            # Drop the property from properties DataFrame
-            self.properties_df = self.properties_df.drop(
-                index=index_to_remove
-            ).reset_index(drop=True)
+        self.store.remove(property_id)
 
-            # Remove the corresponding row from the features matrix
-            self.features_matrix = np.delete(
-                self.features_matrix, index_to_remove, axis=0
-            )
-        else:
-            pass
+    def _constraint_index(self, properties):
+        """
+        The constraint index for this snapshot, rebuilt once it is stale.
+        """
+        index = self.constraint_index
+        if index.stale(properties):
+            with self._index_lock:
+                index = self.constraint_index
+                if index.stale(properties):
+                    index = ConstraintIndex(properties)
+                    self.constraint_index = index
+        return index
+
+    def _build_ann_index(self, properties):
+        # Optional approximate index, see settings.RECOMMENDER_ANN
+        self.ann_index = IVFIndex.from_settings('real_state', properties.features)
+        self.ann_generation = properties.generation
+
+    def _ann_index(self, properties):
+        """
+        The ANN index for this snapshot, rebuilt after compaction renumbers
+        the rows or once many properties were added. None when disabled.
+        """
+        index = self.ann_index
+        if index is not None and (
+            self.ann_generation != properties.generation
+            or index.stale(properties.ids.size)
+        ):
+            with self._index_lock:
+                if self.ann_index is index:
+                    self._build_ann_index(properties)
+                index = self.ann_index
+        return index
+
+    def _preference_vectors(self, preferences_list):
+        """
+        Unit preference vectors, one row per preference dict, normalized
+        with the fitted scaler's parameters.
+        """
+        vectors = np.array(
+            [
+                [preferences[key] for key in PREFERENCE_KEYS]
+                for preferences in preferences_list
+            ],
+            dtype=np.float64,
+        )
+        return unit_rows(vectors * self.scaler.scale_ + self.scaler.min_)
+
+    def _candidates(self, properties, user_preferences):
+        return self._constraint_index(properties).candidates(
+            properties,
+            user_preferences['budget'],
+            user_preferences['min_bedrooms'],
+            user_preferences['min_bathrooms'],
+        )
 
     def get_recommendations(self, user_preferences, num_recommendations=5):
         """
@@ -115,53 +250,93 @@ class RealEstateRecommender:
         Returns:
         DataFrame with recommended properties
         """
-        # Create preference vector
-        pref_vector = np.array(
-            [
-                user_preferences['budget'],
-                user_preferences['min_bedrooms'],
-                user_preferences['min_bathrooms'],
-                user_preferences['preferred_sqft'],
-                user_preferences['min_year_built'],
-                user_preferences['parking_spaces'],
-            ]
-        ).reshape(1, -1)
-
-        # Normalize preferences using the same scaler
-        pref_vector_normalized = self.scaler.transform(pref_vector)
-
-        # Calculate similarity scores
-        similarity_scores = cosine_similarity(
-            self.features_matrix, pref_vector_normalized
-        ).flatten()
-
-        # Apply hard constraints
-        mask = (
-            (self.properties_df['price'] <= user_preferences['budget'])
-            & (self.properties_df['bedrooms'] >= user_preferences['min_bedrooms'])
-            & (self.properties_df['bathrooms'] >= user_preferences['min_bathrooms'])
+        lap = laps()
+        # Create the normalized preference vector
+        pref_vector_normalized = self._preference_vectors([user_preferences])[0]
+
+        properties = self.store.snapshot()
+
+        # Apply hard constraints before scoring
+        valid_indices = self._candidates(properties, user_preferences)
+        lap('filter')
+
+        if valid_indices.size == 0:
+            return pd.DataFrame()
+
+        ann_index = self._ann_index(properties)
+        if ann_index is not None and ann_index.worthwhile(valid_indices.size):
+            allowed = np.zeros(properties.ids.size, dtype=bool)
+            allowed[valid_indices] = True
+            found = ann_index.search(
+                properties.features,
+                pref_vector_normalized,
+                num_recommendations,
+                allowed,
+            )
+            lap('similarity')
+            # Too few candidates in the probed lists: score exactly below
+            if found is not None:
+                recommendations = property_records(properties.ids[found[0]].tolist())
+                lap('records')
+                return recommendations
+
+        # Calculate similarity scores for the candidates only
+        similarity_scores = cosine_scores(
+            properties.features, pref_vector_normalized, valid_indices
         )
+        lap('similarity')
 
-        # Get indices of properties that meet constraints
-        valid_indices = np.where(mask)[0]
-
-        # Sort by similarity score
+        # Select the best candidates by similarity score
         recommended_indices = valid_indices[
-            np.argsort(-similarity_scores[valid_indices])[:num_recommendations]
+            top_n_indices(similarity_scores, num_recommendations)
         ]
+        lap('rank')
 
-        # Get recommendations and format output
-        recommendations = self.properties_df.iloc[recommended_indices].copy()
+        # Fetch the full records of the recommended properties only
+        recommendations = property_records(properties.ids[recommended_indices].tolist())
+        lap('records')
 
         return recommendations
 
+    def get_batch_recommended_ids(self, preferences_list, num_recommendations=5):
+        """
+        Ids recommended for each of several preference dicts, best first.
+
+        The candidates of all preferences are scored together with one
+        matrix-matrix product instead of one product per preference.
+        """
+        if not preferences_list:
+            return []
+        queries = self._preference_vectors(preferences_list)
+        properties = self.store.snapshot()
+        candidates = [
+            self._candidates(properties, preferences)
+            for preferences in preferences_list
+        ]
+
+        # (candidate rows x preferences) scores
+        rows = np.unique(np.concatenate(candidates))
+        scores = properties.features[rows] @ queries.T
+
+        results = []
+        for column, valid_indices in enumerate(candidates):
+            candidate_scores = scores[np.searchsorted(rows, valid_indices), column]
+            best = valid_indices[top_n_indices(candidate_scores, num_recommendations)]
+            results.append(properties.ids[best].tolist())
+        return results
+
 
 real_state_recommender = None
 
+real_state_slot = EngineSlot('real_state', RealEstateRecommender)
+
 
-def get_real_state_recommender():
+def get_real_state_recommender(wait=True):
+    """
+    The process's engine; with wait=False None until it has been built.
+    """
     global real_state_recommender
-    if real_state_recommender is None:
-        # Initialize the recommender here (only when accessed)
-        real_state_recommender = RealEstateRecommender()
+    # Loaded on first access, then swapped when a new model version is
+    # published
+    real_state_recommender = real_state_slot.get(wait)
     return real_state_recommender
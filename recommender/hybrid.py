@@ -0,0 +1,179 @@
+import numpy as np
+from django.conf import settings
+
+from .collaborative_filtering import (
+    get_item_based_recommender,
+    get_user_based_recommender,
+)
+from .content_based_filtering import get_content_filtering_recommender
+from .metrics import laps
+from .ranking import top_n_indices
+
+# Engines blended by HybridRecommender
+HYBRID_ENGINES = ('content_filtering', 'user_based_cf', 'item_based_cf')
+
+HYBRID_DEFAULTS = {
+    'WEIGHTS': {'content': 0.2, 'user_cf': 0.4, 'item_cf': 0.4},
+    # Unseen properties most similar to the profile added to the candidates
+    'CONTENT_CANDIDATES': 100,
+}
+
+
+def hybrid_options():
+    """
+    HYBRID_DEFAULTS overridden by settings.RECOMMENDER_HYBRID.
+    """
+    return {**HYBRID_DEFAULTS, **getattr(settings, 'RECOMMENDER_HYBRID', {})}
+
+
+def _scaled(scores):
+    # Components have different ranges; the best candidate of each scores 1
+    peak = scores.max() if scores.size else 0.0
+    return scores / peak if peak > 0 else scores
+
+
+class HybridRecommender:
+    """
+    Blends the content, user-based CF and item-based CF engines of this
+    process in one pass per request.
+
+    The user's interaction row is read once, from the user-based engine.
+    The candidates are the unseen properties rated by the user's
+    neighbours, the unseen neighbours of the user's properties and the
+    `content_candidates` unseen properties most similar to the user's
+    content profile, above the content engine's similarity threshold.
+    Every component is scored as a vector over that shared candidate set,
+    scaled to a maximum of 1 and weighted by `weights`; one top-N then
+    ranks the blend. A user without candidates gets the ranking of the
+    most heavily weighted engine, that is its own fallback.
+    """
+
+    def __init__(self, content, user_cf, item_cf, weights, content_candidates=100):
+        self.content = content
+        self.user_cf = user_cf
+        self.item_cf = item_cf
+        self.weights = weights
+        self.content_candidates = content_candidates
+
+    def _user_cf_scores(self, user_row, items, ratings):
+        interactions = self.user_cf.interactions
+        seen = np.zeros(interactions.n_properties, dtype=bool)
+        seen[items] = True
+        cols, scores = self.user_cf.predicted_ratings(user_row, items, ratings, seen)
+        return interactions.property_ids[cols], scores
+
+    def _item_cf_scores(self, seen_ids, ratings):
+        # The item-based engine keeps its own columns
+        interactions = self.item_cf.interactions
+        cols = [interactions.property_col(property_id) for property_id in seen_ids]
+        known = np.array([col is not None for col in cols], dtype=bool)
+        items = np.array([col for col in cols if col is not None], dtype=np.intp)
+        seen = np.zeros(interactions.n_properties, dtype=bool)
+        seen[items] = True
+        cols, scores = self.item_cf.predicted_scores(items, ratings[known], seen)
+        return interactions.property_ids[cols], scores
+
+    def _content_scores(self, seen_ids, top_n):
+        """
+        (similarities, pool ids): similarity of every property of the
+        content engine to the profile, 0 below the engine's threshold, and
+        the unseen ones most similar.
+        """
+        similarities = self.content.profile_similarities(seen_ids)
+        if similarities is None:
+            return None, np.empty(0, dtype=np.int64)
+        similarities = np.where(
+            similarities >= self.content.SIMILARITY_THRESHOLD, similarities, 0.0
+        )
+        candidates = similarities.copy()
+        for property_id in seen_ids:
+            row = self.content.property_index.get(property_id)
+            if row is not None:
+                candidates[row] = 0.0
+        pool = top_n_indices(candidates, max(self.content_candidates, top_n))
+        pool = pool[candidates[pool] > 0]
+        return similarities, self.content.property_ids[pool]
+
+    def _fallback_ids(self, user, top_n):
+        # The engine with the largest weight; the first one on a tie
+        name = max(
+            ('content', 'user_cf', 'item_cf'),
+            key=lambda name: self.weights.get(name, 0),
+        )
+        if name == 'content':
+            return self.content.get_similar_property_ids(user, top_n)
+        return getattr(self, name).get_recommended_ids(user, top_n)
+
+    def get_recommended_ids(self, user, top_n=10):
+        """
+        Ids of the top_n properties with the best blended score, best first.
+        """
+        lap = laps()
+        interactions = self.user_cf.interactions
+        user_row = interactions.user_row(getattr(user, 'id', user))
+        if user_row is None:
+            return []
+        items, ratings = interactions.row(user_row)
+        if items.size == 0:
+            return []
+        seen_ids = interactions.property_ids[items]
+        lap('fetch')
+
+        # (ids, scores) of the CF components; zero weights are not scored
+        components = {}
+        if self.weights.get('user_cf'):
+            components['user_cf'] = self._user_cf_scores(user_row, items, ratings)
+        if self.weights.get('item_cf'):
+            components['item_cf'] = self._item_cf_scores(seen_ids, ratings)
+        similarities, pool = None, np.empty(0, dtype=np.int64)
+        if self.weights.get('content'):
+            similarities, pool = self._content_scores(seen_ids, top_n)
+        lap('similarity')
+
+        candidates = np.unique(
+            np.concatenate([pool] + [ids for ids, _ in components.values()])
+        )
+        if candidates.size == 0:
+            # No neighbours and no profile
+            return self._fallback_ids(user, top_n)
+
+        blended = np.zeros(candidates.size)
+        for name, (ids, scores) in components.items():
+            vector = np.zeros(candidates.size)
+            vector[np.searchsorted(candidates, ids)] = scores
+            blended += self.weights[name] * _scaled(vector)
+        if similarities is not None:
+            rows = np.array(
+                [
+                    self.content.property_index.get(property_id, -1)
+                    for property_id in candidates.tolist()
+                ],
+                dtype=np.intp,
+            )
+            vector = np.where(rows >= 0, similarities[rows], 0.0)
+            blended += self.weights['content'] * _scaled(vector)
+        lap('blend')
+
+        best = candidates[top_n_indices(blended, top_n)]
+        lap('rank')
+        return best.tolist()
+
+
+def get_hybrid_recommender(wait=True):
+    """
+    A HybridRecommender over the process's engines; with wait=False None
+    until all three have been built.
+    """
+    engines = (
+        get_content_filtering_recommender(wait),
+        get_user_based_recommender(wait),
+        get_item_based_recommender(wait),
+    )
+    if any(engine is None for engine in engines):
+        return None
+    options = hybrid_options()
+    return HybridRecommender(
+        *engines,
+        weights=options['WEIGHTS'],
+        content_candidates=options['CONTENT_CANDIDATES'],
+    )
@@ -0,0 +1,184 @@
+from datetime import datetime, timezone
+from itertools import islice
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from django.db.models import Max
+
+from real_state.models import UserInteraction
+
+from .models import InteractionChange
+
+INTERACTION_WEIGHTS = {'view': 1, 'like': 2, 'save': 3}
+
+DEFAULT_CHUNK_SIZE = 20000
+
+
+class InteractionArrays:
+    """
+    Columnar form of the UserInteraction table.
+
+    Interaction k links user_ids[user_rows[k]] to
+    property_ids[property_cols[k]] with weight weights[k]. user_ids and
+    property_ids are sorted, so row/column indices are stable for a given
+    set of ids. timestamps[k] is its creation time when loaded with
+    with_timestamps=True.
+    """
+
+    def __init__(
+        self, user_ids, property_ids, user_rows, property_cols, weights, timestamps=None
+    ):
+        self.user_ids = user_ids
+        self.property_ids = property_ids
+        self.user_rows = user_rows
+        self.property_cols = property_cols
+        self.weights = weights
+        # Creation times in seconds since the epoch, if loaded
+        self.timestamps = timestamps
+
+    def __len__(self):
+        return self.weights.size
+
+    @property
+    def shape(self):
+        return (self.user_ids.size, self.property_ids.size)
+
+    def to_csr(self, dtype=np.float64):
+        """
+        Build the user x property weight matrix.
+        """
+        matrix = csr_matrix(
+            (self.weights.astype(dtype), (self.user_rows, self.property_cols)),
+            shape=self.shape,
+        )
+        matrix.eliminate_zeros()
+        return matrix
+
+
+def iter_interaction_chunks(
+    chunk_size=DEFAULT_CHUNK_SIZE, since=None, with_timestamps=False
+):
+    """
+    Stream (user_ids, property_ids, weights, timestamps) NumPy arrays of at
+    most chunk_size interactions each, created at or after `since` (seconds
+    since the epoch) if given. timestamps is None unless with_timestamps.
+
+    Rows come from a server-side cursor over values_list, so no model
+    instances or related objects are created.
+    """
+    queryset = UserInteraction.objects.all()
+    if since is not None:
+        queryset = queryset.filter(
+            timestamp__gte=datetime.fromtimestamp(since, tz=timezone.utc)
+        )
+    fields = ['user_id', 'property_id', 'interaction_type']
+    if with_timestamps:
+        fields.append('timestamp')
+    rows = queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        user_ids, property_ids, interaction_types, *timestamps = zip(*chunk)
+        yield (
+            np.fromiter(user_ids, dtype=np.int64, count=len(chunk)),
+            np.fromiter(property_ids, dtype=np.int64, count=len(chunk)),
+            np.fromiter(
+                (INTERACTION_WEIGHTS.get(t, 0) for t in interaction_types),
+                dtype=np.float32,
+                count=len(chunk),
+            ),
+            (
+                np.fromiter(
+                    (t.timestamp() for t in timestamps[0]),
+                    dtype=np.float64,
+                    count=len(chunk),
+                )
+                if with_timestamps
+                else None
+            ),
+        )
+
+
+def load_interactions(chunk_size=DEFAULT_CHUNK_SIZE, since=None, with_timestamps=False):
+    """
+    Load every interaction (created at or after `since`, if given) into an
+    InteractionArrays.
+    """
+    user_chunks, property_chunks, weight_chunks, timestamp_chunks = [], [], [], []
+    for user_ids, property_ids, weights, timestamps in iter_interaction_chunks(
+        chunk_size, since, with_timestamps
+    ):
+        user_chunks.append(user_ids)
+        property_chunks.append(property_ids)
+        weight_chunks.append(weights)
+        timestamp_chunks.append(timestamps)
+
+    if not weight_chunks:
+        empty = np.empty(0, dtype=np.int64)
+        return InteractionArrays(
+            empty,
+            empty,
+            np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=np.float32),
+            np.empty(0, dtype=np.float64) if with_timestamps else None,
+        )
+
+    user_ids, user_rows = np.unique(np.concatenate(user_chunks), return_inverse=True)
+    property_ids, property_cols = np.unique(
+        np.concatenate(property_chunks), return_inverse=True
+    )
+    return InteractionArrays(
+        user_ids,
+        property_ids,
+        user_rows.astype(np.int32),
+        property_cols.astype(np.int32),
+        np.concatenate(weight_chunks),
+        np.concatenate(timestamp_chunks) if with_timestamps else None,
+    )
+
+
+def change_mark():
+    """
+    Id of the latest InteractionChange, 0 if there is none.
+    """
+    return InteractionChange.objects.aggregate(mark=Max('id'))['mark'] or 0
+
+
+def changes_since(mark, batch_size=500):
+    """
+    (new mark, changes) of the cells logged in InteractionChange after
+    entry `mark`. Changes are (user_id, property_id, weight, created) with
+    the cell's current weight and creation time, or weight 0 and None for
+    cells deleted since. Only the interactions of the changed users are
+    read.
+    """
+    entries = list(
+        InteractionChange.objects.filter(id__gt=mark).values_list(
+            'id', 'user_id', 'property_id'
+        )
+    )
+    if not entries:
+        return mark, []
+    cells = {(user_id, property_id) for _, user_id, property_id in entries}
+    user_ids = sorted({user_id for user_id, _ in cells})
+
+    current = {}
+    for start in range(0, len(user_ids), batch_size):
+        rows = UserInteraction.objects.filter(
+            user_id__in=user_ids[start : start + batch_size]
+        ).values_list('user_id', 'property_id', 'interaction_type', 'timestamp')
+        for user_id, property_id, interaction_type, timestamp in rows:
+            if (user_id, property_id) in cells:
+                current[user_id, property_id] = (
+                    INTERACTION_WEIGHTS.get(interaction_type, 0),
+                    timestamp.timestamp(),
+                )
+    changes = [
+        (user_id, property_id, *current.get((user_id, property_id), (0, None)))
+        for user_id, property_id in sorted(cells)
+    ]
+    return max(entry[0] for entry in entries), changes
@@ -0,0 +1,383 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from .metrics import update_seconds
+from .snapshots import load_array, load_sparse, sparse_arrays
+
+
+def grow(array, size, fill=0):
+    """
+    Return `array` if it has at least `size` rows, otherwise a copy with
+    doubled capacity whose new rows are set to `fill`.
+    """
+    if array.shape[0] >= size:
+        return array
+    capacity = max(size, 2 * array.shape[0], 16)
+    grown = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+    grown[: array.shape[0]] = array
+    return grown
+
+
+class UpdateTimer:
+    """
+    Records the wall time of each incremental update of engine `name` in
+    the recommender_update_seconds histogram of /metrics.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    @contextmanager
+    def measure(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            update_seconds.observe((self.name,), time.perf_counter() - start)
+
+
+class InteractionMatrix:
+    """
+    User x property weight matrix that accepts in-place cell updates.
+
+    Reads combine a CSR (by user) and CSC (by property) base with a small
+    overlay of pending cell changes. Once the overlay holds `max_pending`
+    cells it is merged into the base, so a single update costs O(1)
+    dictionary work and the O(nnz) merge is amortized over `max_pending`
+    updates. A weight of 0 means the cell is absent.
+
+    Per-property interaction counts and weight sums and per-user squared
+    weight sums are maintained incrementally.
+    """
+
+    def __init__(self, user_ids, property_ids, matrix, max_pending=10000):
+        csr = csr_matrix(matrix, dtype=np.float64)
+        csr.eliminate_zeros()
+        csc = csr.tocsc()
+        self._setup(
+            user_ids,
+            property_ids,
+            csr,
+            csc,
+            item_counts=np.diff(csc.indptr).astype(np.int64),
+            item_weight_sums=np.asarray(csc.sum(axis=0)).ravel(),
+            user_sq_sums=np.asarray(csr.multiply(csr).sum(axis=1)).ravel(),
+            max_pending=max_pending,
+        )
+
+    def _setup(
+        self,
+        user_ids,
+        property_ids,
+        csr,
+        csc,
+        item_counts,
+        item_weight_sums,
+        user_sq_sums,
+        max_pending,
+    ):
+        self.max_pending = max_pending
+        self._lock = threading.RLock()
+
+        self._user_ids = np.asarray(user_ids, dtype=np.int64)
+        self._property_ids = np.asarray(property_ids, dtype=np.int64)
+        self.n_users = self._user_ids.size
+        self.n_properties = self._property_ids.size
+        self._user_index = {
+            user_id: row for row, user_id in enumerate(self._user_ids.tolist())
+        }
+        self._property_index = {
+            property_id: col
+            for col, property_id in enumerate(self._property_ids.tolist())
+        }
+
+        self._csr = csr
+        self._csc = csc
+        self._row_patches = {}
+        self._col_patches = {}
+        self.pending = 0
+
+        self._item_counts = item_counts
+        self._item_weight_sums = item_weight_sums
+        self._user_sq_sums = user_sq_sums
+
+    @classmethod
+    def load(cls, path, max_pending=10000):
+        """
+        Map a matrix saved with snapshot_arrays() from snapshot `path`.
+        """
+        matrix = cls.__new__(cls)
+        matrix._setup(
+            load_array(path, 'user_ids'),
+            load_array(path, 'property_ids'),
+            load_sparse(path, 'csr', 'csr'),
+            load_sparse(path, 'csc', 'csc'),
+            item_counts=load_array(path, 'item_counts'),
+            item_weight_sums=load_array(path, 'item_weight_sums'),
+            user_sq_sums=load_array(path, 'user_sq_sums'),
+            max_pending=max_pending,
+        )
+        return matrix
+
+    def snapshot_arrays(self):
+        """
+        The arrays to save for load(); pending changes are merged first.
+        """
+        with self._lock:
+            self.compact()
+            return {
+                'user_ids': self.user_ids,
+                'property_ids': self.property_ids,
+                'item_counts': self.item_counts,
+                'item_weight_sums': self.item_weight_sums,
+                'user_sq_sums': self._user_sq_sums[: self.n_users],
+                **sparse_arrays('csr', self._csr),
+                **sparse_arrays('csc', self._csc),
+            }
+
+    @classmethod
+    def from_interactions(cls, interactions, **kwargs):
+        """
+        Build from an interaction_loader.InteractionArrays.
+        """
+        return cls(
+            interactions.user_ids,
+            interactions.property_ids,
+            interactions.to_csr(),
+            **kwargs,
+        )
+
+    @property
+    def user_ids(self):
+        return self._user_ids[: self.n_users]
+
+    @property
+    def property_ids(self):
+        return self._property_ids[: self.n_properties]
+
+    @property
+    def item_counts(self):
+        return self._item_counts[: self.n_properties]
+
+    @property
+    def item_weight_sums(self):
+        return self._item_weight_sums[: self.n_properties]
+
+    @property
+    def user_norms(self):
+        return np.sqrt(self._user_sq_sums[: self.n_users])
+
+    def user_row(self, user_id):
+        return self._user_index.get(user_id)
+
+    def property_col(self, property_id):
+        return self._property_index.get(property_id)
+
+    def _merge(self, positions, indices, weights, keys, patches, width):
+        """
+        Apply overlay `patches` (one dict per requested key) on top of base
+        entries given as (positions, indices, weights).
+        """
+        if not patches:
+            return positions, indices, weights
+
+        patch_positions, patch_indices, patch_weights = [], [], []
+        patched = np.isin(keys, np.fromiter(patches.keys(), dtype=np.int64))
+        for position in np.flatnonzero(patched).tolist():
+            for index, weight in patches[int(keys[position])].items():
+                patch_positions.append(position)
+                patch_indices.append(index)
+                patch_weights.append(weight)
+
+        if not patch_positions:
+            return positions, indices, weights
+
+        patch_positions = np.array(patch_positions, dtype=np.int64)
+        patch_indices = np.array(patch_indices, dtype=np.int64)
+        patch_weights = np.array(patch_weights, dtype=np.float64)
+
+        # Patched cells replace their base entries
+        overridden = np.isin(
+            positions.astype(np.int64) * width + indices,
+            patch_positions * width + patch_indices,
+        )
+        present = patch_weights != 0
+        return (
+            np.concatenate([positions[~overridden], patch_positions[present]]),
+            np.concatenate([indices[~overridden], patch_indices[present]]),
+            np.concatenate([weights[~overridden], patch_weights[present]]),
+        )
+
+    def _slice(self, base, keys):
+        """
+        COO entries of the given major-axis keys of `base`; keys beyond the
+        base shape (added since the last merge) have no base entries.
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        by_row = base is self._csr
+        in_base = np.flatnonzero(keys < base.shape[0 if by_row else 1])
+        if by_row:
+            block = base[keys[in_base]].tocoo()
+            return in_base[block.row], block.col.astype(np.int64), block.data
+        block = base[:, keys[in_base]].tocoo()
+        return in_base[block.col], block.row.astype(np.int64), block.data
+
+    def rows(self, user_rows):
+        """
+        Entries of the given users as (positions into user_rows,
+        property columns, weights).
+        """
+        with self._lock:
+            positions, cols, weights = self._slice(self._csr, user_rows)
+            return self._merge(
+                positions,
+                cols,
+                weights,
+                np.asarray(user_rows, dtype=np.int64),
+                self._row_patches,
+                self.n_properties,
+            )
+
+    def columns(self, property_cols):
+        """
+        Entries of the given properties as (user rows, positions into
+        property_cols, weights).
+        """
+        with self._lock:
+            positions, rows, weights = self._slice(self._csc, property_cols)
+            positions, rows, weights = self._merge(
+                positions,
+                rows,
+                weights,
+                np.asarray(property_cols, dtype=np.int64),
+                self._col_patches,
+                self.n_users,
+            )
+            return rows, positions, weights
+
+    def row(self, user_row):
+        """
+        (property columns, weights) of a single user.
+        """
+        _, cols, weights = self.rows([user_row])
+        return cols, weights
+
+    def rows_csr(self, user_rows):
+        """
+        The given users' rows as a (len(user_rows) x properties) CSR matrix.
+        """
+        positions, cols, weights = self.rows(user_rows)
+        return csr_matrix(
+            (weights, (positions, cols)),
+            shape=(len(user_rows), self.n_properties),
+        )
+
+    def to_csr(self):
+        """
+        The full merged matrix. Must not be modified; with no pending
+        changes it is the base matrix itself.
+        """
+        with self._lock:
+            if not self._row_patches and self._csr.shape == (
+                self.n_users,
+                self.n_properties,
+            ):
+                return self._csr
+            return self.rows_csr(np.arange(self.n_users))
+
+    def _add_user(self, user_id):
+        row = self.n_users
+        self._user_ids = grow(self._user_ids, row + 1)
+        self._user_sq_sums = grow(self._user_sq_sums, row + 1)
+        self._user_ids[row] = user_id
+        self._user_index[user_id] = row
+        self.n_users += 1
+        return row
+
+    def _add_property(self, property_id):
+        col = self.n_properties
+        self._property_ids = grow(self._property_ids, col + 1)
+        self._item_counts = grow(self._item_counts, col + 1)
+        self._item_weight_sums = grow(self._item_weight_sums, col + 1)
+        self._property_ids[col] = property_id
+        self._property_index[property_id] = col
+        self.n_properties += 1
+        return col
+
+    def _base_weight(self, row, col):
+        if row >= self._csr.shape[0] or col >= self._csr.shape[1]:
+            return 0.0
+        return float(self._csr[row, col])
+
+    def _discard_patch(self, row, col):
+        del self._row_patches[row][col]
+        if not self._row_patches[row]:
+            del self._row_patches[row]
+        del self._col_patches[col][row]
+        if not self._col_patches[col]:
+            del self._col_patches[col]
+        self.pending -= 1
+
+    def get(self, row, col):
+        with self._lock:
+            patch = self._row_patches.get(row, {})
+            if col in patch:
+                return patch[col]
+            return self._base_weight(row, col)
+
+    def set(self, user_id, property_id, weight):
+        """
+        Set the weight of a user -> property cell; 0 deletes it.
+
+        Returns (user row, property column, previous weight).
+        """
+        with self._lock:
+            row = self._user_index.get(user_id)
+            col = self._property_index.get(property_id)
+            if weight == 0 and (row is None or col is None):
+                return row, col, 0.0
+            if row is None:
+                row = self._add_user(user_id)
+            if col is None:
+                col = self._add_property(property_id)
+
+            previous = self.get(row, col)
+            if previous == weight:
+                return row, col, previous
+
+            if weight == self._base_weight(row, col):
+                # Back to the base value, the patch is no longer needed
+                self._discard_patch(row, col)
+            else:
+                if col not in self._row_patches.get(row, {}):
+                    self.pending += 1
+                self._row_patches.setdefault(row, {})[col] = weight
+                self._col_patches.setdefault(col, {})[row] = weight
+
+            self._item_counts[col] += int(weight != 0) - int(previous != 0)
+            self._item_weight_sums[col] += weight - previous
+            self._user_sq_sums[row] += weight**2 - previous**2
+
+            if self.pending >= self.max_pending:
+                self.compact()
+            return row, col, previous
+
+    def remove(self, user_id, property_id):
+        return self.set(user_id, property_id, 0)
+
+    def compact(self):
+        """
+        Merge the overlay into the CSR/CSC base.
+        """
+        with self._lock:
+            merged = self.to_csr()
+            merged.eliminate_zeros()
+            self._csr = merged
+            self._csc = merged.tocsc()
+            self._row_patches = {}
+            self._col_patches = {}
+            self.pending = 0
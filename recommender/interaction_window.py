@@ -0,0 +1,231 @@
+"""
+Time window and decay of the interactions the CF engines are built from.
+
+With settings.RECOMMENDER_INTERACTION_WINDOW['WINDOW_DAYS'] set, the
+engines load only the interactions created in the last WINDOW_DAYS days
+and delete cells as they age out of the window, so their matrices hold a
+bounded slice of the event log however long it grows. Cell creation times
+are queued oldest first, so finding the expired cells costs nothing until
+some are due.
+
+With HALF_LIFE_DAYS set, the matrix factorization engine multiplies each
+weight by 0.5 ** (age / HALF_LIFE_DAYS) at build time, which scales its
+confidences. Cells created after the build keep their full weight until
+the next build decays them. The user- and item-based engines compare the
+integer view/like/save levels of co-rated cells, so their matrices are
+never decayed.
+"""
+
+import heapq
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .interaction_loader import load_interactions
+from .snapshots import load_array
+
+DAY_SECONDS = 86400
+
+WINDOW_DEFAULTS = {
+    # Interactions older than this are dropped; None keeps all of them
+    'WINDOW_DAYS': None,
+    # Age at which an interaction counts half; None disables decay
+    'HALF_LIFE_DAYS': None,
+}
+
+
+def window_options():
+    """
+    WINDOW_DEFAULTS overridden by settings.RECOMMENDER_INTERACTION_WINDOW.
+    """
+    return {
+        **WINDOW_DEFAULTS,
+        **getattr(settings, 'RECOMMENDER_INTERACTION_WINDOW', {}),
+    }
+
+
+class InteractionWindow:
+    """
+    Creation times of the cells of one engine's InteractionMatrix, and the
+    weights written cells are stored with.
+
+    Cells loaded at build time sit in arrays sorted by time and consumed
+    from the front; cells written later go to a heap. A queued cell that
+    has been re-created since (with a new time) is skipped when its old
+    entry comes up. Without a window nothing is tracked.
+    """
+
+    def __init__(
+        self,
+        window_days,
+        half_life_days,
+        reference,
+        user_ids=None,
+        property_ids=None,
+        timestamps=None,
+    ):
+        self.window_days = window_days
+        self.half_life_days = half_life_days
+        # Ages for the decay are measured back from this time
+        self.reference = reference
+        self._lock = threading.Lock()
+
+        if window_days is None or timestamps is None:
+            user_ids = property_ids = timestamps = np.empty(0)
+        order = np.argsort(timestamps, kind='stable')
+        self._times = np.asarray(timestamps, dtype=np.float64)[order]
+        self._user_ids = np.asarray(user_ids, dtype=np.int64)[order]
+        self._property_ids = np.asarray(property_ids, dtype=np.int64)[order]
+        self._head = 0
+        self._recent = []
+        # Creation time of the cells written since the build, by cell
+        self._created = {}
+
+    @property
+    def enabled(self):
+        return self.window_days is not None
+
+    def meta(self):
+        return {
+            'window_days': self.window_days,
+            'half_life_days': self.half_life_days,
+            'reference': self.reference,
+        }
+
+    @classmethod
+    def load(cls, path, meta):
+        """
+        Rebuild a window saved with meta() and snapshot_arrays().
+        """
+        return cls(
+            meta['window_days'],
+            meta['half_life_days'],
+            meta['reference'],
+            load_array(path, 'window_user_ids'),
+            load_array(path, 'window_property_ids'),
+            load_array(path, 'window_times'),
+        )
+
+    def _live(self, user_id, property_id, timestamp):
+        return self._created.get((user_id, property_id), timestamp) == timestamp
+
+    def snapshot_arrays(self):
+        """
+        The queued cells to save for load(), without stale entries.
+        """
+        with self._lock:
+            entries = [
+                entry
+                for entry in zip(
+                    self._times[self._head :].tolist(),
+                    self._user_ids[self._head :].tolist(),
+                    self._property_ids[self._head :].tolist(),
+                )
+                if self._live(entry[1], entry[2], entry[0])
+            ]
+            entries += [
+                entry
+                for entry in self._recent
+                if self._live(entry[1], entry[2], entry[0])
+            ]
+        times, user_ids, property_ids = zip(*entries) if entries else ((), (), ())
+        return {
+            'window_times': np.array(times, dtype=np.float64),
+            'window_user_ids': np.array(user_ids, dtype=np.int64),
+            'window_property_ids': np.array(property_ids, dtype=np.int64),
+        }
+
+    def decayed(self, weights, timestamps):
+        """
+        `weights` of interactions created at `timestamps`, decayed by age.
+        """
+        if self.half_life_days is None:
+            return weights
+        ages = np.maximum(self.reference - np.asarray(timestamps), 0) / DAY_SECONDS
+        return weights * 0.5 ** (ages / self.half_life_days)
+
+    def record(self, user_id, property_id, weight, timestamp=None):
+        """
+        Note a write of a cell created at `timestamp` (default: now); 0
+        deletes it. Returns the weight to store.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        if self.enabled:
+            key = (user_id, property_id)
+            with self._lock:
+                if weight == 0:
+                    self._created.pop(key, None)
+                elif self._created.get(key) != timestamp:
+                    self._created[key] = timestamp
+                    heapq.heappush(self._recent, (timestamp, user_id, property_id))
+        if weight == 0:
+            return 0
+        return float(self.decayed(weight, timestamp))
+
+    def expired(self, now=None):
+        """
+        (user_id, property_id) of the queued cells created before the
+        window, which leave the queue. Cells already deleted may be
+        included; deleting them again is a no-op.
+        """
+        if not self.enabled:
+            return []
+        cutoff = (time.time() if now is None else now) - self.window_days * DAY_SECONDS
+        cells = []
+        with self._lock:
+            stop = max(int(np.searchsorted(self._times, cutoff)), self._head)
+            entries = list(
+                zip(
+                    self._times[self._head : stop].tolist(),
+                    self._user_ids[self._head : stop].tolist(),
+                    self._property_ids[self._head : stop].tolist(),
+                )
+            )
+            self._head = stop
+            while self._recent and self._recent[0][0] < cutoff:
+                entries.append(heapq.heappop(self._recent))
+
+            for timestamp, user_id, property_id in entries:
+                if self._live(user_id, property_id, timestamp):
+                    cells.append((user_id, property_id))
+                    self._created.pop((user_id, property_id), None)
+
+            if self._head > self._times.size // 2:
+                # Release the consumed front of the build-time arrays
+                self._times = self._times[self._head :].copy()
+                self._user_ids = self._user_ids[self._head :].copy()
+                self._property_ids = self._property_ids[self._head :].copy()
+                self._head = 0
+        return cells
+
+
+def load_window_interactions(decay=False):
+    """
+    (InteractionArrays, InteractionWindow) of the interactions inside the
+    configured window; with `decay`, weights are decayed by HALF_LIFE_DAYS.
+    """
+    options = window_options()
+    window_days = options['WINDOW_DAYS']
+    half_life_days = options['HALF_LIFE_DAYS'] if decay else None
+    reference = time.time()
+    if window_days is None and half_life_days is None:
+        return load_interactions(), InteractionWindow(None, None, reference)
+
+    since = None if window_days is None else reference - window_days * DAY_SECONDS
+    interactions = load_interactions(since=since, with_timestamps=True)
+    window = InteractionWindow(
+        window_days,
+        half_life_days,
+        reference,
+        interactions.user_ids[interactions.user_rows],
+        interactions.property_ids[interactions.property_cols],
+        interactions.timestamps,
+    )
+    interactions.weights = window.decayed(
+        interactions.weights, interactions.timestamps
+    ).astype(np.float32)
+    # The window keeps its own copy of the times it needs
+    interactions.timestamps = None
+    return interactions, window
@@ -0,0 +1,102 @@
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from recommender import snapshots
+from recommender.models import InteractionChange
+from recommender.registry import ENGINE_SLOTS
+
+ENGINES = {name: slot.engine_class for name, slot in ENGINE_SLOTS.items()}
+
+
+def build_engine(name, version):
+    """
+    Build engine `name` from the database and save it into the staging
+    directory of `version`. Returns the build time in seconds.
+    """
+    start = time.perf_counter()
+    engine = ENGINES[name]()
+    engine.save(snapshots.staging_path(version) / name)
+    return time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the recommender engines from the database and publish them as "
+        "a new model version. Running workers swap to it on their next check."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--engines',
+            nargs='+',
+            choices=sorted(ENGINES),
+            default=list(ENGINES),
+            help="Engines to build (default: all).",
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=min(len(ENGINES), os.cpu_count() or 1),
+            help="Processes building engines in parallel; 1 builds in-process.",
+        )
+        parser.add_argument(
+            '--keep',
+            type=int,
+            default=3,
+            help="Number of model versions to keep on disk.",
+        )
+
+    def handle(self, *args, **options):
+        names = options['engines']
+        version = snapshots.new_version()
+
+        # Engines left out of this build are carried over from the current
+        # version so that it stays complete.
+        current = snapshots.current_version()
+        carried = [
+            name
+            for name in ENGINES
+            if name not in names and snapshots.engine_path(name, current)
+        ]
+
+        start = time.perf_counter()
+        try:
+            if options['workers'] > 1 and len(names) > 1:
+                # Forked children must not share the parent's connections
+                connections.close_all()
+                with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+                    futures = {
+                        name: pool.submit(build_engine, name, version) for name in names
+                    }
+                    timings = {
+                        name: future.result() for name, future in futures.items()
+                    }
+            else:
+                timings = {name: build_engine(name, version) for name in names}
+        except Exception as exc:
+            shutil.rmtree(snapshots.staging_path(version), ignore_errors=True)
+            raise CommandError(f"Building the models failed: {exc}") from exc
+
+        for name in carried:
+            snapshots.copy_engine(name, current, version)
+
+        snapshots.publish_version(version)
+        snapshots.prune_versions(options['keep'])
+
+        # Changes every kept snapshot already includes are not replayed again
+        mark = snapshots.oldest_changes_mark()
+        if mark is not None:
+            InteractionChange.objects.filter(id__lte=mark).delete()
+
+        for name, seconds in timings.items():
+            self.stdout.write(f"{name}: built in {seconds:.2f}s")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Published {version} in {time.perf_counter() - start:.2f}s"
+            )
+        )
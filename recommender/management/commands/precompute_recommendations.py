@@ -0,0 +1,105 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Count
+
+from real_state.models import UserInteraction
+from recommender.models import PrecomputedRecommendation
+from recommender.precomputed import replace_recommendations, score_users
+
+ENGINES = [engine for engine, _ in PrecomputedRecommendation.ENGINES]
+
+
+class Command(BaseCommand):
+    help = (
+        "Precompute the recommendations of active users into "
+        "PrecomputedRecommendation, scoring chunks of users in a process pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--engines',
+            nargs='+',
+            choices=ENGINES,
+            default=ENGINES,
+            help="Engines to precompute (default: all).",
+        )
+        parser.add_argument(
+            '--top-n',
+            type=int,
+            default=10,
+            help="Recommendations stored per user and engine.",
+        )
+        parser.add_argument(
+            '--min-interactions',
+            type=int,
+            default=1,
+            help="Only precompute users with at least this many interactions.",
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help="Users scored together by one task.",
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Scoring processes; 1 scores in-process.",
+        )
+
+    def handle(self, *args, **options):
+        user_ids = list(
+            UserInteraction.objects.values('user_id')
+            .annotate(interactions=Count('id'))
+            .filter(interactions__gte=options['min_interactions'])
+            .order_by('user_id')
+            .values_list('user_id', flat=True)
+        )
+        chunk_size = options['chunk_size']
+        tasks = [
+            (engine, user_ids[start : start + chunk_size])
+            for engine in options['engines']
+            for start in range(0, len(user_ids), chunk_size)
+        ]
+
+        start = time.perf_counter()
+        written = 0
+        if options['workers'] > 1 and len(tasks) > 1:
+            # Forked children must not share the parent's connections. Each
+            # child loads every engine once and keeps it for later chunks.
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+                futures = {
+                    pool.submit(score_users, engine, chunk, options['top_n']): (
+                        engine,
+                        chunk,
+                    )
+                    for engine, chunk in tasks
+                }
+                # Rows are written by this process only, as chunks finish
+                for future in as_completed(futures):
+                    engine, chunk = futures[future]
+                    version, versions, results = future.result()
+                    written += replace_recommendations(
+                        engine, chunk, results, version, versions
+                    )
+        else:
+            for engine, chunk in tasks:
+                version, versions, results = score_users(
+                    engine, chunk, options['top_n']
+                )
+                written += replace_recommendations(
+                    engine, chunk, results, version, versions
+                )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Wrote {written} recommendations for {len(user_ids)} users "
+                f"in {time.perf_counter() - start:.2f}s"
+            )
+        )
@@ -0,0 +1,350 @@
+"""
+Implicit-feedback matrix factorization (Hu, Koren and Volinsky, 2008).
+
+The view=1/like=2/save=3 weights (decayed by age with
+RECOMMENDER_INTERACTION_WINDOW['HALF_LIFE_DAYS']) become confidences
+c = 1 + alpha * w that every observed cell of the user x property matrix
+is a 1. Alternating least squares fits float32 user and item factors of
+`factors` dimensions; each half-step improves every row with a few
+conjugate gradient steps over blocks of rows, so the work is sparse
+gathers and dense BLAS products rather than one k x k solve per row. A request is then one k-dimensional
+dot product of the user's factors against the item factors.
+
+Interactions arriving after training (including those of new users) are
+folded in: the user's factors are solved exactly against the fixed item
+factors, which is the ALS user step for that one user.
+"""
+
+import logging
+import threading
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from real_state.models import RealState
+
+from .interaction_loader import change_mark, changes_since
+from .interaction_matrix import InteractionMatrix, UpdateTimer, grow
+from .interaction_window import InteractionWindow, load_window_interactions
+from .metrics import laps
+from .ranking import top_n_indices
+from .snapshots import EngineSlot, load_array, load_meta, save_arrays
+
+logger = logging.getLogger(__name__)
+
+# Observed cells whose rows are solved together; bounds the gathered
+# (cells x factors) block of a conjugate gradient step
+BLOCK_ENTRIES = 1 << 18
+
+
+def _row_blocks(indptr, block_entries):
+    """
+    (start, stop) ranges of consecutive rows holding at most block_entries
+    cells each, except single rows that are larger on their own.
+    """
+    n_rows = indptr.size - 1
+    start = 0
+    while start < n_rows:
+        stop = int(np.searchsorted(indptr, indptr[start] + block_entries, 'right')) - 1
+        stop = min(max(stop, start + 1), n_rows)
+        yield start, stop
+        start = stop
+
+
+def _row_dots(a, b):
+    return np.einsum('ij,ij->i', a, b)
+
+
+def _conjugate_gradient(confidence, solved, fixed, gram, steps):
+    """
+    Move every row x_u of `solved` (in place) towards the minimum of
+
+        sum_i c_ui (p_ui - x_u . y_i)^2 + regularization * |x_u|^2
+
+    with `steps` conjugate gradient steps, where y_i are the rows of
+    `fixed`, `confidence` is a CSR matrix of c_ui - 1 over the observed
+    cells (where p_ui = 1) and gram = fixed.T @ fixed + regularization * I.
+    """
+    indptr = confidence.indptr
+    for start, stop in _row_blocks(indptr, BLOCK_ENTRIES):
+        first, last = indptr[start], indptr[stop]
+        rows = np.repeat(np.arange(stop - start), np.diff(indptr[start : stop + 1]))
+        positions = np.arange(last - first)
+        block_indptr = indptr[start : stop + 1] - first
+        y = fixed[confidence.indices[first:last]]
+        c = confidence.data[first:last]
+
+        def by_row(weights):
+            # (rows x cells) matrix summing weighted cells into their row
+            return csr_matrix(
+                (weights, positions, block_indptr), shape=(stop - start, y.shape[0])
+            )
+
+        def product(vectors):
+            # A_u v_u = gram v_u + sum_i c_ui (y_i . v_u) y_i
+            return vectors @ gram + by_row(c * _row_dots(y, vectors[rows])) @ y
+
+        x = solved[start:stop]
+        residual = by_row(1 + c) @ y - product(x)
+        direction = residual.copy()
+        norms = _row_dots(residual, residual)
+        for _ in range(steps):
+            curved = product(direction)
+            curvature = _row_dots(direction, curved)
+            step = np.divide(
+                norms, curvature, out=np.zeros_like(norms), where=curvature > 0
+            )
+            x += step[:, None] * direction
+            residual -= step[:, None] * curved
+            new_norms = _row_dots(residual, residual)
+            ratio = np.divide(
+                new_norms, norms, out=np.zeros_like(norms), where=norms > 0
+            )
+            direction = residual + ratio[:, None] * direction
+            norms = new_norms
+
+
+class MatrixFactorization:
+    """
+    Collaborative filtering from float32 latent factors fitted by implicit
+    ALS on the user x property weight matrix.
+
+    `alpha` scales weights into confidences, `regularization` is the L2
+    penalty on the factors and every one of the `iterations` ALS sweeps
+    takes `cg_steps` conjugate gradient steps per side. Properties added
+    after training have no factors and are not recommended until the next
+    build.
+    """
+
+    def __init__(
+        self,
+        factors=64,
+        regularization=0.1,
+        alpha=40.0,
+        iterations=15,
+        cg_steps=3,
+        seed=0,
+    ):
+        self.factors = factors
+        self.regularization = regularization
+        self.alpha = alpha
+        self.iterations = iterations
+        self.cg_steps = cg_steps
+        self.seed = seed
+        self._update_lock = threading.Lock()
+        self._factors_lock = threading.Lock()
+        self._create_matrix()
+        self._train()
+
+    def _create_matrix(self):
+        # Decay only scales confidences, so it applies to this engine alone
+        # Changes logged from here on are replayed onto loaded snapshots
+        self.changes_mark = change_mark()
+        interactions, self.window = load_window_interactions(decay=True)
+        self.interactions = InteractionMatrix.from_interactions(interactions)
+        self.update_timer = UpdateTimer('matrix_factorization')
+
+    def _gram(self, factors):
+        return factors.T @ factors + self.regularization * np.eye(
+            self.factors, dtype=factors.dtype
+        )
+
+    def _train(self):
+        start = time.perf_counter()
+        confidence = self.interactions.to_csr().astype(np.float32)
+        confidence.data *= self.alpha
+        item_confidence = confidence.T.tocsr()
+
+        rng = np.random.default_rng(self.seed)
+        n_users, n_items = confidence.shape
+        self.user_factors = np.zeros((n_users, self.factors), dtype=np.float32)
+        self.item_factors = (
+            rng.standard_normal((n_items, self.factors)) * 0.01
+        ).astype(np.float32)
+
+        for _ in range(self.iterations):
+            _conjugate_gradient(
+                confidence,
+                self.user_factors,
+                self.item_factors,
+                self._gram(self.item_factors),
+                self.cg_steps,
+            )
+            _conjugate_gradient(
+                item_confidence,
+                self.item_factors,
+                self.user_factors,
+                self._gram(self.user_factors),
+                self.cg_steps,
+            )
+        # Fold-ins solve against the item factors in double precision
+        self.item_gram = self._gram(self.item_factors.astype(np.float64))
+
+        self.build_seconds = time.perf_counter() - start
+        logger.info(
+            "Fitted %d factors for %d users and %d properties in %.2fs",
+            self.factors,
+            n_users,
+            n_items,
+            self.build_seconds,
+        )
+
+    def save(self, path):
+        with self._update_lock:
+            save_arrays(
+                path,
+                {
+                    **self.interactions.snapshot_arrays(),
+                    **self.window.snapshot_arrays(),
+                    'user_factors': self.user_factors[: self.interactions.n_users],
+                    'item_factors': self.item_factors,
+                    'item_gram': self.item_gram,
+                },
+                {
+                    'factors': self.factors,
+                    'regularization': self.regularization,
+                    'alpha': self.alpha,
+                    'iterations': self.iterations,
+                    'cg_steps': self.cg_steps,
+                    'seed': self.seed,
+                    'build_seconds': self.build_seconds,
+                    'window': self.window.meta(),
+                    'changes_mark': self.changes_mark,
+                },
+            )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Map a snapshot written by save(), then fold in the interaction
+        changes made since it was built.
+        """
+        meta = load_meta(path)
+        recommender = cls.__new__(cls)
+        recommender.factors = meta['factors']
+        recommender.regularization = meta['regularization']
+        recommender.alpha = meta['alpha']
+        recommender.iterations = meta['iterations']
+        recommender.cg_steps = meta['cg_steps']
+        recommender.seed = meta['seed']
+        recommender.build_seconds = meta['build_seconds']
+        recommender._update_lock = threading.Lock()
+        recommender._factors_lock = threading.Lock()
+        recommender.interactions = InteractionMatrix.load(path)
+        recommender.window = InteractionWindow.load(path, meta['window'])
+        recommender.update_timer = UpdateTimer('matrix_factorization')
+        recommender.user_factors = load_array(path, 'user_factors')
+        recommender.item_factors = load_array(path, 'item_factors')
+        recommender.item_gram = np.array(load_array(path, 'item_gram'))
+        recommender.changes_mark, changes = changes_since(meta['changes_mark'])
+        for change in changes:
+            recommender.apply_interaction(*change)
+        recommender.expire_interactions()
+        return recommender
+
+    def _fold_in(self, user_row):
+        """
+        Solve the user's factors against the fixed item factors from their
+        current interactions.
+        """
+        cols, weights = self.interactions.row(user_row)
+        # Properties added since training have no factors
+        trained = cols < self.item_factors.shape[0]
+        y = self.item_factors[cols[trained]].astype(np.float64)
+        c = self.alpha * weights[trained]
+        factors = np.linalg.solve(self.item_gram + (y.T * c) @ y, (1 + c) @ y)
+
+        # Readers copy rows under the same lock, so they never see a
+        # partly written one
+        with self._factors_lock:
+            user_factors = grow(self.user_factors, user_row + 1)
+            user_factors[user_row] = factors
+            self.user_factors = user_factors
+
+    def _user_vector(self, user_row):
+        """
+        A copy of the user's factors, or None before their first fold-in.
+        """
+        with self._factors_lock:
+            if user_row >= self.user_factors.shape[0]:
+                return None
+            return self.user_factors[user_row].copy()
+
+    def apply_interaction(self, user_id, property_id, weight, created=None):
+        """
+        Set (or with weight 0, delete) a user -> property cell in place and
+        fold the user's interactions in again; `created` is the
+        interaction's creation time (default: now). Item factors stay as
+        trained until the next build.
+        """
+        with self.update_timer.measure(), self._update_lock:
+            weight = self.window.record(user_id, property_id, weight, created)
+            user_row, _, previous = self.interactions.set(user_id, property_id, weight)
+            if user_row is None or previous == weight:
+                return
+            self._fold_in(user_row)
+
+    def expire_interactions(self, now=None):
+        """
+        Delete the cells that have left the interaction window.
+        """
+        for user_id, property_id in self.window.expired(now):
+            self.apply_interaction(user_id, property_id, 0)
+
+    def get_recommendations(self, user, top_n=10):
+        recommended_ids = self.get_recommended_ids(user, top_n)
+        return RealState.objects.filter(id__in=recommended_ids)
+
+    def get_recommended_ids(self, user, top_n=10):
+        """
+        Ids of the top_n recommended properties, best first.
+        """
+        user_row = self.interactions.user_row(getattr(user, 'id', user))
+        if user_row is None:
+            return []
+
+        items, _ = self.interactions.row(user_row)
+        if items.size == 0:
+            return []
+
+        lap = laps()
+        user_vector = self._user_vector(user_row)
+        n_items = self.item_factors.shape[0]
+        seen = np.zeros(self.interactions.n_properties, dtype=bool)
+        seen[items] = True
+        item_cols = np.flatnonzero(~seen[:n_items])
+        if user_vector is not None and user_vector.any():
+            scores = (self.item_factors @ user_vector)[item_cols]
+        else:
+            # Fallback: no trained property among the user's interactions,
+            # recommend popular ones (require at least 2 ratings).
+            # Properties added since `seen` was sized are left out.
+            item_counts = self.interactions.item_counts[: seen.size]
+            item_cols = np.flatnonzero((item_counts >= 2) & ~seen)
+            scores = (
+                self.interactions.item_weight_sums[item_cols] / item_counts[item_cols]
+            )
+        lap('similarity')
+
+        # Ties rank by property id, as in the CF engines
+        candidate_ids = self.interactions.property_ids[item_cols]
+        recommended_ids = candidate_ids[top_n_indices(scores, top_n, candidate_ids)]
+        lap('rank')
+
+        return recommended_ids.tolist()
+
+
+# Singleton instance
+matrix_factorization_recommender = None
+
+matrix_factorization_slot = EngineSlot('matrix_factorization', MatrixFactorization)
+
+
+def get_matrix_factorization_recommender(wait=True):
+    """
+    The process's engine; with wait=False None until it has been built.
+    """
+    global matrix_factorization_recommender
+    matrix_factorization_recommender = matrix_factorization_slot.get(wait)
+    return matrix_factorization_recommender
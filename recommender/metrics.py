@@ -0,0 +1,457 @@
+"""
+Per-request stage timings and process metrics of the recommender.
+
+MetricsMiddleware gives every request a RequestMetrics in a context
+variable. Code on the hot path reports its stages to it through stage()
+or laps(), and every SQL query run on a connection of this process is
+counted against the request's current stage. At the end of the request
+the stages are sent back in a Server-Timing header and added to the
+process histograms that metrics_view renders in the Prometheus text
+format, together with cache hit counts and engine memory footprints.
+
+Outside a request (commands, warm-up threads) stage() and laps() do
+nothing. Metrics are per process; with several workers, scrape each one.
+"""
+
+import bisect
+import contextvars
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import Http404, HttpResponse
+from scipy.sparse import issparse
+
+# Upper bounds in seconds, as in the default Prometheus client buckets
+SECONDS_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# Seconds an engine's memory footprint is reused between scrapes
+FOOTPRINT_TTL = 60
+
+current = contextvars.ContextVar('recommender_request_metrics', default=None)
+
+
+class RequestMetrics:
+    """
+    Stages and SQL queries of one request. Repeated stages add up.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        # {stage: [seconds, queries]} in the order stages first ran
+        self.stages = {}
+
+    def record(self, name, seconds, queries):
+        totals = self.stages.setdefault(name, [0.0, 0])
+        totals[0] += seconds
+        totals[1] += queries
+
+    def server_timing(self, total_seconds):
+        entries = [f'total;dur={total_seconds * 1000:.2f}']
+        for name, (seconds, queries) in self.stages.items():
+            entry = f'{name};dur={seconds * 1000:.2f}'
+            if queries:
+                entry += f';desc="{queries} queries"'
+            entries.append(entry)
+        entries.append(f'db;desc="{self.queries} queries"')
+        return ', '.join(entries)
+
+
+@contextmanager
+def stage(name):
+    """
+    Time the block as stage `name` of the current request.
+    """
+    request_metrics = current.get()
+    if request_metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    queries = request_metrics.queries
+    try:
+        yield
+    finally:
+        request_metrics.record(
+            name, time.perf_counter() - start, request_metrics.queries - queries
+        )
+
+
+class Laps:
+    """
+    Consecutive stages of one computation: each call ends the stage that
+    began at the previous call (or at creation) and names it.
+    """
+
+    def __init__(self, request_metrics):
+        self.request_metrics = request_metrics
+        self.start = time.perf_counter()
+        self.queries = request_metrics.queries
+
+    def __call__(self, name):
+        now = time.perf_counter()
+        queries = self.request_metrics.queries
+        self.request_metrics.record(name, now - self.start, queries - self.queries)
+        self.start = now
+        self.queries = queries
+
+
+def _no_laps(name):
+    pass
+
+
+def laps():
+    """
+    A Laps for the current request, or a no-op outside requests.
+    """
+    request_metrics = current.get()
+    return _no_laps if request_metrics is None else Laps(request_metrics)
+
+
+def count_queries(execute, sql, params, many, context):
+    request_metrics = current.get()
+    if request_metrics is not None:
+        request_metrics.queries += 1
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def _install_query_counter(sender, connection, **kwargs):
+    # Wrappers outlive reconnects of the same connection object
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+def _labels(names, values):
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+
+
+class Histogram:
+    """
+    Thread-safe Prometheus histogram with fixed label names.
+    """
+
+    def __init__(self, name, documentation, label_names, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # {label values: [bucket counts..., sum, count]}
+        self._series = {}
+
+    def observe(self, label_values, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} histogram',
+        ]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            labels = _labels(self.label_names, label_values)
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {values[-1]}')
+            lines.append(f'{self.name}_sum{{{labels}}} {values[-2]}')
+            lines.append(f'{self.name}_count{{{labels}}} {values[-1]}')
+        return lines
+
+
+class Counter:
+    """
+    Thread-safe Prometheus counter with fixed label names.
+    """
+
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} counter',
+        ]
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            labels = _labels(self.label_names, label_values)
+            lines.append(f'{self.name}{{{labels}}} {value}')
+        return lines
+
+
+request_seconds = Histogram(
+    'recommender_request_seconds',
+    'Duration of requests.',
+    ('endpoint',),
+    SECONDS_BUCKETS,
+)
+requests_total = Counter(
+    'recommender_requests_total',
+    'Requests by response status.',
+    ('endpoint', 'status'),
+)
+stage_seconds = Histogram(
+    'recommender_stage_seconds',
+    'Duration of request stages.',
+    ('endpoint', 'stage'),
+    SECONDS_BUCKETS,
+)
+request_queries = Histogram(
+    'recommender_request_queries',
+    'SQL queries per request.',
+    ('endpoint',),
+    QUERY_BUCKETS,
+)
+
+update_seconds = Histogram(
+    'recommender_update_seconds',
+    'Duration of incremental interaction updates of the engines.',
+    ('engine',),
+    SECONDS_BUCKETS,
+)
+request_errors = Counter(
+    'recommender_request_errors_total',
+    'Requests that failed with an exception.',
+    ('endpoint',),
+)
+
+
+def _endpoint(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.url_name or match.route
+
+
+def _finish(request, request_metrics, response):
+    total_seconds = time.perf_counter() - request_metrics.start
+    endpoint = _endpoint(request)
+    request_seconds.observe((endpoint,), total_seconds)
+    requests_total.inc((endpoint, str(response.status_code)))
+    request_queries.observe((endpoint,), request_metrics.queries)
+    for name, (seconds, _) in request_metrics.stages.items():
+        stage_seconds.observe((endpoint, name), seconds)
+    response['Server-Timing'] = request_metrics.server_timing(total_seconds)
+    return response
+
+
+def record_error(request):
+    """
+    Count a request whose view caught an exception.
+    """
+    request_errors.inc((_endpoint(request),))
+
+
+class MetricsMiddleware:
+    """
+    Collect the metrics of each request and add its Server-Timing header.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_metrics = RequestMetrics()
+        token = current.set(request_metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        return _finish(request, request_metrics, response)
+
+    async def __acall__(self, request):
+        request_metrics = RequestMetrics()
+        token = current.set(request_metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        return _finish(request, request_metrics, response)
+
+
+def footprint(engine):
+    """
+    Bytes of the NumPy arrays, sparse matrices, DataFrames and containers
+    reachable from `engine`. Memory-mapped arrays count in full even if
+    only part of them is resident.
+    """
+    total = 0
+    seen = set()
+    stack = [engine]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, np.ndarray):
+            # Views count once, as the array that owns the data
+            while isinstance(obj.base, np.ndarray):
+                obj = obj.base
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+
+        if isinstance(obj, np.ndarray):
+            total += obj.nbytes
+        elif issparse(obj):
+            stack.extend(vars(obj).values())
+        elif hasattr(obj, 'memory_usage') and hasattr(obj, 'columns'):
+            total += int(obj.memory_usage(index=True).sum())
+        elif isinstance(obj, dict):
+            total += sys.getsizeof(obj)
+            stack.extend(
+                value
+                for value in obj.values()
+                if not isinstance(value, (int, float, str, bytes))
+            )
+        elif isinstance(obj, (list, tuple, set)):
+            total += sys.getsizeof(obj)
+            stack.extend(
+                value
+                for value in obj
+                if not isinstance(value, (int, float, str, bytes))
+            )
+        elif type(obj).__module__.startswith('recommender.') and hasattr(
+            obj, '__dict__'
+        ):
+            stack.extend(vars(obj).values())
+    return total
+
+
+_footprints = {}
+
+
+def engine_footprint(name, engine):
+    """
+    footprint(engine), recomputed when the engine is swapped or after
+    FOOTPRINT_TTL seconds.
+    """
+    cached = _footprints.get(name)
+    now = time.monotonic()
+    if cached is None or cached[0] is not engine or now - cached[2] > FOOTPRINT_TTL:
+        cached = _footprints[name] = (engine, footprint(engine), now)
+    return cached[1]
+
+
+def _gauge_lines(name, documentation, label_name, values, kind='gauge'):
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+    for label, value in values.items():
+        lines.append(f'{name}{{{label_name}="{label}"}} {value}')
+    return lines
+
+
+def render():
+    """
+    Every metric of this process in the Prometheus text format.
+    """
+    from .cosine_similarity_recommender import record_cache
+    from .pagination import ranked_lists
+    from .registry import ENGINE_SLOTS
+    from .serializers import property_rows
+
+    caches = {
+        'property_rows': property_rows,
+        'property_records': record_cache,
+        'ranked_lists': ranked_lists,
+    }
+    engines = {}
+    for name, slot in ENGINE_SLOTS.items():
+        engine = slot.engine
+        if engine is None:
+            continue
+        engines[name] = engine
+        cache = getattr(engine, 'cache', None)
+        if cache is not None:
+            caches[name] = cache
+    cache_stats = {name: cache.stats() for name, cache in caches.items()}
+
+    lines = []
+    for histogram in (request_seconds, stage_seconds, request_queries, update_seconds):
+        lines += histogram.render()
+    lines += requests_total.render()
+    lines += request_errors.render()
+    for key, kind, documentation in (
+        ('hits', 'counter', 'Cache hits.'),
+        ('misses', 'counter', 'Cache misses.'),
+        ('evictions', 'counter', 'Cache evictions.'),
+        ('size', 'gauge', 'Cached entries.'),
+    ):
+        lines += _gauge_lines(
+            f'recommender_cache_{key}' + ('_total' if kind == 'counter' else ''),
+            documentation,
+            'cache',
+            {name: stats[key] for name, stats in cache_stats.items()},
+            kind,
+        )
+    lines += _gauge_lines(
+        'recommender_engine_ready',
+        'Whether the engine has been built in this process.',
+        'engine',
+        {name: int(slot.ready) for name, slot in ENGINE_SLOTS.items()},
+    )
+    lines += _gauge_lines(
+        'recommender_engine_bytes',
+        'Bytes held by the engine, memory-mapped arrays included.',
+        'engine',
+        {name: engine_footprint(name, engine) for name, engine in engines.items()},
+    )
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    The Prometheus metrics of this worker, for clients listed in
+    settings.RECOMMENDER_METRICS_IPS only.
+    """
+    allowed = getattr(settings, 'RECOMMENDER_METRICS_IPS', ['127.0.0.1', '::1'])
+    if request.META.get('REMOTE_ADDR') not in allowed:
+        raise Http404
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4')
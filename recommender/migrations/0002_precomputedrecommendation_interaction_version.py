@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-17 04:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recommender", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="precomputedrecommendation",
+            name="interaction_version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.5 on 2026-10-17 04:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recommender", "0002_precomputedrecommendation_interaction_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InteractionChange",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("user_id", models.BigIntegerField()),
+                ("property_id", models.BigIntegerField()),
+            ],
+        ),
+    ]
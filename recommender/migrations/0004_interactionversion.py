@@ -0,0 +1,31 @@
+# Generated by Django 5.1.5 on 2026-10-17 04:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("recommender", "0003_interactionchange"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InteractionVersion",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("version", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -1,3 +1,68 @@
+from django.contrib.auth.models import User
 from django.db import models
+from real_state.models import RealState
 
-# Create your models here.
+
+class InteractionChange(models.Model):
+    """
+    Log of the UserInteraction cells written through the ORM, filled by
+    the signal handlers in the transaction of the change.
+
+    Engines remember the last entry when they are built, so a worker
+    mapping their snapshot replays only the cells changed since instead
+    of reading the whole interaction table. Entries older than every kept
+    snapshot are pruned by `manage.py build_recommender_models`.
+    """
+
+    user_id = models.BigIntegerField()
+    property_id = models.BigIntegerField()
+
+    def __str__(self):
+        return f"#{self.id}: {self.user_id} -> {self.property_id}"
+
+
+class InteractionVersion(models.Model):
+    """
+    Per-user counter bumped by the signal handlers in the transaction of
+    every UserInteraction change. Precomputed rows remember the counter
+    they were computed under, so every worker sees them go stale at the
+    change's commit, whatever cache backend it uses.
+    """
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.version}"
+
+
+class PrecomputedRecommendation(models.Model):
+    """
+    One ranked recommendation of an engine for a user, written by
+    `manage.py precompute_recommendations` and served before computing
+    online while its model and the user's interactions are unchanged.
+    """
+
+    ENGINES = [
+        ('content', 'Content-based'),
+        ('user_cf', 'User-based CF'),
+        ('item_cf', 'Item-based CF'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    engine = models.CharField(max_length=20, choices=ENGINES)
+    rank = models.PositiveSmallIntegerField()
+    property = models.ForeignKey(RealState, on_delete=models.CASCADE)
+    score = models.FloatField()
+    model_version = models.CharField(max_length=50, blank=True)
+    # The user's InteractionVersion when the row was computed
+    interaction_version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'engine', 'rank')
+        indexes = [
+            models.Index(fields=["engine", "model_version"]),
+        ]
+
+    def __str__(self):
+        return f"{self.engine} #{self.rank} for {self.user_id}: {self.property_id}"
@@ -0,0 +1,126 @@
+"""
+Cursor pagination over cached ranked id lists.
+
+The first page of a ranking computes its best RANKED_LIST_SIZE ids once
+and caches them under the model versions of the engines that produced
+them (and, for per-user rankings, the user's interaction version). Later
+pages only slice the cached list and hydrate their own rows, so paging
+never rescores. Cursors are opaque offsets into the list.
+"""
+
+import base64
+import binascii
+
+import numpy as np
+from django.conf import settings
+
+from .cache import RecommendationCache
+from .registry import ENGINE_SLOTS
+
+PAGINATION_DEFAULTS = {
+    'RANKED_LIST_SIZE': 500,
+    'DEFAULT_PAGE_SIZE': 5,
+    'MAX_PAGE_SIZE': 100,
+}
+
+# Ranked id arrays by (user id or None, ranking, ..., model key)
+ranked_lists = RecommendationCache.from_settings('ranked_lists')
+
+
+class InvalidPage(ValueError):
+    pass
+
+
+def pagination_options():
+    """
+    PAGINATION_DEFAULTS overridden by settings.RECOMMENDER_PAGINATION.
+    """
+    return {**PAGINATION_DEFAULTS, **getattr(settings, 'RECOMMENDER_PAGINATION', {})}
+
+
+def paginated(params):
+    """
+    Whether the request asks for a page rather than the plain top results.
+    """
+    return 'page_size' in params or 'cursor' in params
+
+
+def encode_cursor(offset):
+    return base64.urlsafe_b64encode(f'offset={offset}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        name, _, value = (
+            base64.urlsafe_b64decode(cursor.encode()).decode().partition('=')
+        )
+        offset = int(value)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise InvalidPage("Invalid cursor")
+    if name != 'offset' or offset < 0:
+        raise InvalidPage("Invalid cursor")
+    return offset
+
+
+def page_params(params):
+    """
+    (offset, page_size) of the request, raising InvalidPage.
+    """
+    options = pagination_options()
+    try:
+        page_size = int(params.get('page_size', options['DEFAULT_PAGE_SIZE']))
+    except ValueError:
+        raise InvalidPage("page_size must be an integer")
+    if not 1 <= page_size <= options['MAX_PAGE_SIZE']:
+        raise InvalidPage(f"page_size must be between 1 and {options['MAX_PAGE_SIZE']}")
+    cursor = params.get('cursor')
+    return (decode_cursor(cursor) if cursor else 0), page_size
+
+
+def model_key(engine_names):
+    """
+    Identity of the named engines as currently loaded, or None while one
+    of them is not ready.
+    """
+    key = []
+    for name in engine_names:
+        slot = ENGINE_SLOTS[name]
+        engine = slot.engine
+        if engine is None:
+            return None
+        # Engines built from the database have no version
+        key.append((slot.version, id(engine)))
+    return tuple(key)
+
+
+def slice_page(ids, offset, page_size):
+    """
+    (page of `ids`, cursor of the next page or None).
+    """
+    stop = offset + page_size
+    page = [int(property_id) for property_id in ids[offset:stop]]
+    return page, (encode_cursor(stop) if stop < len(ids) else None)
+
+
+def ranked_page(params, key, engine_names, rank):
+    """
+    (ids of the requested page, next cursor) of the ranking rank(n), which
+    returns the best n ids. The ranking is cached under `key` (whose first
+    item is the user id, or None) and the model key of `engine_names`.
+
+    While an engine is not ready, rank() serves a fallback that is not
+    cached, and only as many ids as the page needs are ranked.
+    """
+    offset, page_size = page_params(params)
+    size = pagination_options()['RANKED_LIST_SIZE']
+    if offset >= size:
+        return [], None
+
+    models = model_key(engine_names)
+    if models is None:
+        ids = rank(min(offset + page_size + 1, size))
+    else:
+        ids = ranked_lists.get_or_compute(
+            key + (models,), lambda: np.asarray(rank(size), dtype=np.int64)
+        )
+    return slice_page(ids, offset, page_size)
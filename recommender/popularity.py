@@ -0,0 +1,117 @@
+"""
+Popularity fallbacks served while an engine is still being built.
+
+Every property is ranked by its interaction count once, with a single
+GROUP BY, and the ranking is kept for a TTL
+(settings.RECOMMENDER_CACHES['popular_properties']). Fallback requests,
+which arrive exactly while the worker is cold and busy building, then
+only filter in-memory arrays instead of aggregating the interaction table.
+"""
+
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count
+from real_state.models import RealState, UserInteraction
+
+
+class PopularityRanking:
+    """
+    Property ids by descending interaction count (ties by id), with the
+    columns of RealEstateRecommender's hard constraints.
+
+    The ranking is computed on first use and again once it is `ttl`
+    seconds old; one thread recomputes while the others keep using the
+    previous ranking.
+    """
+
+    def __init__(self, ttl=300, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._ranking = None
+        self._expires_at = None
+
+    @classmethod
+    def from_settings(cls, name):
+        options = getattr(settings, 'RECOMMENDER_CACHES', {}).get(name, {})
+        return cls(ttl=options.get('TTL', 300))
+
+    def _fresh(self):
+        return self._ranking is not None and self.clock() < self._expires_at
+
+    def _compute(self):
+        rows = list(
+            RealState.objects.annotate(interactions=Count('userinteraction'))
+            .order_by('-interactions', 'id')
+            .values_list('id', 'price', 'bedrooms', 'bathrooms')
+        )
+        ids, price, bedrooms, bathrooms = zip(*rows) if rows else ((), (), (), ())
+        return {
+            'ids': np.array(ids, dtype=np.int64),
+            'price': np.array(price, dtype=np.float64),
+            'bedrooms': np.array(bedrooms, dtype=np.int64),
+            'bathrooms': np.array(bathrooms, dtype=np.int64),
+        }
+
+    def get(self):
+        """
+        {'ids', 'price', 'bedrooms', 'bathrooms'} arrays in popularity order.
+        """
+        ranking = self._ranking
+        if self._fresh():
+            return ranking
+        # Only the first computation waits
+        if not self._lock.acquire(blocking=ranking is None):
+            return ranking
+        try:
+            if not self._fresh():
+                self._ranking = self._compute()
+                self._expires_at = self.clock() + self.ttl
+            return self._ranking
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        with self._lock:
+            self._ranking = self._expires_at = None
+
+
+popularity_ranking = PopularityRanking.from_settings('popular_properties')
+
+
+def popular_property_ids(top_n, user_id=None):
+    """
+    Ids of the most interacted-with properties, leaving out those the user
+    already interacted with. Served while an engine is still being built.
+    """
+    ids = popularity_ranking.get()['ids']
+    if user_id is not None:
+        seen = UserInteraction.objects.filter(user_id=user_id).values_list(
+            'property_id', flat=True
+        )
+        ids = ids[~np.isin(ids, np.fromiter(seen, dtype=np.int64))]
+    return ids[:top_n].tolist()
+
+
+def popular_properties(user_preferences, num_recommendations):
+    """
+    The most popular properties meeting the hard constraints of
+    RealEstateRecommender, as RealState.objects.values() records.
+    """
+    ranking = popularity_ranking.get()
+    eligible = (
+        (ranking['price'] <= user_preferences['budget'])
+        & (ranking['bedrooms'] >= user_preferences['min_bedrooms'])
+        & (ranking['bathrooms'] >= user_preferences['min_bathrooms'])
+    )
+    ids = ranking['ids'][eligible][:num_recommendations].tolist()
+    fields = [field.attname for field in RealState._meta.concrete_fields]
+    records = {
+        record['id']: record
+        for record in RealState.objects.filter(id__in=ids).values(*fields)
+    }
+    # Properties deleted since the ranking was computed are left out
+    return [records[property_id] for property_id in ids if property_id in records]
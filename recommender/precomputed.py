@@ -0,0 +1,158 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .collaborative_filtering import (
+    get_item_based_recommender,
+    get_user_based_recommender,
+    item_based_slot,
+    user_based_slot,
+)
+from .content_based_filtering import (
+    content_filtering_slot,
+    get_content_filtering_recommender,
+)
+from .metrics import stage
+from .models import InteractionVersion, PrecomputedRecommendation
+from .snapshots import current_version
+
+# Engines with rows in PrecomputedRecommendation
+PRECOMPUTED_ENGINES = [engine for engine, _ in PrecomputedRecommendation.ENGINES]
+
+PRECOMPUTED_SLOTS = {
+    'content': content_filtering_slot,
+    'user_cf': user_based_slot,
+    'item_cf': item_based_slot,
+}
+
+
+def model_version(engine):
+    """
+    Version of the model this process serves `engine` from: the one its
+    engine was loaded from, or while that is being built the published
+    one; '' for engines built from the database.
+    """
+    slot = PRECOMPUTED_SLOTS[engine]
+    return (slot.version if slot.ready else current_version()) or ''
+
+
+def bump_interaction_version(user_id):
+    """
+    Increment the user's InteractionVersion, in the caller's transaction.
+    """
+    versions = InteractionVersion.objects.filter(user_id=user_id)
+    if versions.update(version=F('version') + 1):
+        return
+    try:
+        # First change of the user; another transaction may create it first
+        with transaction.atomic():
+            InteractionVersion.objects.create(user_id=user_id, version=1)
+    except IntegrityError:
+        versions.update(version=F('version') + 1)
+
+
+def stored_interaction_versions(user_ids):
+    """
+    InteractionVersions of `user_ids`, in order; 0 for users who never
+    changed an interaction.
+    """
+    found = dict(
+        InteractionVersion.objects.filter(user_id__in=user_ids).values_list(
+            'user_id', 'version'
+        )
+    )
+    return [found.get(user_id, 0) for user_id in user_ids]
+
+
+def _precomputed_rows(user_id, engine, top_n):
+    # Rows of another model, or from before the user's latest interaction
+    # change, are stale
+    interaction_version = InteractionVersion.objects.filter(
+        user_id=OuterRef('user_id')
+    ).values('version')
+    return (
+        PrecomputedRecommendation.objects.filter(
+            user_id=user_id,
+            engine=engine,
+            rank__lt=top_n,
+            model_version=model_version(engine),
+            interaction_version=Coalesce(Subquery(interaction_version), Value(0)),
+        )
+        .order_by('rank')
+        .values_list('property_id', flat=True)
+    )
+
+
+def precomputed_ids(user_id, engine, top_n):
+    """
+    Property ids precomputed for the user by `engine`, best first, or None
+    when the table has no current rows for the user.
+    """
+    if user_id is None:
+        return None
+    with stage('precomputed'):
+        return list(_precomputed_rows(user_id, engine, top_n)) or None
+
+
+async def aprecomputed_ids(user_id, engine, top_n):
+    """
+    precomputed_ids through the async ORM.
+    """
+    if user_id is None:
+        return None
+    with stage('precomputed'):
+        rows = _precomputed_rows(user_id, engine, top_n)
+        return [property_id async for property_id in rows] or None
+
+
+def score_users(engine, user_ids, top_n):
+    """
+    Score `user_ids` with the process's instance of `engine`.
+
+    Returns (model version, interaction versions, [(ids, scores), ...]);
+    the model version is '' for engines built from the database rather
+    than loaded from a snapshot, and the users' interaction versions are
+    read before scoring, so changes made meanwhile make the rows stale.
+    """
+    versions = stored_interaction_versions(user_ids)
+    if engine == 'content':
+        results = get_content_filtering_recommender().get_batch_similar_property_ids(
+            user_ids, top_n, with_scores=True
+        )
+    elif engine == 'user_cf':
+        results = get_user_based_recommender().get_batch_recommended_ids(
+            user_ids, top_n, with_scores=True
+        )
+    else:
+        results = get_item_based_recommender().get_batch_recommended_ids(
+            user_ids, top_n, with_scores=True
+        )
+    return PRECOMPUTED_SLOTS[engine].version or '', versions, results
+
+
+def replace_recommendations(engine, user_ids, results, model_version, versions):
+    """
+    Replace the rows of `engine` for `user_ids` with `results` in one
+    transaction, so readers see either the old or the new ranking.
+    `versions` are the users' interaction versions the results were
+    computed under.
+    """
+    rows = [
+        PrecomputedRecommendation(
+            user_id=user_id,
+            engine=engine,
+            rank=rank,
+            property_id=property_id,
+            score=score,
+            model_version=model_version,
+            interaction_version=version,
+        )
+        for user_id, version, (ids, scores) in zip(user_ids, versions, results)
+        for rank, (property_id, score) in enumerate(zip(ids, scores))
+    ]
+    with transaction.atomic():
+        PrecomputedRecommendation.objects.filter(
+            engine=engine, user_id__in=user_ids
+        ).delete()
+        PrecomputedRecommendation.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
@@ -0,0 +1,185 @@
+import threading
+
+import numpy as np
+
+from .interaction_matrix import grow
+from .snapshots import load_array
+
+
+class PropertyStore:
+    """
+    Array-backed table of properties with amortized O(1) add and remove.
+
+    Rows live in capacity-doubling arrays and an id -> row map locates
+    them. Removing a property only tombstones its row; once tombstones make
+    up `compact_ratio` of the rows the live rows are copied into fresh
+    arrays, so the O(N) compaction is paid once per Θ(N) removals.
+
+    Only the values scoring and filtering need are held: one typed array
+    per entry of `columns` ({name: dtype}) and the scoring feature vector,
+    stored with `feature_dtype`. Full records, descriptions included, stay
+    in the database.
+    """
+
+    def __init__(
+        self, columns, n_features, feature_dtype=np.float64, compact_ratio=0.25
+    ):
+        self.columns = {column: np.dtype(dtype) for column, dtype in columns.items()}
+        self.n_features = n_features
+        self.feature_dtype = feature_dtype
+        self.compact_ratio = compact_ratio
+        self._lock = threading.RLock()
+        # Bumped whenever compaction renumbers the rows
+        self.generation = 0
+        self._reset(0)
+
+    def _reset(self, capacity):
+        self._values = {
+            column: np.zeros(capacity, dtype=dtype)
+            for column, dtype in self.columns.items()
+        }
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._features = np.zeros((capacity, self.n_features), dtype=self.feature_dtype)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._index = {}
+        self.n_rows = 0
+        self.n_removed = 0
+
+    def __len__(self):
+        return self.n_rows - self.n_removed
+
+    def __contains__(self, property_id):
+        return property_id in self._index
+
+    def _ensure_capacity(self, size):
+        for column in self.columns:
+            self._values[column] = grow(self._values[column], size)
+        self._ids = grow(self._ids, size)
+        self._features = grow(self._features, size)
+        self._alive = grow(self._alive, size)
+
+    def extend(self, ids, values, features):
+        """
+        Append many properties at once; `values` maps every column to an
+        array of the properties' values.
+        """
+        with self._lock:
+            start, stop = self.n_rows, self.n_rows + len(ids)
+            self._ensure_capacity(stop)
+            for column in self.columns:
+                self._values[column][start:stop] = values[column]
+            self._ids[start:stop] = ids
+            self._features[start:stop] = features
+            self._alive[start:stop] = True
+            self._index.update(zip(np.asarray(ids).tolist(), range(start, stop)))
+            self.n_rows = stop
+
+    def add(self, property_id, values, features):
+        """
+        Add one property, replacing any existing row with the same id;
+        `values` maps every column to its value.
+        """
+        with self._lock:
+            self.remove(property_id)
+            self.extend(
+                [property_id],
+                {column: [values[column]] for column in self.columns},
+                np.atleast_2d(features),
+            )
+
+    def remove(self, property_id):
+        """
+        Tombstone a property's row. Returns False if the id is unknown.
+        """
+        with self._lock:
+            row = self._index.pop(property_id, None)
+            if row is None:
+                return False
+            self._alive[row] = False
+            self.n_removed += 1
+            if self.n_removed > self.compact_ratio * self.n_rows:
+                self.compact()
+            return True
+
+    def compact(self):
+        """
+        Copy the live rows into fresh arrays, dropping tombstones.
+        """
+        with self._lock:
+            live = np.flatnonzero(self._alive[: self.n_rows])
+            values = {column: array[live] for column, array in self._values.items()}
+            ids, features = self._ids[live], self._features[live]
+
+            self._reset(0)
+            self._values = values
+            self._ids, self._features = ids, features
+            self._alive = np.ones(live.size, dtype=bool)
+            self._index = {
+                property_id: row for row, property_id in enumerate(ids.tolist())
+            }
+            self.n_rows = live.size
+            self.generation += 1
+
+    def snapshot_arrays(self):
+        """
+        The live rows as arrays for snapshots.save_arrays; columns are
+        saved as `column_<name>`.
+        """
+        with self._lock:
+            self.compact()
+            return {
+                'ids': self._ids,
+                'features': self._features,
+                **{f'column_{column}': array for column, array in self._values.items()},
+            }
+
+    @classmethod
+    def load(cls, path, columns, n_features, **kwargs):
+        """
+        Map a store saved from snapshot_arrays() at snapshot `path`.
+        """
+        store = cls(columns, n_features, **kwargs)
+        ids = load_array(path, 'ids')
+        store._values = {
+            column: load_array(path, f'column_{column}') for column in store.columns
+        }
+        store._ids = ids
+        store._features = load_array(path, 'features')
+        store._alive = np.ones(ids.size, dtype=bool)
+        store._index = {
+            property_id: row for row, property_id in enumerate(ids.tolist())
+        }
+        store.n_rows = ids.size
+        return store
+
+    def snapshot(self):
+        """
+        A consistent PropertySnapshot of the used rows.
+        """
+        with self._lock:
+            n = self.n_rows
+            return PropertySnapshot(
+                self.generation,
+                self._ids[:n],
+                self._features[:n],
+                self._alive[:n],
+                {column: array[:n] for column, array in self._values.items()},
+            )
+
+
+class PropertySnapshot:
+    """
+    Views over a PropertyStore's rows at one point in time.
+
+    Later adds write past the end of these views and compaction swaps in
+    new arrays, so row positions in a snapshot stay valid while the store
+    keeps changing. Removals show up through `alive`.
+    """
+
+    def __init__(self, generation, ids, features, alive, columns):
+        self.generation = generation
+        self.ids = ids
+        self.features = features
+        self.alive = alive
+        # {column: values of the rows}
+        self.columns = columns
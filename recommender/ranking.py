@@ -0,0 +1,28 @@
+import numpy as np
+
+
+def top_n_indices(scores, n, keys=None):
+    """
+    Return the positions of the n highest scores, best first.
+
+    Uses argpartition so only the selected n positions are sorted. Equal
+    scores rank in position order, or by ascending `keys` if given.
+    """
+    if n <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.intp)
+    if keys is not None:
+        keys = np.asarray(keys)
+        if np.any(keys[1:] < keys[:-1]):
+            order = np.argsort(keys, kind='stable')
+            return order[top_n_indices(scores[order], n)]
+    if scores.size > n:
+        candidates = np.argpartition(-scores, n - 1)[:n]
+        # Ties at the cut go to the lowest positions, so the best n are
+        # always a prefix of the best n + 1
+        threshold = scores[candidates].min()
+        above = np.flatnonzero(scores > threshold)
+        tied = np.flatnonzero(scores == threshold)[: n - above.size]
+        candidates = np.concatenate([above, tied])
+    else:
+        candidates = np.arange(scores.size)
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
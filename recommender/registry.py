@@ -0,0 +1,40 @@
+from .collaborative_filtering import item_based_slot, user_based_slot
+from .content_based_filtering import content_filtering_slot
+from .cosine_similarity_recommender import real_state_slot
+from .matrix_factorization import matrix_factorization_slot
+from .popularity import popularity_ranking
+from .snapshots import background_builds
+
+# Every engine of this process, by snapshot name
+ENGINE_SLOTS = {
+    slot.name: slot
+    for slot in (
+        real_state_slot,
+        content_filtering_slot,
+        user_based_slot,
+        item_based_slot,
+        matrix_factorization_slot,
+    )
+}
+
+
+def warm_up():
+    """
+    Queue the popularity ranking and then every engine on
+    background_builds, which builds them one after another so peak memory
+    stays that of a single build. Requests arriving meanwhile queue onto
+    the same thread.
+    """
+    background_builds.add('popularity', popularity_ranking.get)
+    for slot in ENGINE_SLOTS.values():
+        slot.start()
+
+
+def readiness():
+    """
+    {name: {'ready', 'version', 'error'}} of every engine.
+    """
+    return {
+        name: {'ready': slot.ready, 'version': slot.version, 'error': slot.error}
+        for name, slot in ENGINE_SLOTS.items()
+    }
@@ -0,0 +1,22 @@
+import numpy as np
+
+
+def unit_rows(matrix, dtype=np.float32):
+    """
+    Return a C-contiguous copy of `matrix` with every row scaled to unit
+    length. All-zero rows stay zero, matching sklearn's cosine_similarity.
+    """
+    matrix = np.array(matrix, dtype=dtype, order='C', ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def cosine_scores(unit_matrix, unit_query, rows=None):
+    """
+    Cosine similarity of a unit query vector against the unit rows of
+    `unit_matrix` (optionally only `rows`), as one matrix-vector product.
+    """
+    if rows is not None:
+        unit_matrix = unit_matrix[rows]
+    return unit_matrix @ unit_query.astype(unit_matrix.dtype, copy=False)
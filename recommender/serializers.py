@@ -0,0 +1,103 @@
+from django.db.models import F
+from real_state.models import RealState
+
+from .cache import RowCache
+from .metrics import stage
+
+# Fields every recommendation endpoint returns, in response order
+PROPERTY_FIELDS = (
+    'id',
+    'price',
+    'bedrooms',
+    'bathrooms',
+    'sqft',
+    'year_built',
+    'property_type',
+    'city',
+    'country',
+    'parking_spaces',
+    'has_garage',
+    'has_pool',
+    'description',
+)
+
+# Serialized rows of recently recommended properties
+property_rows = RowCache.from_settings('property_rows')
+
+
+def _property_values(property_ids):
+    return (
+        RealState.objects.filter(id__in=property_ids)
+        .values(
+            *(field for field in PROPERTY_FIELDS if field not in ('city', 'country')),
+            city=F('location__city'),
+            country=F('location__country'),
+        )
+        .order_by()
+    )
+
+
+def fetch_properties(property_ids):
+    """
+    Serialize the given properties with a single query, location included.
+    """
+    rows = _property_values(property_ids)
+    return {row['id']: {field: row[field] for field in PROPERTY_FIELDS} for row in rows}
+
+
+async def afetch_properties(property_ids):
+    """
+    fetch_properties through the async ORM.
+    """
+    return {
+        row['id']: {field: row[field] for field in PROPERTY_FIELDS}
+        async for row in _property_values(property_ids)
+    }
+
+
+def serialize_property_map(property_ids):
+    """
+    {id: serialized row} of the given properties.
+
+    Rows come from the hot-row cache when possible; the rest are fetched
+    together in one query. Ids that no longer exist are left out.
+    """
+    property_ids = list(property_ids)
+    with stage('serialize'):
+        rows = property_rows.get_many(property_ids)
+        missing = [
+            property_id for property_id in property_ids if property_id not in rows
+        ]
+        if missing:
+            fetched = fetch_properties(missing)
+            property_rows.set_many(fetched)
+            rows.update(fetched)
+    return rows
+
+
+def serialize_properties(property_ids):
+    """
+    Serialize properties in the order of `property_ids`, skipping ids that
+    no longer exist.
+    """
+    property_ids = list(property_ids)
+    rows = serialize_property_map(property_ids)
+    return [rows[property_id] for property_id in property_ids if property_id in rows]
+
+
+async def aserialize_properties(property_ids):
+    """
+    serialize_properties with the missing rows fetched through the async
+    ORM.
+    """
+    property_ids = list(property_ids)
+    with stage('serialize'):
+        rows = property_rows.get_many(property_ids)
+        missing = [
+            property_id for property_id in property_ids if property_id not in rows
+        ]
+        if missing:
+            fetched = await afetch_properties(missing)
+            property_rows.set_many(fetched)
+            rows.update(fetched)
+    return [rows[property_id] for property_id in property_ids if property_id in rows]
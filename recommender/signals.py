@@ -1,39 +1,104 @@
-# from django.db.models.signals import post_save, post_delete
-# from django.dispatch import receiver
-# from real_state.models import RealState
-
-# from .cosine_similarity_recommender import get_real_state_recommender
-
-
-# @receiver(post_save, sender=RealState)
-# def handle_property_save(sender, instance, created, **kwargs):
-#     real_state_recommender = get_real_state_recommender()
-#     # Create the property data from the instance
-#     property_data = {
-#         'id': instance.id,
-#         'price': instance.price,
-#         'bedrooms': instance.bedrooms,
-#         'bathrooms': instance.bathrooms,
-#         'sqft': instance.sqft,
-#         'year_built': instance.year_built,
-#         'parking_spaces': instance.parking_spaces,
-#     }
-
-#     if created:
-#         # Add the property if it's a new one
-#         real_state_recommender.add_property(property_data)
-#     else:
-#         # Remove the old property if it's an update
-#         real_state_recommender.remove_property(instance.id)
-#         # Add the updated property
-#         real_state_recommender.add_property(property_data)
-
-
-# @receiver(post_delete, sender=RealState)
-# def handle_property_delete(sender, instance, **kwargs):
-#     real_state_recommender = get_real_state_recommender()
-#     try:
-#         # Remove the property from the recommender
-#         real_state_recommender.remove_property(instance.id)
-#     except:
-#         pass
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from real_state.models import Location, RealState, UserInteraction
+
+from . import (
+    collaborative_filtering,
+    cosine_similarity_recommender,
+    matrix_factorization,
+)
+from .cache import interaction_versions
+from .interaction_loader import INTERACTION_WEIGHTS
+from .models import InteractionChange
+from .precomputed import bump_interaction_version
+from .serializers import property_rows
+
+
+def _apply_interaction(user_id, property_id, weight, created=None):
+    # Only engines already built in this process need the delta; the
+    # others will read the committed row when they are first loaded.
+    for recommender in (
+        collaborative_filtering.user_based_slot.engine,
+        collaborative_filtering.item_based_slot.engine,
+        matrix_factorization.matrix_factorization_slot.engine,
+    ):
+        if recommender is not None:
+            recommender.apply_interaction(user_id, property_id, weight, created)
+
+    # Cached per-user results computed before this change are now stale
+    interaction_versions.bump(user_id)
+
+
+@receiver(post_save, sender=UserInteraction)
+def handle_interaction_save(sender, instance, **kwargs):
+    # Logged in the change's transaction, for workers loading snapshots
+    # and serving precomputed rows
+    InteractionChange.objects.create(
+        user_id=instance.user_id, property_id=instance.property_id
+    )
+    bump_interaction_version(instance.user_id)
+    weight = INTERACTION_WEIGHTS.get(instance.interaction_type, 0)
+    created = instance.timestamp.timestamp()
+    transaction.on_commit(
+        lambda: _apply_interaction(
+            instance.user_id, instance.property_id, weight, created
+        )
+    )
+
+
+@receiver(post_delete, sender=UserInteraction)
+def handle_interaction_delete(sender, instance, **kwargs):
+    InteractionChange.objects.create(
+        user_id=instance.user_id, property_id=instance.property_id
+    )
+    bump_interaction_version(instance.user_id)
+    transaction.on_commit(
+        lambda: _apply_interaction(instance.user_id, instance.property_id, 0)
+    )
+
+
+def _property_data(instance):
+    # Same keys as RealState.objects.values()
+    return {
+        field.attname: getattr(instance, field.attname)
+        for field in RealState._meta.concrete_fields
+    }
+
+
+@receiver(post_save, sender=RealState)
+def handle_property_save(sender, instance, created, **kwargs):
+    property_rows.invalidate(instance.id)
+    cosine_similarity_recommender.record_cache.invalidate(instance.id)
+
+    real_state_recommender = cosine_similarity_recommender.real_state_slot.engine
+    if real_state_recommender is None:
+        # Not loaded yet; it will pick the property up from the database
+        return
+
+    # Create the property data from the instance
+    property_data = _property_data(instance)
+
+    # add_property replaces the old row when the property is updated
+    transaction.on_commit(lambda: real_state_recommender.add_property(property_data))
+
+
+@receiver(post_delete, sender=RealState)
+def handle_property_delete(sender, instance, **kwargs):
+    property_rows.invalidate(instance.id)
+    cosine_similarity_recommender.record_cache.invalidate(instance.id)
+
+    real_state_recommender = cosine_similarity_recommender.real_state_slot.engine
+    if real_state_recommender is None:
+        return
+
+    property_id = instance.id
+    # Remove the property from the recommender
+    transaction.on_commit(lambda: real_state_recommender.remove_property(property_id))
+
+
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+def handle_location_change(sender, instance, **kwargs):
+    # Serialized rows embed the city and country
+    property_rows.clear()
@@ -0,0 +1,441 @@
+"""
+On-disk model snapshots shared by every worker process on a host.
+
+A snapshot is a versioned directory under settings.RECOMMENDER_MODEL_DIR
+holding one sub-directory per engine. Each engine directory contains its
+arrays as individual .npy files plus a meta.json. Arrays are opened with
+mmap_mode='c' (copy-on-write), so all workers share the same page-cache
+pages until one of them modifies an array in place.
+
+The CURRENT file in the model directory names the version to load;
+`manage.py build_recommender_models` writes new versions and running
+workers pick them up through EngineSlot.
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+from scipy.sparse import csc_matrix, csr_matrix
+from sklearn.preprocessing import MinMaxScaler
+
+from .metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of saved engines changes; older snapshots are then
+# ignored and the engines are rebuilt from the database.
+SNAPSHOT_FORMAT = 4
+
+SCALER_ATTRIBUTES = (
+    'data_min_',
+    'data_max_',
+    'data_range_',
+    'scale_',
+    'min_',
+)
+
+
+def model_dir():
+    return Path(
+        getattr(
+            settings,
+            'RECOMMENDER_MODEL_DIR',
+            settings.BASE_DIR / 'recommender_models',
+        )
+    )
+
+
+def current_version():
+    """
+    Name of the version CURRENT points at, or None.
+    """
+    try:
+        return (model_dir() / 'CURRENT').read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def engine_path(name, version=None):
+    """
+    Directory of engine `name` in `version` (default: the current one), or
+    None when there is no such snapshot.
+    """
+    version = version or current_version()
+    if version is None:
+        return None
+    path = model_dir() / version / name
+    return path if (path / 'meta.json').exists() else None
+
+
+def save_arrays(path, arrays, meta=None):
+    """
+    Write each array to path/<name>.npy and `meta` to path/meta.json.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        np.save(path / f'{name}.npy', array, allow_pickle=array.dtype == object)
+    meta = dict(meta or {}, format=SNAPSHOT_FORMAT, saved_at=time.time())
+    (path / 'meta.json').write_text(json.dumps(meta))
+
+
+def load_meta(path):
+    meta = json.loads((Path(path) / 'meta.json').read_text())
+    if meta.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format in {path}")
+    return meta
+
+
+def load_array(path, name):
+    """
+    Memory-map path/<name>.npy copy-on-write. Object arrays cannot be
+    mapped and are read into memory.
+    """
+    filename = Path(path) / f'{name}.npy'
+    try:
+        return np.load(filename, mmap_mode='c')
+    except ValueError:
+        return np.load(filename, allow_pickle=True)
+
+
+def sparse_arrays(prefix, matrix):
+    """
+    The arrays of a CSR/CSC matrix, named for save_arrays.
+    """
+    return {
+        f'{prefix}_data': matrix.data,
+        f'{prefix}_indices': matrix.indices,
+        f'{prefix}_indptr': matrix.indptr,
+        f'{prefix}_shape': np.array(matrix.shape, dtype=np.int64),
+    }
+
+
+def load_sparse(path, prefix, format='csr'):
+    shape = tuple(int(n) for n in load_array(path, f'{prefix}_shape'))
+    arrays = (
+        load_array(path, f'{prefix}_data'),
+        load_array(path, f'{prefix}_indices'),
+        load_array(path, f'{prefix}_indptr'),
+    )
+    matrix_class = csr_matrix if format == 'csr' else csc_matrix
+    # copy=False keeps the mapped buffers instead of reading them in
+    return matrix_class(arrays, shape=shape, copy=False)
+
+
+def scaler_arrays(prefix, scaler):
+    return {
+        f'{prefix}_{attribute}': getattr(scaler, attribute)
+        for attribute in SCALER_ATTRIBUTES
+    }
+
+
+def scaler_meta(scaler):
+    return {
+        'feature_range': list(scaler.feature_range),
+        'n_samples_seen': int(scaler.n_samples_seen_),
+    }
+
+
+def load_scaler(path, prefix, meta):
+    """
+    Rebuild a fitted MinMaxScaler from scaler_arrays/scaler_meta output.
+    """
+    scaler = MinMaxScaler(feature_range=tuple(meta['feature_range']))
+    for attribute in SCALER_ATTRIBUTES:
+        setattr(scaler, attribute, np.array(load_array(path, f'{prefix}_{attribute}')))
+    scaler.n_samples_seen_ = meta['n_samples_seen']
+    scaler.n_features_in_ = scaler.scale_.size
+    return scaler
+
+
+def load_or_build(name, engine_class, version=None):
+    """
+    Load engine `name` from `version` (default: the current one) if there
+    is such a snapshot, falling back to building it from the database.
+    """
+    path = engine_path(name, version)
+    if path is not None:
+        try:
+            start = time.perf_counter()
+            engine = engine_class.load(path)
+            logger.info(
+                "Loaded %s from %s in %.2fs", name, path, time.perf_counter() - start
+            )
+            return engine
+        except (OSError, ValueError, KeyError):
+            logger.exception("Could not load %s from %s, rebuilding", name, path)
+    return engine_class()
+
+
+def new_version():
+    return datetime.now().strftime('v%Y%m%d%H%M%S%f')
+
+
+def staging_path(version):
+    """
+    Directory engines of an unpublished `version` are saved into.
+    """
+    return model_dir() / f'.{version}.tmp'
+
+
+def copy_engine(name, source_version, version):
+    """
+    Stage engine `name` of `source_version` unchanged into `version`.
+    """
+    shutil.copytree(model_dir() / source_version / name, staging_path(version) / name)
+
+
+def publish_version(version):
+    """
+    Move a staged version into place and point CURRENT at it.
+
+    Both steps are renames, so readers only ever see complete versions.
+    """
+    root = model_dir()
+    os.replace(staging_path(version), root / version)
+
+    pointer = root / '.CURRENT.tmp'
+    pointer.write_text(version)
+    os.replace(pointer, root / 'CURRENT')
+
+
+def write_version(engines, version=None):
+    """
+    Save {name: engine} as a new version and point CURRENT at it.
+    """
+    version = version or new_version()
+    for name, engine in engines.items():
+        engine.save(staging_path(version) / name)
+    publish_version(version)
+    return version
+
+
+def prune_versions(keep):
+    """
+    Delete all but the `keep` newest versions, never the current one.
+    Workers that still map files of a deleted version keep reading them
+    until they swap.
+    """
+    current = current_version()
+    versions = sorted(
+        path
+        for path in model_dir().iterdir()
+        if path.is_dir() and path.name.startswith('v')
+    )
+    for path in versions[: max(len(versions) - keep, 0)]:
+        if path.name != current:
+            shutil.rmtree(path)
+
+
+def oldest_changes_mark():
+    """
+    Lowest InteractionChange mark saved by an engine of a version on disk,
+    or None if no engine saved one. Loading any of them only replays the
+    changes after it.
+    """
+    marks = []
+    for meta_path in model_dir().glob('v*/*/meta.json'):
+        meta = json.loads(meta_path.read_text())
+        if 'changes_mark' in meta:
+            marks.append(meta['changes_mark'])
+    return min(marks, default=None)
+
+
+def reload_interval():
+    return getattr(settings, 'RECOMMENDER_RELOAD_INTERVAL', 5)
+
+
+class BackgroundBuilds:
+    """
+    Runs engine builds and loads one after another in a single background
+    thread, so however many are requested at once peak memory stays that
+    of one build. A job is not queued again while it is still queued or
+    running under the same key.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        # {key: function} in the order they run
+        self._jobs = {}
+        self._thread = None
+
+    def add(self, key, function):
+        with self._lock:
+            if key in self._jobs:
+                return
+            self._jobs[key] = function
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=self.name, daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._jobs:
+                    self._thread = None
+                    return
+                key, function = next(iter(self._jobs.items()))
+            try:
+                function()
+            except Exception:
+                logger.exception("Background job %s failed", key)
+            finally:
+                # Not a request thread: release its database connection
+                close_old_connections()
+                with self._lock:
+                    del self._jobs[key]
+
+    def join(self, timeout=None):
+        """
+        Wait until every queued job has run.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                thread = self._thread
+            if thread is None:
+                return
+            thread.join(None if deadline is None else deadline - time.monotonic())
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+
+
+background_builds = BackgroundBuilds('recommender-warm-up')
+
+
+class EngineSlot:
+    """
+    Holds a process's instance of one engine and swaps in the new version
+    once CURRENT moves on.
+
+    The first build is single-flighted: one thread builds while the others
+    wait for it, or with get(wait=False) return None at once so callers can
+    serve a fallback while start() queues the build on background_builds.
+
+    CURRENT is checked at most every settings.RECOMMENDER_RELOAD_INTERVAL
+    seconds; engines with an interaction window expire cells at the same
+    checks. A new version is loaded by reload() on background_builds,
+    never on a request thread, and swapped in once it is completely
+    loaded; until then every request gets the old engine, and in-flight
+    requests finish on the model they started with.
+    """
+
+    def __init__(self, name, engine_class):
+        self.name = name
+        self.engine_class = engine_class
+        self.engine = None
+        self.version = None
+        # repr of the last build failure, cleared by a successful build
+        self.error = None
+        self._checked_at = None
+        self._failed_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.engine is not None
+
+    def _due(self):
+        return (
+            self._checked_at is None
+            or time.monotonic() - self._checked_at >= reload_interval()
+        )
+
+    def get(self, wait=True):
+        engine = self.engine
+        if engine is not None and not self._due():
+            return engine
+        if engine is None and not wait:
+            self.start()
+            return None
+
+        # Only the first build waits; checks happen in one thread while
+        # the others keep using the current engine.
+        if not self._lock.acquire(blocking=engine is None):
+            return engine
+        try:
+            if self.engine is None:
+                self._checked_at = time.monotonic()
+                self._load(current_version())
+            elif self._due():
+                self._checked_at = time.monotonic()
+                if current_version() != self.version:
+                    # Loaded off the request thread, swapped in when done
+                    background_builds.add(self.name, self.reload)
+                elif hasattr(self.engine, 'expire_interactions'):
+                    # Drop interactions that have left the time window
+                    self.engine.expire_interactions()
+            return self.engine
+        except Exception as exc:
+            self.error = repr(exc)
+            self._failed_at = time.monotonic()
+            raise
+        finally:
+            self._lock.release()
+
+    def _load(self, version):
+        with stage('model_load'):
+            engine = load_or_build(self.name, self.engine_class, version)
+        self.engine = engine
+        # Recorded even if the load fell back to a build, so a broken
+        # snapshot is not retried on every check
+        self.version = version
+        self.error = None
+
+    def reload(self):
+        """
+        Load the version CURRENT points at and swap it in, unless it is
+        already the one being served. Runs on background_builds.
+        """
+        # Requests do not wait for the lock while an engine is served
+        with self._lock:
+            version = current_version()
+            if version == self.version:
+                return
+            try:
+                self._load(version)
+            except Exception as exc:
+                self.error = repr(exc)
+                self._failed_at = time.monotonic()
+                # Not retried until CURRENT moves on again
+                self.version = version
+                raise
+
+    def start(self):
+        """
+        Queue a build on background_builds unless the engine is ready,
+        queued, or failed less than RECOMMENDER_RELOAD_INTERVAL seconds ago.
+        """
+        if self.engine is not None:
+            return
+        if (
+            self._failed_at is not None
+            and time.monotonic() - self._failed_at < reload_interval()
+        ):
+            return
+        background_builds.add(self.name, self.warm_up)
+
+    def warm_up(self):
+        """
+        Build the engine now, logging instead of raising on failure.
+        """
+        try:
+            self.get()
+        except Exception:
+            logger.exception("Building %s failed", self.name)
+        finally:
+            # Not a request thread: release its database connection
+            close_old_connections()
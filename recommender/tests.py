@@ -1,3 +1,1898 @@
-from django.test import TestCase
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from sklearn.metrics.pairwise import cosine_similarity
+
+from real_state.models import Feature, Location, RealState, UserInteraction
+
+from .ann import IVFIndex
+from .async_views import run_scoring
+from .cache import RecommendationCache, interaction_versions
+from .collaborative_filtering import SCORE_DECIMALS, ItemBasedCF, UserBasedCF
+from .constraint_index import ConstraintIndex
+from .content_based_filtering import ContentFiltering
+from .cosine_similarity_recommender import RealEstateRecommender
+from .hybrid import HybridRecommender
+from .interaction_loader import INTERACTION_WEIGHTS, change_mark, load_interactions
+from .interaction_matrix import InteractionMatrix
+from .interaction_window import DAY_SECONDS, InteractionWindow
+from .matrix_factorization import MatrixFactorization
+from .metrics import request_errors
+from .models import InteractionChange, PrecomputedRecommendation
+from .pagination import InvalidPage, encode_cursor, ranked_lists, ranked_page
+from .precomputed import (
+    model_version,
+    precomputed_ids,
+    replace_recommendations,
+    stored_interaction_versions,
+)
+from .popularity import (
+    PopularityRanking,
+    popular_properties,
+    popular_property_ids,
+    popularity_ranking,
+)
+from .property_store import PropertyStore
+from .ranking import top_n_indices
+from .registry import ENGINE_SLOTS
+from .scoring import cosine_scores, unit_rows
+from .serializers import (
+    PROPERTY_FIELDS,
+    aserialize_properties,
+    property_rows,
+    serialize_properties,
+)
+from .snapshots import (
+    BackgroundBuilds,
+    EngineSlot,
+    current_version,
+    engine_path,
+    load_meta,
+    model_dir,
+    new_version,
+    oldest_changes_mark,
+    publish_version,
+    save_arrays,
+    staging_path,
+)
+
+INTERACTION_TYPES = list(INTERACTION_WEIGHTS)
+
+
+def create_catalog(rng, n_properties=60, n_users=30, per_user=8):
+    """
+    Seeded properties, users and interactions; returns (user ids,
+    property ids).
+    """
+    location = Location.objects.create(city='Lisbon', country='Portugal')
+    properties = RealState.objects.bulk_create(
+        RealState(
+            price=Decimal(rng.randint(50, 900) * 1000),
+            bedrooms=rng.randint(1, 5),
+            bathrooms=rng.randint(1, 3),
+            sqft=Decimal(rng.randint(400, 4000)),
+            year_built=rng.randint(1950, 2024),
+            location=location,
+            parking_spaces=rng.randint(0, 3),
+            has_garage=rng.random() < 0.5,
+            has_pool=rng.random() < 0.3,
+        )
+        for _ in range(n_properties)
+    )
+    users = User.objects.bulk_create(User(username=f'user{i}') for i in range(n_users))
+    UserInteraction.objects.bulk_create(
+        UserInteraction(
+            user=user,
+            property=property,
+            interaction_type=rng.choice(INTERACTION_TYPES),
+        )
+        for user in users
+        # Popular properties first, so neighbourhoods overlap
+        for property in rng.sample(properties[: n_properties // 2], per_user)
+    )
+    return [user.id for user in users], [property.id for property in properties]
+
+
+def change_interaction(rng, user_ids, property_ids):
+    """
+    Create, update or delete a random interaction; returns (user id,
+    property id, weight) as the signal handlers pass it to the engines.
+    """
+    user_id, property_id = rng.choice(user_ids), rng.choice(property_ids)
+    interaction = UserInteraction.objects.filter(
+        user_id=user_id, property_id=property_id
+    ).first()
+    if interaction is not None and rng.random() < 0.4:
+        interaction.delete()
+        return user_id, property_id, 0
+    if interaction is None:
+        interaction = UserInteraction(user_id=user_id, property_id=property_id)
+    interaction.interaction_type = rng.choice(INTERACTION_TYPES)
+    interaction.save()
+    return user_id, property_id, INTERACTION_WEIGHTS[interaction.interaction_type]
+
+
+def matrix_cells(interactions):
+    """
+    {(user id, property id): weight} of an InteractionMatrix.
+    """
+    matrix = interactions.to_csr().tocoo()
+    return {
+        (interactions.user_ids[row], interactions.property_ids[col]): weight
+        for row, col, weight in zip(matrix.row, matrix.col, matrix.data)
+    }
+
+
+def neighbour_lists(recommender):
+    """
+    {property id: {neighbour id: score}} of an ItemBasedCF index.
+    """
+    property_ids = recommender.interactions.property_ids.tolist()
+    return {
+        property_id: {
+            property_ids[neighbour]: float(score)
+            for neighbour, score in zip(
+                recommender.neighbour_indices[col], recommender.neighbour_scores[col]
+            )
+            if neighbour >= 0
+        }
+        for col, property_id in enumerate(property_ids)
+    }
+
+
+def authenticate(client, user):
+    """
+    Send `user`'s token with every request of `client`.
+    """
+    token, _ = Token.objects.get_or_create(user=user)
+    client.defaults['HTTP_AUTHORIZATION'] = f'Token {token.key}'
+
+
+def reset_engines():
+    """
+    Drop the process's engines and the caches outliving a test database.
+    """
+    for slot in ENGINE_SLOTS.values():
+        slot.engine = slot.version = slot.error = None
+        slot._checked_at = slot._failed_at = None
+    ranked_lists.clear()
+    property_rows.clear()
+    popularity_ranking.clear()
+
+
+class ServingMixin:
+    """
+    Engines built from the test database on demand, with no snapshots.
+    """
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(RECOMMENDER_MODEL_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        reset_engines()
+        self.addCleanup(reset_engines)
+
+    def build_engines(self, *names):
+        for name in names:
+            ENGINE_SLOTS[name].get()
+
+
+class InteractionMatrixTests(SimpleTestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        dense = self.rng.choice([0, 0, 0, 1, 2, 3], size=(12, 9)).astype(float)
+        self.user_ids = list(range(100, 112))
+        self.property_ids = list(range(200, 209))
+        self.cells = {
+            (self.user_ids[row], self.property_ids[col]): dense[row, col]
+            for row, col in zip(*np.nonzero(dense))
+        }
+        self.matrix = InteractionMatrix(
+            self.user_ids, self.property_ids, dense, max_pending=7
+        )
+
+    def assert_matches_cells(self, matrix):
+        self.assertEqual(matrix_cells(matrix), self.cells)
+        dense = matrix.to_csr().toarray()
+        for row in range(matrix.n_users):
+            cols, weights = matrix.row(row)
+            np.testing.assert_array_equal(dense[row, cols], weights)
+            self.assertEqual(cols.size, np.count_nonzero(dense[row]))
+        rows, positions, weights = matrix.columns(np.arange(matrix.n_properties))
+        np.testing.assert_array_equal(dense[rows, positions], weights)
+        self.assertEqual(weights.size, np.count_nonzero(dense))
+        np.testing.assert_array_equal(matrix.item_counts, (dense != 0).sum(axis=0))
+        np.testing.assert_allclose(matrix.item_weight_sums, dense.sum(axis=0))
+        np.testing.assert_allclose(matrix.user_norms, np.linalg.norm(dense, axis=1))
+
+    def test_updates_through_overlay_and_compaction(self):
+        # New users and properties are appended past the base matrix
+        user_ids = self.user_ids + [300, 301]
+        property_ids = self.property_ids + [400, 401]
+        compactions = 0
+        for _ in range(60):
+            cell = (int(self.rng.choice(user_ids)), int(self.rng.choice(property_ids)))
+            weight = float(self.rng.choice([0, 1, 2, 3]))
+            pending = self.matrix.pending
+            self.matrix.set(*cell, weight)
+            # Reaching max_pending merges the overlay into the base
+            compactions += pending == 6 and self.matrix.pending == 0
+            if weight:
+                self.cells[cell] = weight
+            else:
+                self.cells.pop(cell, None)
+            self.assert_matches_cells(self.matrix)
+        self.assertGreater(compactions, 0)
+
+    def test_setting_the_base_weight_drops_the_patch(self):
+        (user_id, property_id), weight = next(iter(self.cells.items()))
+        self.matrix.set(user_id, property_id, weight + 1)
+        self.assertEqual(self.matrix.pending, 1)
+        self.matrix.set(user_id, property_id, weight)
+        self.assertEqual(self.matrix.pending, 0)
+        self.assert_matches_cells(self.matrix)
+
+    def test_snapshot_round_trip(self):
+        for user_id, property_id in [(100, 200), (300, 201), (101, 400)]:
+            self.matrix.set(user_id, property_id, 2)
+            self.cells[user_id, property_id] = 2
+        with tempfile.TemporaryDirectory() as directory:
+            save_arrays(directory, self.matrix.snapshot_arrays())
+            loaded = InteractionMatrix.load(directory)
+            self.assert_matches_cells(loaded)
+            loaded.set(300, 200, 3)
+            self.cells[300, 200] = 3
+            self.assert_matches_cells(loaded)
+
+
+STORE_COLUMNS = {'price': np.float64, 'bedrooms': np.int64, 'bathrooms': np.int64}
+
+
+class StoreMixin:
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.store = PropertyStore(STORE_COLUMNS, 2)
+
+    def add(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        self.store.extend(
+            ids,
+            {
+                'price': self.rng.uniform(1e5, 1e6, ids.size),
+                'bedrooms': self.rng.integers(1, 6, ids.size),
+                'bathrooms': self.rng.integers(1, 4, ids.size),
+            },
+            self.rng.random((ids.size, 2)),
+        )
+
+
+class PropertyStoreTests(StoreMixin, SimpleTestCase):
+
+    def live_ids(self, snapshot):
+        return set(snapshot.ids[snapshot.alive].tolist())
+
+    def test_removal_tombstones_until_compaction(self):
+        self.add(range(20))
+        before = self.store.snapshot()
+        for property_id in range(5):
+            self.assertTrue(self.store.remove(property_id))
+        self.assertFalse(self.store.remove(0))
+
+        # 5 of 20 rows is the compaction ratio, not past it
+        self.assertEqual(self.store.generation, 0)
+        self.assertEqual(self.store.n_rows, 20)
+        self.assertEqual(len(self.store), 15)
+        self.assertNotIn(0, self.store)
+        self.assertEqual(self.live_ids(self.store.snapshot()), set(range(5, 20)))
+
+        self.store.remove(5)
+        self.assertEqual(self.store.generation, 1)
+        self.assertEqual(self.store.n_rows, 14)
+        snapshot = self.store.snapshot()
+        self.assertEqual(self.live_ids(snapshot), set(range(6, 20)))
+        self.assertTrue(snapshot.alive.all())
+        # Rows of an older snapshot keep their positions
+        self.assertEqual(before.ids.tolist(), list(range(20)))
+
+    def test_add_replaces_a_row(self):
+        self.add(range(4))
+        self.store.add(2, {'price': 1.0, 'bedrooms': 9, 'bathrooms': 9}, [0.5, 0.5])
+        snapshot = self.store.snapshot()
+        self.assertEqual(len(self.store), 4)
+        row = np.flatnonzero(snapshot.alive & (snapshot.ids == 2))
+        self.assertEqual(snapshot.columns['bedrooms'][row].tolist(), [9])
+
+    def test_snapshot_round_trip(self):
+        self.add(range(10))
+        self.store.remove(3)
+        expected = self.store.snapshot()
+        expected_rows = {
+            property_id: (expected.features[row], expected.columns['price'][row])
+            for row, property_id in enumerate(expected.ids.tolist())
+            if expected.alive[row]
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            save_arrays(directory, self.store.snapshot_arrays())
+            loaded = PropertyStore.load(directory, STORE_COLUMNS, 2)
+            snapshot = loaded.snapshot()
+            self.assertEqual(set(snapshot.ids.tolist()), set(expected_rows))
+            for row, property_id in enumerate(snapshot.ids.tolist()):
+                features, price = expected_rows[property_id]
+                np.testing.assert_array_equal(snapshot.features[row], features)
+                self.assertEqual(snapshot.columns['price'][row], price)
+
+
+class ConstraintIndexTests(StoreMixin, SimpleTestCase):
+    def assert_candidates_match(self, index, snapshot):
+        columns = snapshot.columns
+        for budget in (1e5, 3e5, 6e5, 2e6):
+            for min_bedrooms in range(0, 7):
+                for min_bathrooms in range(0, 5):
+                    expected = np.flatnonzero(
+                        snapshot.alive
+                        & (columns['price'] <= budget)
+                        & (columns['bedrooms'] >= min_bedrooms)
+                        & (columns['bathrooms'] >= min_bathrooms)
+                    )
+                    rows = index.candidates(
+                        snapshot, budget, min_bedrooms, min_bathrooms
+                    )
+                    self.assertEqual(sorted(rows.tolist()), expected.tolist())
+
+    def test_candidates_match_a_scan(self):
+        # 77 rows leave a partial last byte in the bitsets
+        self.add(range(77))
+        index = ConstraintIndex(self.store.snapshot())
+        self.assert_candidates_match(index, self.store.snapshot())
+
+    def test_appended_and_removed_rows(self):
+        self.add(range(50))
+        index = ConstraintIndex(self.store.snapshot())
+        self.add(range(50, 54))
+        self.store.remove(10)
+        snapshot = self.store.snapshot()
+        self.assertFalse(index.stale(snapshot))
+        self.assert_candidates_match(index, snapshot)
+
+        self.add(range(54, 60))
+        self.assertTrue(index.stale(self.store.snapshot()))
+
+    def test_compaction_makes_the_index_stale(self):
+        self.add(range(20))
+        index = ConstraintIndex(self.store.snapshot())
+        for property_id in range(6):
+            self.store.remove(property_id)
+        self.assertTrue(index.stale(self.store.snapshot()))
+
+
+class ScoringTests(SimpleTestCase):
+    def test_kernel_matches_sklearn_cosine_similarity(self):
+        rng = np.random.default_rng(0)
+        matrix = rng.normal(size=(40, 6))
+        matrix[3] = 0
+        query = rng.normal(size=6)
+        rows = np.array([0, 3, 7, 39])
+
+        unit = unit_rows(matrix)
+        self.assertEqual(unit.dtype, np.float32)
+        self.assertTrue(unit.flags['C_CONTIGUOUS'])
+        expected = cosine_similarity(matrix, query[None, :]).ravel()
+        scores = cosine_scores(unit, unit_rows(query)[0])
+        np.testing.assert_allclose(scores, expected, atol=1e-6)
+        np.testing.assert_allclose(
+            cosine_scores(unit, unit_rows(query)[0], rows), expected[rows], atol=1e-6
+        )
+        self.assertEqual(scores[3], 0)
+
+
+class RankingTests(SimpleTestCase):
+    def test_top_n_matches_a_stable_sort(self):
+        rng = np.random.default_rng(0)
+        for _ in range(50):
+            # Few distinct values, so ties are common
+            scores = rng.integers(0, 5, size=rng.integers(1, 30)).astype(float)
+            keys = rng.permutation(scores.size)
+            order = sorted(range(scores.size), key=lambda i: -scores[i])
+            by_key = sorted(range(scores.size), key=lambda i: (-scores[i], keys[i]))
+            for n in (0, 1, 3, scores.size, scores.size + 2):
+                self.assertEqual(top_n_indices(scores, n).tolist(), order[:n])
+                self.assertEqual(top_n_indices(scores, n, keys).tolist(), by_key[:n])
+
+
+class IVFIndexTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.matrix = unit_rows(rng.normal(size=(500, 8))).astype(np.float32)
+        self.queries = unit_rows(rng.normal(size=(10, 8))).astype(np.float32)
+        self.allowed = rng.random(500) < 0.5
+
+    def exact(self, query, n, allowed):
+        rows = np.flatnonzero(allowed)
+        return rows[top_n_indices(self.matrix[rows] @ query, n)]
+
+    def test_probing_every_list_is_exact(self):
+        for quantize in (False, True):
+            index = IVFIndex(
+                self.matrix, n_lists=16, n_probe=16, quantize=quantize, rerank=50
+            )
+            for query in self.queries:
+                rows, _ = index.search(self.matrix, query, 10, self.allowed)
+                self.assertEqual(
+                    rows.tolist(), self.exact(query, 10, self.allowed).tolist()
+                )
+
+    def test_rows_appended_after_the_build_are_searched(self):
+        index = IVFIndex(self.matrix[:400], n_lists=16, n_probe=1)
+        everything = np.ones(500, dtype=bool)
+        for query in self.queries:
+            rows, _ = index.search(self.matrix, query, 5)
+            best = self.exact(query, 5, everything)
+            # Appended rows are scored exactly, whichever lists are probed
+            self.assertTrue(set(best[best >= 400]) <= set(rows.tolist()))
+
+    def test_too_few_allowed_rows_fall_back(self):
+        index = IVFIndex(self.matrix, n_lists=16, n_probe=1)
+        allowed = np.zeros(500, dtype=bool)
+        allowed[:3] = True
+        self.assertIsNone(index.search(self.matrix, self.queries[0], 5, allowed))
+
+    def test_settings(self):
+        self.assertIsNone(IVFIndex.from_settings('real_state', self.matrix))
+        options = {'real_state': {'ENABLED': True, 'MIN_ROWS': 1000}}
+        with override_settings(RECOMMENDER_ANN=options):
+            self.assertIsNone(IVFIndex.from_settings('real_state', self.matrix))
+        options['real_state']['MIN_ROWS'] = 100
+        with override_settings(RECOMMENDER_ANN=options):
+            index = IVFIndex.from_settings('real_state', self.matrix)
+        self.assertEqual(index.n_lists, int(np.sqrt(500)))
+
+
+@override_settings(RECOMMENDER_PAGINATION={'RANKED_LIST_SIZE': 23})
+class PaginationTests(SimpleTestCase):
+    def setUp(self):
+        ranked_lists.clear()
+        self.calls = []
+
+    def rank(self, n):
+        self.calls.append(n)
+        return list(range(1000, 1000 + n))
+
+    def page(self, **params):
+        return ranked_page(params, (None, 'test'), (), self.rank)
+
+    def test_pages_walk_the_ranking_once(self):
+        ids, cursor = self.page(page_size='5')
+        pages = [ids]
+        while cursor is not None:
+            ids, cursor = self.page(page_size='5', cursor=cursor)
+            pages.append(ids)
+        self.assertEqual([len(page) for page in pages], [5, 5, 5, 5, 3])
+        self.assertEqual(sum(pages, []), list(range(1000, 1023)))
+        self.assertEqual(self.calls, [23])
+
+    def test_cursor_past_the_ranking(self):
+        self.assertEqual(self.page(cursor=encode_cursor(23)), ([], None))
+
+    def test_invalid_parameters(self):
+        for params in (
+            {'cursor': 'not a cursor'},
+            {'cursor': encode_cursor(-1)},
+            {'page_size': '0'},
+            {'page_size': '101'},
+            {'page_size': 'five'},
+        ):
+            with self.subTest(params=params), self.assertRaises(InvalidPage):
+                self.page(**params)
+
+    def test_unready_engine_ranks_only_the_page(self):
+        # No engine is built in the tests, so the ranking is not cached
+        for _ in range(2):
+            ids, cursor = ranked_page(
+                {'page_size': '4'}, (None, 'test'), ('item_based_cf',), self.rank
+            )
+            self.assertEqual(ids, list(range(1000, 1004)))
+        self.assertEqual(self.calls, [5, 5])
+
+
+class RecommendationCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.cache = RecommendationCache(maxsize=2, ttl=10, clock=lambda: self.now)
+        self.user_id = -1
+
+    def test_hits_and_invalidation(self):
+        values = iter(range(10))
+        compute = lambda: next(values)
+        self.assertEqual(self.cache.get_or_compute((self.user_id, 5), compute), 0)
+        self.assertEqual(self.cache.get_or_compute((self.user_id, 5), compute), 0)
+
+        interaction_versions.bump(self.user_id)
+        self.assertEqual(self.cache.get_or_compute((self.user_id, 5), compute), 1)
+
+        self.now += 10
+        self.assertEqual(self.cache.get_or_compute((self.user_id, 5), compute), 2)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for key in (1, 2, 1, 3):
+            self.cache.get_or_compute((self.user_id, key), lambda: key)
+        self.assertEqual(self.cache.get_or_compute((self.user_id, 1), lambda: 0), 1)
+        self.assertEqual(
+            self.cache.get_or_compute((self.user_id, 2), lambda: 'recomputed'),
+            'recomputed',
+        )
+
+    def test_concurrent_misses_compute_once(self):
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(None)
+            release.wait(5)
+            return 'value'
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    self.cache.get_or_compute((self.user_id, 5), compute)
+                )
+            )
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        while self.cache.stats()['misses'] < len(threads):
+            release.wait(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['value'] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_failures_are_not_cached(self):
+        def fail():
+            raise RuntimeError
+
+        with self.assertRaises(RuntimeError):
+            self.cache.get_or_compute((self.user_id, 5), fail)
+        self.assertEqual(self.cache.get_or_compute((self.user_id, 5), lambda: 1), 1)
+
+
+class RealEstateRecommenderTests(ServingMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        create_catalog(random.Random(0))
+        self.preferences = {
+            'budget': 20000000,
+            'min_bedrooms': 0,
+            'min_bathrooms': 0,
+            'preferred_sqft': 2000,
+            'min_year_built': 2000,
+            'parking_spaces': 1,
+        }
+
+    def create_property(self, price):
+        return RealState.objects.create(
+            price=Decimal(price),
+            bedrooms=3,
+            bathrooms=2,
+            sqft=Decimal(2000),
+            year_built=2000,
+            location=Location.objects.get(),
+            parking_spaces=1,
+        )
+
+    def recommended_ids(self, recommender, preferences, n=100):
+        records = recommender.get_recommendations(preferences, n)
+        ids = records['id'].tolist() if len(records) else []
+        self.assertEqual(recommender.get_batch_recommended_ids([preferences], n), [ids])
+        return ids
+
+    def scanned_ids(self, recommender, preferences, n):
+        """
+        Top-n ids of a scan scoring every property, then applying the hard
+        constraints to the database rows.
+        """
+        properties = recommender.store.snapshot()
+        query = recommender._preference_vectors([preferences])[0]
+        scores = properties.features @ query
+        eligible = set(
+            RealState.objects.filter(
+                price__lte=preferences['budget'],
+                bedrooms__gte=preferences['min_bedrooms'],
+                bathrooms__gte=preferences['min_bathrooms'],
+            ).values_list('id', flat=True)
+        )
+        rows = [
+            row
+            for row, property_id in enumerate(properties.ids)
+            if property_id in eligible
+        ]
+        rows.sort(key=lambda row: -scores[row])
+        return properties.ids[rows[:n]].tolist()
+
+    def test_recommendations_match_a_full_scan(self):
+        recommender = RealEstateRecommender()
+        for budget in (1e5, 3e5, 6e5, 1e6):
+            for min_bedrooms in (1, 3, 5):
+                for min_bathrooms in (1, 2, 3):
+                    preferences = dict(
+                        self.preferences,
+                        budget=budget,
+                        min_bedrooms=min_bedrooms,
+                        min_bathrooms=min_bathrooms,
+                    )
+                    with self.subTest(**preferences):
+                        self.assertEqual(
+                            self.recommended_ids(recommender, preferences, 5),
+                            self.scanned_ids(recommender, preferences, 5),
+                        )
+
+    def test_approximate_search_keeps_constraints_and_falls_back(self):
+        options = {
+            'real_state': {'ENABLED': True, 'MIN_ROWS': 0, 'N_LISTS': 8, 'N_PROBE': 1}
+        }
+        with override_settings(RECOMMENDER_ANN=options):
+            recommender = RealEstateRecommender()
+        preferences = dict(self.preferences, budget=6e5, min_bedrooms=2)
+        eligible = self.scanned_ids(recommender, preferences, 100)
+
+        ids = recommender.get_recommendations(preferences, 5)['id'].tolist()
+        self.assertEqual(len(ids), 5)
+        self.assertTrue(set(ids) <= set(eligible))
+
+        # Too few candidates in the probed lists
+        with mock.patch.object(IVFIndex, 'search', return_value=None) as search:
+            ids = recommender.get_recommendations(preferences, 5)['id'].tolist()
+        search.assert_called_once()
+        self.assertEqual(ids, eligible[:5])
+
+    def test_budgets_are_compared_with_exact_prices(self):
+        # Both round to 20000000 in float32
+        at_budget = self.create_property('20000000')
+        above_budget = self.create_property('20000001')
+        recommender = RealEstateRecommender()
+        ids = self.recommended_ids(recommender, self.preferences)
+        self.assertIn(at_budget.id, ids)
+        self.assertNotIn(above_budget.id, ids)
+
+        added = self.create_property('30000001')
+        recommender.add_property(
+            RealState.objects.filter(id=added.id).values()[0],
+        )
+        preferences = dict(self.preferences, budget=30000000)
+        self.assertNotIn(added.id, self.recommended_ids(recommender, preferences))
+
+
+class ContentFilteringTests(TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        self.user_ids, self.property_ids = create_catalog(rng)
+        # Vary the categorical and M2M blocks
+        other = Location.objects.create(city='Porto', country='Portugal')
+        features = [
+            Feature.objects.create(name=name)
+            for name in ('balcony', 'garden', 'elevator', 'fireplace')
+        ]
+        for prop in RealState.objects.all():
+            if rng.random() < 0.3:
+                prop.location = other
+            if rng.random() < 0.2:
+                prop.property_type = 'commercial'
+            prop.save()
+            prop.features.set(rng.sample(features, rng.randint(0, 3)))
+
+    def test_vectors_hold_every_block(self):
+        # Properties, the Feature vocabulary and the M2M through table
+        with self.assertNumQueries(3):
+            recommender = ContentFiltering()
+        properties = RealState.objects.prefetch_related('features')
+        numerical = np.array(
+            [
+                [prop.price, prop.bedrooms, prop.bathrooms, prop.sqft]
+                for prop in properties
+            ],
+            dtype=np.float64,
+        )
+        low, high = numerical.min(axis=0), numerical.max(axis=0)
+        location_ids = sorted({prop.location_id for prop in properties})
+        feature_ids = list(Feature.objects.values_list('id', flat=True))
+        for prop, scaled in zip(properties, (numerical - low) / (high - low)):
+            expected = np.concatenate(
+                [
+                    scaled,
+                    [prop.has_pool, prop.has_garage],
+                    [prop.property_type == 'commercial'],
+                    [prop.property_type == 'residential'],
+                    [prop.location_id == location_id for location_id in location_ids],
+                    [
+                        any(feature.id == feature_id for feature in prop.features.all())
+                        for feature_id in feature_ids
+                    ],
+                ]
+            )
+            row = recommender.content_matrix[recommender.property_index[prop.id]]
+            np.testing.assert_allclose(row.toarray().ravel(), expected, atol=1e-6)
+
+    def scanned_ids(self, recommender, user_id, top_n):
+        """
+        The user's recommendations from a dense scan of the content matrix.
+        """
+        matrix = recommender.content_matrix.toarray()
+        seen = set(
+            UserInteraction.objects.filter(user_id=user_id).values_list(
+                'property_id', flat=True
+            )
+        )
+        seen_rows = [recommender.property_index[property_id] for property_id in seen]
+        profile = matrix[seen_rows].mean(axis=0)
+        similarities = (matrix @ profile) / (
+            np.linalg.norm(matrix, axis=1) * np.linalg.norm(profile)
+        )
+        rows = [
+            row
+            for row, property_id in enumerate(recommender.property_ids)
+            if property_id not in seen
+            and similarities[row] >= recommender.SIMILARITY_THRESHOLD - 1e-6
+        ]
+        rows.sort(key=lambda row: -similarities[row])
+        return recommender.property_ids[rows[:top_n]].tolist()
+
+    def test_recommendations_match_a_dense_scan(self):
+        recommender = ContentFiltering()
+        for user_id in self.user_ids:
+            with self.subTest(user_id=user_id):
+                # The whole catalog, so only the threshold cuts the list
+                self.assertEqual(
+                    recommender.get_similar_property_ids(user_id, 100),
+                    self.scanned_ids(recommender, user_id, 100),
+                )
+        self.assertEqual(recommender.get_similar_property_ids(0, 10), [])
+
+
+class HybridRecommenderTests(TestCase):
+    def setUp(self):
+        self.user_ids, _ = create_catalog(random.Random(0))
+        self.engines = {
+            'content': ContentFiltering(),
+            'user_cf': UserBasedCF(),
+            'item_cf': ItemBasedCF(),
+        }
+
+    def hybrid(self, weights):
+        return HybridRecommender(
+            self.engines['content'],
+            self.engines['user_cf'],
+            self.engines['item_cf'],
+            weights,
+        )
+
+    def test_a_single_weight_ranks_like_its_engine(self):
+        for name, engine in self.engines.items():
+            hybrid = self.hybrid({name: 1.0})
+            recommend = (
+                engine.get_similar_property_ids
+                if name == 'content'
+                else engine.get_recommended_ids
+            )
+            for user_id in self.user_ids:
+                with self.subTest(engine=name, user_id=user_id):
+                    self.assertEqual(
+                        hybrid.get_recommended_ids(user_id, 8), recommend(user_id, 8)
+                    )
+
+    def test_blend_ranks_the_weighted_sum(self):
+        hybrid = self.hybrid({'user_cf': 0.5, 'item_cf': 0.5})
+        for user_id in self.user_ids:
+            ids = hybrid.get_recommended_ids(user_id, 100)
+            scores = {}
+            for name in ('user_cf', 'item_cf'):
+                engine = self.engines[name]
+                [(ranked, ranked_scores)] = engine.get_batch_recommended_ids(
+                    [user_id], 100, with_scores=True
+                )
+                peak = max(ranked_scores, default=1.0)
+                for property_id, score in zip(ranked, ranked_scores):
+                    scores[property_id] = scores.get(property_id, 0) + score / peak
+            self.assertEqual(set(ids), set(scores))
+            # Each component scaled to a best score of 1
+            blended = np.array([scores[property_id] for property_id in ids])
+            self.assertTrue(np.all(np.diff(blended) <= 1e-9))
+
+
+class SerializerTests(TestCase):
+    def setUp(self):
+        _, self.property_ids = create_catalog(random.Random(0))
+        property_rows.clear()
+        self.addCleanup(property_rows.clear)
+
+    def test_rows_follow_the_ranking_in_one_query(self):
+        ids = self.property_ids[:10][::-1] + [0]
+        with self.assertNumQueries(1):
+            rows = serialize_properties(ids)
+        self.assertEqual([row['id'] for row in rows], ids[:-1])
+        self.assertEqual(list(rows[0]), list(PROPERTY_FIELDS))
+        prop = RealState.objects.select_related('location').get(id=ids[0])
+        self.assertEqual(rows[0]['price'], prop.price)
+        self.assertEqual(rows[0]['city'], prop.location.city)
+        self.assertEqual(async_to_sync(aserialize_properties)(ids), rows)
+
+    def test_hot_rows_are_reused_until_changed(self):
+        ids = self.property_ids[:5]
+        serialize_properties(ids)
+        with self.assertNumQueries(0):
+            serialize_properties(ids)
+
+        RealState.objects.filter(id=ids[0]).first().save()
+        with self.assertNumQueries(1):
+            serialize_properties(ids)
+
+        location = Location.objects.get()
+        location.city = 'Porto'
+        location.save()
+        rows = serialize_properties(ids)
+        self.assertEqual({row['city'] for row in rows}, {'Porto'})
+
+
+def interaction_dicts():
+    """
+    {user id: {property id: weight}} of the interaction table, as the
+    original dict-of-dicts engines held it.
+    """
+    users = {}
+    for user_id, property_id, interaction_type in UserInteraction.objects.values_list(
+        'user_id', 'property_id', 'interaction_type'
+    ):
+        users.setdefault(user_id, {})[property_id] = INTERACTION_WEIGHTS.get(
+            interaction_type, 0
+        )
+    return users
+
+
+class InteractionLoaderTests(TestCase):
+    def setUp(self):
+        create_catalog(random.Random(0))
+
+    def cells(self, interactions):
+        return {
+            (
+                int(interactions.user_ids[row]),
+                int(interactions.property_ids[col]),
+            ): float(weight)
+            for row, col, weight in zip(
+                interactions.user_rows, interactions.property_cols, interactions.weights
+            )
+        }
+
+    def test_chunks_assemble_the_whole_table_in_one_query(self):
+        with self.assertNumQueries(1):
+            interactions = load_interactions(chunk_size=7)
+        self.assertEqual(
+            self.cells(interactions),
+            {
+                (user_id, property_id): weight
+                for user_id, ratings in interaction_dicts().items()
+                for property_id, weight in ratings.items()
+            },
+        )
+        self.assertTrue(np.all(np.diff(interactions.user_ids) > 0))
+        self.assertTrue(np.all(np.diff(interactions.property_ids) > 0))
+        self.assertEqual(interactions.to_csr().nnz, len(interactions))
+
+    def test_interactions_since_a_time(self):
+        old = list(UserInteraction.objects.order_by('id')[:10])
+        UserInteraction.objects.filter(id__in=[row.id for row in old]).update(
+            timestamp=datetime(2020, 1, 1, tzinfo=timezone.utc)
+        )
+        since = datetime(2021, 1, 1, tzinfo=timezone.utc).timestamp()
+        interactions = load_interactions(since=since, with_timestamps=True)
+        self.assertEqual(len(interactions), UserInteraction.objects.count() - 10)
+        self.assertFalse(
+            self.cells(interactions).keys()
+            & {(row.user_id, row.property_id) for row in old}
+        )
+        self.assertTrue(np.all(interactions.timestamps >= since))
+
+
+class CollaborativeFilteringTests(TestCase):
+    def setUp(self):
+        self.user_ids, _ = create_catalog(random.Random(0))
+        self.users = interaction_dicts()
+
+    def predicted(self, engine, predict, user_id):
+        """
+        {property id: score} of an engine's candidates for the user.
+        """
+        interactions = engine.interactions
+        user_row = interactions.user_row(user_id)
+        items, ratings = interactions.row(user_row)
+        seen = np.zeros(interactions.n_properties, dtype=bool)
+        seen[items] = True
+        if predict == 'ratings':
+            cols, scores = engine.predicted_ratings(user_row, items, ratings, seen)
+        else:
+            cols, scores = engine.predicted_scores(items, ratings, seen)
+        return dict(zip(interactions.property_ids[cols].tolist(), scores.tolist()))
+
+    def assert_scores_equal(self, scores, expected, places):
+        self.assertEqual(scores.keys(), expected.keys())
+        for property_id, score in expected.items():
+            self.assertAlmostEqual(scores[property_id], score, places=places)
+
+    def agreement_scores(self, user_id):
+        # Neighbours agree on co-rated properties within 1 point
+        target = self.users[user_id]
+        totals, similarity_sums = {}, {}
+        for other_id, other in self.users.items():
+            common = target.keys() & other.keys()
+            if other_id == user_id or not common:
+                continue
+            agreements = sum(abs(target[item] - other[item]) <= 1 for item in common)
+            similarity = agreements / len(common)
+            if similarity <= 0:
+                continue
+            for property_id, rating in other.items():
+                if property_id not in target:
+                    totals[property_id] = (
+                        totals.get(property_id, 0) + rating * similarity
+                    )
+                    similarity_sums[property_id] = (
+                        similarity_sums.get(property_id, 0) + similarity
+                    )
+        return {
+            property_id: total / similarity_sums[property_id]
+            for property_id, total in totals.items()
+        }
+
+    def item_scores(self, user_id):
+        # Jaccard and rating similarity of every unseen property to each
+        # seen one, boosted by popularity
+        items = {}
+        for other_id, ratings in self.users.items():
+            for property_id, rating in ratings.items():
+                items.setdefault(property_id, {})[other_id] = rating
+        target = self.users[user_id]
+        totals, similarity_sums = {}, {}
+        for seen_id, rating in target.items():
+            for property_id, raters in items.items():
+                if property_id in target:
+                    continue
+                common = items[seen_id].keys() & raters.keys()
+                if not common:
+                    continue
+                jaccard = len(common) / len(items[seen_id].keys() | raters.keys())
+                agreement = sum(
+                    1.0 - abs(items[seen_id][other] - raters[other]) / 3.0
+                    for other in common
+                ) / len(common)
+                similarity = jaccard * 0.4 + agreement * 0.6
+                if similarity > 0.1:
+                    totals[property_id] = (
+                        totals.get(property_id, 0) + similarity * rating
+                    )
+                    similarity_sums[property_id] = (
+                        similarity_sums.get(property_id, 0) + similarity
+                    )
+        return {
+            property_id: total / similarity_sums[property_id] * 0.7
+            + sum(items[property_id].values()) / len(items[property_id]) / 3.0 * 0.3
+            for property_id, total in totals.items()
+        }
+
+    def test_item_based_index_matches_the_pairwise_algorithm(self):
+        # Lists longer than the catalog keep every similar property
+        recommender = ItemBasedCF(neighbours=100, block_size=16)
+        for user_id in self.user_ids:
+            with self.subTest(user_id=user_id):
+                self.assert_scores_equal(
+                    self.predicted(recommender, 'scores', user_id),
+                    self.item_scores(user_id),
+                    places=5,
+                )
+
+    def test_short_lists_keep_the_most_similar_properties(self):
+        full = neighbour_lists(ItemBasedCF(neighbours=100))
+        short = neighbour_lists(ItemBasedCF(neighbours=5))
+        for property_id, neighbours in full.items():
+            with self.subTest(property_id=property_id):
+                kept = short[property_id]
+                self.assertEqual(len(kept), min(5, len(neighbours)))
+                for neighbour, score in kept.items():
+                    self.assertAlmostEqual(neighbours[neighbour], score, places=6)
+                dropped = [
+                    score
+                    for neighbour, score in neighbours.items()
+                    if neighbour not in kept
+                ]
+                if dropped:
+                    self.assertGreaterEqual(min(kept.values()), max(dropped) - 1e-6)
+
+    def test_user_based_scores_match_the_dict_algorithm(self):
+        recommender = UserBasedCF('agreement')
+        for user_id in self.user_ids:
+            with self.subTest(user_id=user_id):
+                expected = self.agreement_scores(user_id)
+                self.assert_scores_equal(
+                    self.predicted(recommender, 'ratings', user_id), expected, places=9
+                )
+                # Ties rank by property id
+                ranking = sorted(
+                    expected,
+                    key=lambda property_id: (
+                        -round(expected[property_id], SCORE_DECIMALS),
+                        property_id,
+                    ),
+                )
+                self.assertEqual(recommender.get_recommended_ids(user_id), ranking[:10])
+
+
+class IncrementalUpdateTests(TestCase):
+    def setUp(self):
+        self.rng = random.Random(0)
+        self.user_ids, self.property_ids = create_catalog(self.rng)
+
+    def apply_changes(self, recommenders, n_changes=150):
+        # Some changes touch properties nobody interacted with at build time
+        for _ in range(n_changes):
+            change = change_interaction(self.rng, self.user_ids, self.property_ids)
+            for recommender in recommenders:
+                recommender.apply_interaction(*change)
+
+    def test_item_based_index_matches_rebuild(self):
+        # A short list makes full lists, and so evictions, common
+        recommender = ItemBasedCF(neighbours=5)
+        self.apply_changes([recommender])
+        rebuilt = ItemBasedCF(neighbours=5)
+
+        updated, expected = neighbour_lists(recommender), neighbour_lists(rebuilt)
+        for property_id, neighbours in expected.items():
+            with self.subTest(property_id=property_id):
+                self.assertEqual(updated[property_id].keys(), neighbours.keys())
+                for neighbour, score in neighbours.items():
+                    self.assertAlmostEqual(
+                        updated[property_id][neighbour], score, places=5
+                    )
+
+    def assert_recommendations_match(self, recommender, rebuilt):
+        for user_id in self.user_ids:
+            with self.subTest(user_id=user_id):
+                self.assertEqual(
+                    recommender.get_recommended_ids(user_id),
+                    rebuilt.get_recommended_ids(user_id),
+                )
+                self.assertEqual(
+                    recommender.get_batch_recommended_ids([user_id]),
+                    rebuilt.get_batch_recommended_ids([user_id]),
+                )
+
+    def test_item_based_recommendations_match_rebuild(self):
+        recommender = ItemBasedCF(neighbours=5)
+        self.apply_changes([recommender])
+        self.assert_recommendations_match(recommender, ItemBasedCF(neighbours=5))
+
+    def test_user_based_recommendations_match_rebuild(self):
+        recommenders = [UserBasedCF('agreement'), UserBasedCF('cosine')]
+        self.apply_changes(recommenders)
+        for recommender in recommenders:
+            self.assert_recommendations_match(
+                recommender, UserBasedCF(recommender.similarity)
+            )
+
+    def test_fold_in_does_not_write_into_read_factors(self):
+        recommender = MatrixFactorization(factors=8, iterations=3)
+        user_row = recommender.interactions.user_row(self.user_ids[0])
+        vector = recommender._user_vector(user_row)
+        before = vector.copy()
+        recommender.apply_interaction(self.user_ids[0], self.property_ids[-1], 3)
+
+        np.testing.assert_array_equal(vector, before)
+        self.assertFalse(np.array_equal(recommender._user_vector(user_row), before))
+        self.assertNotIn(
+            self.property_ids[-1], recommender.get_recommended_ids(self.user_ids[0])
+        )
+
+
+class InteractionWindowTests(SimpleTestCase):
+    def setUp(self):
+        # Cells (1, 10) and (1, 11) created 50 and 20 days before `now`
+        self.now = 1000 * DAY_SECONDS
+        self.window = InteractionWindow(
+            30,
+            None,
+            self.now,
+            [1, 1],
+            [10, 11],
+            [self.now - 50 * DAY_SECONDS, self.now - 20 * DAY_SECONDS],
+        )
+
+    def test_cells_expire_as_time_advances(self):
+        self.window.record(2, 10, 1, self.now - 5 * DAY_SECONDS)
+        self.assertEqual(self.window.expired(self.now), [(1, 10)])
+        self.assertEqual(self.window.expired(self.now), [])
+        self.assertEqual(self.window.expired(self.now + 15 * DAY_SECONDS), [(1, 11)])
+        self.assertEqual(self.window.expired(self.now + 40 * DAY_SECONDS), [(2, 10)])
+
+    def test_recreated_cells_expire_from_their_new_time(self):
+        self.window.record(1, 10, 2, self.now)
+        self.assertEqual(self.window.expired(self.now), [])
+        arrays = self.window.snapshot_arrays()
+        self.assertEqual(arrays['window_property_ids'].tolist(), [11, 10])
+        self.assertEqual(
+            self.window.expired(self.now + 31 * DAY_SECONDS), [(1, 11), (1, 10)]
+        )
+
+    def test_decay_halves_weights_every_half_life(self):
+        window = InteractionWindow(None, 10, self.now)
+        ages = np.array([0, 10, 20]) * DAY_SECONDS
+        np.testing.assert_allclose(
+            window.decayed(np.array([3.0, 3.0, 3.0]), self.now - ages),
+            [3.0, 1.5, 0.75],
+        )
+        self.assertEqual(window.expired(self.now), [])
+
+
+@override_settings(RECOMMENDER_INTERACTION_WINDOW={'WINDOW_DAYS': 30})
+class WindowedEngineTests(TestCase):
+    def setUp(self):
+        self.user_ids, _ = create_catalog(random.Random(0))
+        self.now = time.time()
+        # Spread the interactions over the last 60 days
+        for interaction in UserInteraction.objects.all():
+            interaction.timestamp = datetime.fromtimestamp(
+                self.now - random.Random(interaction.id).uniform(0, 60) * DAY_SECONDS,
+                tz=timezone.utc,
+            )
+            interaction.save(update_fields=['timestamp'])
+
+    def build_at(self, engine_class, now):
+        with mock.patch('recommender.interaction_window.time.time', return_value=now):
+            return engine_class()
+
+    def test_expired_cells_match_a_later_build(self):
+        later = self.now + 10 * DAY_SECONDS
+        for engine_class in (UserBasedCF, ItemBasedCF, MatrixFactorization):
+            with self.subTest(engine=engine_class.__name__):
+                engine = self.build_at(engine_class, self.now)
+                cells = matrix_cells(engine.interactions)
+                self.assertLess(len(cells), UserInteraction.objects.count())
+                engine.expire_interactions(now=later)
+                rebuilt = matrix_cells(self.build_at(engine_class, later).interactions)
+                self.assertLess(len(rebuilt), len(cells))
+                self.assertEqual(matrix_cells(engine.interactions), rebuilt)
+
+
+class MatrixFactorizationTests(TestCase):
+    def setUp(self):
+        self.user_ids, self.property_ids = create_catalog(random.Random(0))
+
+    def loss(self, recommender):
+        """
+        The implicit ALS objective of the trained factors.
+        """
+        weights = recommender.interactions.to_csr().toarray()
+        confidence = 1 + recommender.alpha * weights
+        predictions = recommender.user_factors @ recommender.item_factors.T
+        return float(
+            (confidence * ((weights > 0) - predictions) ** 2).sum()
+            + recommender.regularization
+            * (
+                np.square(recommender.user_factors).sum()
+                + np.square(recommender.item_factors).sum()
+            )
+        )
+
+    def test_sweeps_lower_the_objective(self):
+        losses = [
+            self.loss(MatrixFactorization(factors=8, iterations=iterations))
+            for iterations in (1, 3, 10)
+        ]
+        self.assertGreater(losses[0], losses[1])
+        self.assertGreater(losses[1], losses[2])
+
+    def test_fold_in_is_the_exact_user_step(self):
+        recommender = MatrixFactorization(factors=8, iterations=5)
+        user = User.objects.create(username='new')
+        for property_id, weight in zip(self.property_ids[:3], (1, 2, 3)):
+            recommender.apply_interaction(user.id, property_id, weight)
+
+        user_row = recommender.interactions.user_row(user.id)
+        cols, weights = recommender.interactions.row(user_row)
+        items = recommender.item_factors.astype(np.float64)
+        confidence = np.ones(items.shape[0])
+        confidence[cols] += recommender.alpha * weights
+        preference = np.zeros(items.shape[0])
+        preference[cols] = 1
+        expected = np.linalg.solve(
+            items.T @ (confidence[:, None] * items)
+            + recommender.regularization * np.eye(recommender.factors),
+            items.T @ (confidence * preference),
+        )
+        np.testing.assert_allclose(
+            recommender._user_vector(user_row), expected, rtol=1e-4, atol=1e-6
+        )
+
+        ids = recommender.get_recommended_ids(user.id, 5)
+        self.assertEqual(len(ids), 5)
+        self.assertFalse(set(ids) & set(self.property_ids[:3]))
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.rng = random.Random(0)
+        self.user_ids, self.property_ids = create_catalog(self.rng)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def change_database(self):
+        # Deletes and type changes leave no newer timestamp behind
+        interactions = list(UserInteraction.objects.order_by('id')[:30])
+        for interaction in interactions[:10]:
+            interaction.delete()
+        for interaction in interactions[10:20]:
+            interaction.interaction_type = {'view': 'save', 'like': 'view'}.get(
+                interaction.interaction_type, 'like'
+            )
+            interaction.save()
+        for _ in range(10):
+            change_interaction(self.rng, self.user_ids, self.property_ids)
+
+    def test_loaded_engines_match_rebuild(self):
+        engine_classes = (UserBasedCF, ItemBasedCF, MatrixFactorization)
+        for engine_class in engine_classes:
+            engine_class().save(self.directory / engine_class.__name__)
+        self.change_database()
+
+        for engine_class in engine_classes:
+            with self.subTest(engine=engine_class.__name__):
+                loaded = engine_class.load(self.directory / engine_class.__name__)
+                rebuilt = engine_class()
+                self.assertEqual(
+                    matrix_cells(loaded.interactions),
+                    matrix_cells(rebuilt.interactions),
+                )
+                if engine_class is not MatrixFactorization:
+                    for user_id in self.user_ids:
+                        self.assertEqual(
+                            loaded.get_recommended_ids(user_id),
+                            rebuilt.get_recommended_ids(user_id),
+                        )
+
+    def test_loading_reads_only_the_logged_changes(self):
+        UserBasedCF().save(self.directory / 'user_cf')
+        # The change log, and nothing else, when nothing changed
+        with self.assertNumQueries(1):
+            UserBasedCF.load(self.directory / 'user_cf')
+
+        self.change_database()
+        changes = InteractionChange.objects.values_list('user_id', flat=True)
+        # The log, then the interactions of the changed users
+        with self.assertNumQueries(2):
+            loaded = UserBasedCF.load(self.directory / 'user_cf')
+        self.assertEqual(loaded.changes_mark, change_mark())
+        self.assertLess(len(set(changes)), len(self.user_ids))
+
+    def test_oldest_changes_mark_is_that_of_the_oldest_snapshot(self):
+        with override_settings(RECOMMENDER_MODEL_DIR=str(self.directory)):
+            self.assertIsNone(oldest_changes_mark())
+            old = UserBasedCF()
+            old.save(self.directory / 'v1' / 'user_cf')
+            self.change_database()
+            new = UserBasedCF()
+            new.save(self.directory / 'v2' / 'user_cf')
+            self.assertLess(old.changes_mark, new.changes_mark)
+            self.assertEqual(oldest_changes_mark(), old.changes_mark)
+
+
+class BuildCommandTests(ServingMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.rng = random.Random(0)
+        self.user_ids, self.property_ids = create_catalog(self.rng)
+
+    def build(self, *engines, keep=3):
+        options = {'engines': list(engines)} if engines else {}
+        call_command(
+            'build_recommender_models',
+            workers=1,
+            keep=keep,
+            stdout=StringIO(),
+            **options,
+        )
+        return current_version()
+
+    def test_partial_builds_carry_the_other_engines(self):
+        first = self.build()
+        second = self.build('item_based_cf')
+        self.assertNotEqual(first, second)
+        for name in ENGINE_SLOTS:
+            with self.subTest(engine=name):
+                meta = load_meta(engine_path(name, second))
+                if name == 'item_based_cf':
+                    self.assertNotEqual(meta, load_meta(engine_path(name, first)))
+                else:
+                    self.assertEqual(meta, load_meta(engine_path(name, first)))
+
+    @override_settings(RECOMMENDER_RELOAD_INTERVAL=0)
+    def test_running_workers_swap_to_the_published_version(self):
+        patcher = mock.patch('recommender.snapshots.background_builds')
+        builds = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        first = self.build('user_based_cf')
+        slot = ENGINE_SLOTS['user_based_cf']
+        old = slot.get()
+        self.assertEqual(slot.version, first)
+
+        second = self.build('user_based_cf')
+        self.assertIs(slot.get(), old)
+        # Run the queued reload here: the test database is not shared with
+        # other threads
+        builds.add.assert_called_once_with('user_based_cf', slot.reload)
+        slot.reload()
+        self.assertIsNot(slot.get(), old)
+        self.assertEqual(slot.version, second)
+
+    def test_old_versions_and_replayed_changes_are_pruned(self):
+        versions = []
+        for _ in range(3):
+            change_interaction(self.rng, self.user_ids, self.property_ids)
+            versions.append(self.build('user_based_cf', keep=2))
+        self.assertEqual(
+            sorted(path.name for path in model_dir().iterdir() if path.is_dir()),
+            versions[1:],
+        )
+        # Only the changes made after the oldest kept build remain
+        mark = load_meta(engine_path('user_based_cf', versions[1]))['changes_mark']
+        self.assertEqual(oldest_changes_mark(), mark)
+        self.assertFalse(InteractionChange.objects.filter(id__lte=mark).exists())
+        self.assertTrue(InteractionChange.objects.filter(id__gt=mark).exists())
+
+
+class PrecomputedTests(ServingMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.rng = random.Random(0)
+        self.user_ids, self.property_ids = create_catalog(self.rng)
+        self.user_id = self.user_ids[0]
+        self.ranking = self.property_ids[-3:]
+
+    def precompute(self, version):
+        replace_recommendations(
+            'item_cf',
+            [self.user_id],
+            [(self.ranking, [0.9, 0.8, 0.7])],
+            version,
+            stored_interaction_versions([self.user_id]),
+        )
+
+    def test_current_rows_are_served(self):
+        self.precompute(model_version('item_cf'))
+        self.assertEqual(precomputed_ids(self.user_id, 'item_cf', 5), self.ranking)
+        self.assertEqual(precomputed_ids(self.user_id, 'item_cf', 2), self.ranking[:2])
+
+    def test_rows_of_another_model_are_not_served(self):
+        self.precompute('20000101-000000')
+        self.assertIsNone(precomputed_ids(self.user_id, 'item_cf', 5))
+
+    def test_rows_are_not_served_after_an_interaction_change(self):
+        self.precompute(model_version('item_cf'))
+        with self.captureOnCommitCallbacks(execute=True):
+            change_interaction(self.rng, [self.user_id], self.property_ids)
+        self.assertIsNone(precomputed_ids(self.user_id, 'item_cf', 5))
+
+    def test_changes_made_by_other_workers_are_seen(self):
+        self.precompute(model_version('item_cf'))
+        cached = interaction_versions.get(self.user_id)
+        # Another worker with its own per-process cache handles the change
+        with mock.patch('recommender.signals.interaction_versions') as versions:
+            with self.captureOnCommitCallbacks(execute=True):
+                change_interaction(self.rng, [self.user_id], self.property_ids)
+        versions.bump.assert_called_once_with(self.user_id)
+        self.assertEqual(interaction_versions.get(self.user_id), cached)
+        self.assertIsNone(precomputed_ids(self.user_id, 'item_cf', 5))
+
+    def test_versions_count_the_changes_of_each_user(self):
+        other_user_id = self.user_ids[1]
+        for _ in range(3):
+            change_interaction(self.rng, [self.user_id], self.property_ids)
+        self.assertEqual(
+            stored_interaction_versions([self.user_id, other_user_id, 0]),
+            [3, 0, 0],
+        )
+        self.precompute(model_version('item_cf'))
+        self.assertEqual(precomputed_ids(self.user_id, 'item_cf', 5), self.ranking)
+
+    def test_command_stores_the_online_rankings(self):
+        call_command(
+            'precompute_recommendations',
+            '--engines',
+            'user_cf',
+            'item_cf',
+            '--top-n',
+            '4',
+            '--chunk-size',
+            '7',
+            '--workers',
+            '1',
+            stdout=StringIO(),
+        )
+        self.assertTrue(PrecomputedRecommendation.objects.exists())
+        online = {
+            'user_cf': ENGINE_SLOTS['user_based_cf'].engine.get_recommended_ids,
+            'item_cf': ENGINE_SLOTS['item_based_cf'].engine.get_recommended_ids,
+        }
+        for engine, recommend in online.items():
+            for user_id in self.user_ids:
+                with self.subTest(engine=engine, user_id=user_id):
+                    self.assertEqual(
+                        precomputed_ids(user_id, engine, 4) or [],
+                        recommend(user_id, 4),
+                    )
+
+
+class PermissionTests(TestCase):
+    def assert_rejects_anonymous(self, *url_names):
+        for url_name in url_names:
+            with self.subTest(url_name=url_name):
+                response = self.client.get(reverse(url_name))
+                self.assertIn(
+                    response.status_code,
+                    (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN),
+                )
+
+    def test_matrix_factorization_requires_authentication(self):
+        self.assert_rejects_anonymous(
+            'matrix-factorization-recommendations',
+            'async-matrix-factorization-recommendations',
+        )
+
+    def test_hybrid_requires_authentication(self):
+        self.assert_rejects_anonymous(
+            'hybrid-recommendations',
+            'async-hybrid-recommendations',
+        )
+
+
+class BatchRecommendationTests(ServingMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user_ids, self.property_ids = create_catalog(random.Random(0))
+        admin = User.objects.create_superuser('admin', password='admin')
+        authenticate(self.client, admin)
+
+    def post(self, body):
+        return self.client.post(
+            reverse('batch-recommendations'), body, content_type='application/json'
+        )
+
+    def test_malformed_input_is_rejected(self):
+        for body in (
+            {'engine': 'item_cf', 'users': ['first']},
+            {'engine': 'item_cf', 'users': [[1]]},
+            {'engine': 'item_cf', 'users': self.user_ids, 'top_n': 'five'},
+            {'engine': 'cosine', 'preferences': [{'budget': 1}]},
+            {'engine': 'cosine', 'preferences': ['cheap']},
+            {'engine': 'item_cf', 'users': 'all'},
+            {'engine': 'svd', 'users': self.user_ids},
+        ):
+            with self.subTest(body=body):
+                self.assertEqual(
+                    self.post(body).status_code, status.HTTP_400_BAD_REQUEST
+                )
+
+    def test_results_follow_request_order(self):
+        users = self.user_ids[::-1][:5]
+        response = self.post({'engine': 'item_cf', 'users': users, 'top_n': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+        self.assertEqual([result['user'] for result in results], users)
+        recommender = ENGINE_SLOTS['item_based_cf'].engine
+        for user_id, result in zip(users, results):
+            self.assertEqual(
+                [row['id'] for row in result['recommendations']],
+                recommender.get_recommended_ids(user_id, 3),
+            )
+
+    def test_batches_match_single_requests(self):
+        self.build_engines('content_filtering', 'user_based_cf', 'item_based_cf')
+        single = {
+            'content': ENGINE_SLOTS[
+                'content_filtering'
+            ].engine.get_similar_property_ids,
+            'user_cf': ENGINE_SLOTS['user_based_cf'].engine.get_recommended_ids,
+            'item_cf': ENGINE_SLOTS['item_based_cf'].engine.get_recommended_ids,
+        }
+        for engine, recommend in single.items():
+            with self.subTest(engine=engine):
+                response = self.post(
+                    {'engine': engine, 'users': self.user_ids, 'top_n': 4}
+                )
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                for user_id, result in zip(self.user_ids, response.json()['results']):
+                    self.assertEqual(
+                        [row['id'] for row in result['recommendations']],
+                        recommend(user_id, 4),
+                    )
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        self.build_engines('content_filtering', 'real_state')
+        preferences = {
+            'budget': 600000,
+            'bedrooms': 1,
+            'bathrooms': 1,
+            'sqft': 2000,
+            'year_built': 1990,
+            'parking_spaces': 1,
+        }
+        for body in (
+            {'engine': 'content', 'users': self.user_ids},
+            {'engine': 'cosine', 'preferences': [preferences] * 20},
+        ):
+            key = 'preferences' if body['engine'] == 'cosine' else 'users'
+            counts = []
+            for size in (2, 20):
+                property_rows.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.post(dict(body, **{key: body[key][:size]}))
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                counts.append(len(queries))
+            self.assertEqual(counts[0], counts[1], body['engine'])
+
+
+class MetricsTests(ServingMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user_ids, self.property_ids = create_catalog(random.Random(0))
+        authenticate(self.client, User.objects.get(id=self.user_ids[0]))
+        self.build_engines('matrix_factorization')
+
+    def errors(self, url_name):
+        return request_errors._values.get((url_name,), 0)
+
+    def test_server_timing_reports_stages_and_queries(self):
+        response = self.client.get(reverse('matrix-factorization-recommendations'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        entries = [
+            entry.split(';')[0] for entry in response['Server-Timing'].split(', ')
+        ]
+        self.assertEqual(entries[0], 'total')
+        self.assertIn('similarity', entries)
+        self.assertIn('rank', entries)
+        self.assertRegex(response['Server-Timing'], r'db;desc="\d+ queries"$')
+
+        metrics = self.client.get(reverse('recommender-metrics')).content.decode()
+        self.assertIn(
+            'recommender_request_seconds_count'
+            '{endpoint="matrix-factorization-recommendations"}',
+            metrics,
+        )
+        self.assertIn(
+            'recommender_engine_ready{engine="matrix_factorization"} 1', metrics
+        )
+
+    def test_incremental_updates_are_timed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            UserInteraction.objects.create(
+                user_id=self.user_ids[0],
+                property_id=self.property_ids[-1],
+                interaction_type='save',
+            )
+        metrics = self.client.get(reverse('recommender-metrics')).content.decode()
+        self.assertRegex(
+            metrics,
+            r'recommender_update_seconds_count\{engine="matrix_factorization"\} [1-9]',
+        )
+
+    def test_metrics_are_limited_to_configured_clients(self):
+        response = self.client.get(
+            reverse('recommender-metrics'), REMOTE_ADDR='10.0.0.1'
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_failures_are_logged_and_counted(self):
+        failing = mock.Mock(side_effect=RuntimeError('engine failed'))
+        for url_name, patch in (
+            (
+                'matrix-factorization-recommendations',
+                mock.patch(
+                    'recommender.views.matrix_factorization_recommendation_ids', failing
+                ),
+            ),
+            (
+                'async-matrix-factorization-recommendations',
+                mock.patch.dict(
+                    'recommender.views.RANKINGS',
+                    {'mf': (('matrix_factorization',), failing)},
+                ),
+            ),
+        ):
+            with self.subTest(url_name=url_name), patch:
+                errors = self.errors(url_name)
+                with self.assertLogs('recommender', 'ERROR') as logs:
+                    response = self.client.get(reverse(url_name))
+                self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+                self.assertIn('engine failed', logs.output[0])
+                self.assertEqual(self.errors(url_name), errors + 1)
+
+
+class AuthenticationTests(ServingMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user_ids, _ = create_catalog(random.Random(0))
+        self.user = User.objects.get(id=self.user_ids[0])
+        self.key = Token.objects.create(user=self.user).key
+        self.build_engines('matrix_factorization')
+
+    def statuses(self, authorization):
+        return [
+            self.client.get(
+                reverse(url_name), HTTP_AUTHORIZATION=authorization
+            ).status_code
+            for url_name in (
+                'matrix-factorization-recommendations',
+                'async-matrix-factorization-recommendations',
+            )
+        ]
+
+    def test_sync_and_async_endpoints_authenticate_alike(self):
+        for authorization, expected in (
+            (f'Token {self.key}', status.HTTP_200_OK),
+            (f'token {self.key}', status.HTTP_200_OK),
+            ('Token', status.HTTP_401_UNAUTHORIZED),
+            (f'Token {self.key} extra', status.HTTP_401_UNAUTHORIZED),
+            ('Token unknown', status.HTTP_401_UNAUTHORIZED),
+            ('', status.HTTP_401_UNAUTHORIZED),
+        ):
+            with self.subTest(authorization=authorization):
+                self.assertEqual(self.statuses(authorization), [expected] * 2)
+
+    def test_inactive_users_are_rejected(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(
+            self.statuses(f'Token {self.key}'), [status.HTTP_401_UNAUTHORIZED] * 2
+        )
+
+    def test_async_challenge_matches_sync(self):
+        responses = [
+            self.client.get(reverse(url_name), HTTP_AUTHORIZATION='Token unknown')
+            for url_name in (
+                'matrix-factorization-recommendations',
+                'async-matrix-factorization-recommendations',
+            )
+        ]
+        self.assertEqual(
+            [response.json() for response in responses],
+            [{'detail': 'Invalid token.'}] * 2,
+        )
+        self.assertEqual(
+            [response['WWW-Authenticate'] for response in responses], ['Token'] * 2
+        )
+
+
+class AsyncViewTests(ServingMixin, TestCase):
+    ENDPOINTS = {
+        'cosine-similarity-recommendations/': 'async-cosine-similarity-recommendations',
+        'content-based-recommendations': 'async-content-based-recommendations',
+        'user-based-cf-recommendations': 'async-user-based-cf-recommendations',
+        'item-based-cf-recommendations': 'async-item-based-cf-recommendations',
+        'matrix-factorization-recommendations': (
+            'async-matrix-factorization-recommendations'
+        ),
+        'hybrid-recommendations': 'async-hybrid-recommendations',
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.user_ids, _ = create_catalog(random.Random(0))
+        authenticate(self.client, User.objects.get(id=self.user_ids[0]))
+        self.build_engines(*ENGINE_SLOTS)
+
+    def test_async_endpoints_answer_like_sync_ones(self):
+        preferences = {
+            'budget': 600000,
+            'bedrooms': 1,
+            'bathrooms': 1,
+            'sqft': 2000,
+            'year_built': 1990,
+            'parking_spaces': 1,
+        }
+        for sync_name, async_name in self.ENDPOINTS.items():
+            base = preferences if sync_name.startswith('cosine') else {}
+            for params in ({}, {'page_size': 3}, {'page_size': 'three'}):
+                with self.subTest(endpoint=sync_name, params=params):
+                    sync, async_ = (
+                        self.client.get(reverse(name), {**base, **params})
+                        for name in (sync_name, async_name)
+                    )
+                    self.assertEqual(async_.status_code, sync.status_code)
+                    self.assertEqual(async_.json(), sync.json())
+
+    def test_scoring_runs_in_the_executor(self):
+        thread = async_to_sync(run_scoring)(threading.current_thread)
+        self.assertTrue(thread.name.startswith('recommender-scoring'))
+
+
+class PopularityTests(TestCase):
+    def setUp(self):
+        self.user_ids, self.property_ids = create_catalog(random.Random(0))
+        self.now = 0.0
+        ranking = PopularityRanking(ttl=60, clock=lambda: self.now)
+        patcher = mock.patch('recommender.popularity.popularity_ranking', ranking)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.expected = list(
+            RealState.objects.annotate(interactions=Count('userinteraction'))
+            .order_by('-interactions', 'id')
+            .values_list('id', flat=True)
+        )
+
+    def test_ranking_is_computed_once(self):
+        self.assertEqual(popular_property_ids(10), self.expected[:10])
+        with self.assertNumQueries(0):
+            popular_property_ids(10)
+        self.now += 60
+        with self.assertNumQueries(1):
+            popular_property_ids(10)
+
+    def test_user_interactions_are_left_out(self):
+        user_id = self.user_ids[0]
+        seen = set(
+            UserInteraction.objects.filter(user_id=user_id).values_list(
+                'property_id', flat=True
+            )
+        )
+        popular_property_ids(1)
+        with self.assertNumQueries(1):
+            ids = popular_property_ids(10, user_id)
+        self.assertEqual(ids, [id for id in self.expected if id not in seen][:10])
+
+    def test_properties_meet_the_hard_constraints(self):
+        preferences = {'budget': 400_000, 'min_bedrooms': 3, 'min_bathrooms': 2}
+        expected = [
+            property.id
+            for property in sorted(
+                RealState.objects.filter(id__in=self.expected),
+                key=lambda property: self.expected.index(property.id),
+            )
+            if property.price <= 400_000
+            and property.bedrooms >= 3
+            and property.bathrooms >= 2
+        ]
+        popular_property_ids(1)
+        with self.assertNumQueries(1):
+            records = popular_properties(preferences, 5)
+        self.assertEqual([record['id'] for record in records], expected[:5])
+
+
+class BackgroundBuildTests(SimpleTestCase):
+    def setUp(self):
+        self.builds = BackgroundBuilds('test-builds')
+        patcher = mock.patch('recommender.snapshots.background_builds', self.builds)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(RECOMMENDER_MODEL_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.lock = threading.Lock()
+        self.running = 0
+        self.overlaps = 0
+        self.built = []
+
+    def build(self, name):
+        with self.lock:
+            self.running += 1
+            self.overlaps += self.running > 1
+        threading.Event().wait(0.01)
+        with self.lock:
+            self.running -= 1
+            self.built.append(name)
+
+    def test_jobs_run_one_after_another_once(self):
+        for key in ('a', 'b', 'a', 'c'):
+            self.builds.add(key, lambda key=key: self.build(key))
+        self.builds.join(5)
+        self.assertEqual(self.built, ['a', 'b', 'c'])
+        self.assertEqual(self.overlaps, 0)
+
+    def test_requests_queue_slots_onto_the_build_thread(self):
+        test = self
+
+        def engine_class(name):
+            return type(name, (), {'__init__': lambda self: test.build(name)})
+
+        slots = [EngineSlot(name, engine_class(name)) for name in ('a', 'b', 'c')]
+        requests = [
+            threading.Thread(target=lambda: [slot.get(wait=False) for slot in slots])
+            for _ in range(8)
+        ]
+        for request in requests:
+            request.start()
+        for request in requests:
+            request.join()
+        self.builds.join(5)
+        self.assertEqual(sorted(self.built), ['a', 'b', 'c'])
+        self.assertEqual(self.overlaps, 0)
+        self.assertTrue(all(slot.ready for slot in slots))
+
+    @override_settings(RECOMMENDER_RELOAD_INTERVAL=0)
+    def test_new_versions_are_loaded_off_the_request_thread(self):
+        loading = threading.Event()
+        loaded = threading.Event()
+
+        class Engine:
+            @classmethod
+            def load(cls, path):
+                loading.set()
+                loaded.wait(5)
+                return cls()
+
+        slot = EngineSlot('a', Engine)
+        old = slot.get()
+        version = new_version()
+        save_arrays(staging_path(version) / 'a', {})
+        publish_version(version)
+
+        # Requests keep getting the old engine while the new one loads
+        self.assertIs(slot.get(), old)
+        self.assertTrue(loading.wait(5))
+        self.assertIs(slot.get(), old)
+        loaded.set()
+        self.builds.join(5)
+        self.assertIsNot(slot.get(), old)
+        self.assertEqual(slot.version, version)
+
+
+class FallbackTests(ServingMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user_ids, _ = create_catalog(random.Random(0))
+        authenticate(self.client, User.objects.get(id=self.user_ids[0]))
+        patcher = mock.patch('recommender.snapshots.background_builds')
+        self.builds = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_popular_properties_are_served_until_ready(self):
+        response = self.client.get(reverse('matrix-factorization-recommendations'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [row['id'] for row in response.json()['recommendations']],
+            popular_property_ids(5, self.user_ids[0]),
+        )
+        self.builds.add.assert_called_once_with(
+            'matrix_factorization', ENGINE_SLOTS['matrix_factorization'].warm_up
+        )
+
+        response = self.client.get(reverse('recommender-ready'))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(response.json()['engines']['matrix_factorization']['ready'])
+
+        self.build_engines(*ENGINE_SLOTS)
+        response = self.client.get(reverse('recommender-ready'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -1,5 +1,7 @@
 from django.urls import path
 
+from . import async_views
+from .metrics import metrics_view
 from .views import *
 
 urlpatterns = [
@@ -23,4 +25,56 @@ urlpatterns = [
         item_based_recommend_properties_cf,
         name='item-based-cf-recommendations',
     ),
+    path(
+        'matrix-factorization-recommendations/',
+        matrix_factorization_recommendations,
+        name='matrix-factorization-recommendations',
+    ),
+    path(
+        'hybrid-recommendations/',
+        hybrid_recommendations,
+        name='hybrid-recommendations',
+    ),
+    path(
+        'batch-recommendations/',
+        batch_recommendations,
+        name='batch-recommendations',
+    ),
+    path(
+        'recommender-ready/',
+        recommender_readiness,
+        name='recommender-ready',
+    ),
+    path('metrics/', metrics_view, name='recommender-metrics'),
+    # Async variants for the ASGI entry point
+    path(
+        'async/cosine-similarity-recommendations/',
+        async_views.cosine_similarity_recommendations,
+        name='async-cosine-similarity-recommendations',
+    ),
+    path(
+        'async/content-based-recommendations/',
+        async_views.content_based_recommendations,
+        name='async-content-based-recommendations',
+    ),
+    path(
+        'async/user-based-cf-recommendations/',
+        async_views.user_based_recommend_properties_cf,
+        name='async-user-based-cf-recommendations',
+    ),
+    path(
+        'async/item-based-cf-recommendations/',
+        async_views.item_based_recommend_properties_cf,
+        name='async-item-based-cf-recommendations',
+    ),
+    path(
+        'async/matrix-factorization-recommendations/',
+        async_views.matrix_factorization_recommendations,
+        name='async-matrix-factorization-recommendations',
+    ),
+    path(
+        'async/hybrid-recommendations/',
+        async_views.hybrid_recommendations,
+        name='async-hybrid-recommendations',
+    ),
 ]
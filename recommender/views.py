@@ -1,39 +1,195 @@
+import logging
+
 from rest_framework import status, permissions
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
 
-from .cosine_similarity_recommender import get_real_state_recommender
+from .cosine_similarity_recommender import (
+    PREFERENCE_KEYS,
+    get_real_state_recommender,
+    property_records,
+)
 from .content_based_filtering import get_content_filtering_recommender
 from .collaborative_filtering import (
     get_item_based_recommender,
     get_user_based_recommender,
 )
+from .hybrid import HYBRID_ENGINES, get_hybrid_recommender
+from .matrix_factorization import get_matrix_factorization_recommender
+from .metrics import record_error
+from .pagination import (
+    InvalidPage,
+    encode_cursor,
+    page_params,
+    paginated,
+    ranked_page,
+)
+from .popularity import popular_properties, popular_property_ids
+from .precomputed import precomputed_ids
+from .registry import readiness
+from .serializers import serialize_properties, serialize_property_map
 
 from django.contrib.auth.models import User
 
 import traceback
 
+logger = logging.getLogger(__name__)
+
+# Most users or preference dicts accepted by one batch request
+MAX_BATCH_SIZE = 1000
+
+
+def parse_preferences(params):
+    """
+    Preference dict for RealEstateRecommender from request parameters.
+    """
+    return {
+        "budget": float(params.get("budget")),
+        "min_bedrooms": int(params.get("bedrooms")),
+        "min_bathrooms": int(params.get("bathrooms")),
+        "preferred_sqft": float(params.get("sqft")),
+        "min_year_built": int(params.get("year_built")),
+        "parking_spaces": int(params.get("parking_spaces")),
+    }
+
+
+def cosine_recommendations(user_preferences, num_recommendations):
+    """
+    Records recommended by RealEstateRecommender, or popular properties
+    meeting the hard constraints while it is still being built.
+    """
+    real_state_recommender = get_real_state_recommender(wait=False)
+    if real_state_recommender is None:
+        return popular_properties(user_preferences, num_recommendations)
+
+    recommendations_df = real_state_recommender.get_recommendations(
+        user_preferences, num_recommendations
+    )
+
+    # Convert DataFrame to a JSON-serializable format
+    return recommendations_df.to_dict(orient="records")
+
+
+def content_recommendation_ids(user_id, top_n=5):
+    recommender = get_content_filtering_recommender(wait=False)
+    if recommender is None:
+        # Still being built; popular properties meanwhile
+        return popular_property_ids(top_n, user_id)
+    return recommender.get_similar_property_ids(user_id, top_n=top_n)
+
+
+def user_cf_recommendation_ids(user_id, top_n=5):
+    recommender = get_user_based_recommender(wait=False)
+    if recommender is None:
+        return popular_property_ids(top_n, user_id)
+    return recommender.get_recommended_ids(user_id, top_n=top_n)
+
+
+def item_cf_recommendation_ids(user_id, top_n=5):
+    recommender = get_item_based_recommender(wait=False)
+    if recommender is None:
+        return popular_property_ids(top_n, user_id)
+    return recommender.get_recommended_ids(user_id, top_n=top_n)
+
+
+def matrix_factorization_recommendation_ids(user_id, top_n=5):
+    recommender = get_matrix_factorization_recommender(wait=False)
+    if recommender is None:
+        return popular_property_ids(top_n, user_id)
+    return recommender.get_recommended_ids(user_id, top_n=top_n)
+
+
+def hybrid_recommendation_ids(user_id, top_n=5):
+    recommender = get_hybrid_recommender(wait=False)
+    if recommender is None:
+        return popular_property_ids(top_n, user_id)
+    return recommender.get_recommended_ids(user_id, top_n=top_n)
+
+
+# Per-user rankings: the engines they depend on and their ranking function
+RANKINGS = {
+    'content': (('content_filtering',), content_recommendation_ids),
+    'user_cf': (('user_based_cf',), user_cf_recommendation_ids),
+    'item_cf': (('item_based_cf',), item_cf_recommendation_ids),
+    'mf': (('matrix_factorization',), matrix_factorization_recommendation_ids),
+    'hybrid': (HYBRID_ENGINES, hybrid_recommendation_ids),
+}
+
+
+def user_page(user_id, ranking, params):
+    """
+    (ids of the requested page, next cursor) of one of the RANKINGS.
+    """
+    engine_names, recommend = RANKINGS[ranking]
+    return ranked_page(
+        params,
+        (user_id, ranking),
+        engine_names,
+        lambda top_n: recommend(user_id, top_n),
+    )
+
+
+def cosine_page(user_preferences, params):
+    """
+    (records of the requested page, next cursor) of the preference ranking.
+    """
+    real_state_recommender = get_real_state_recommender(wait=False)
+    if real_state_recommender is None:
+        # Still being built: page through popular properties, uncached
+        offset, page_size = page_params(params)
+        rows = popular_properties(user_preferences, offset + page_size + 1)
+        more = len(rows) > offset + page_size
+        return (
+            rows[offset : offset + page_size],
+            encode_cursor(offset + page_size) if more else None,
+        )
+
+    property_ids, next_cursor = ranked_page(
+        params,
+        (None, 'cosine', tuple(user_preferences[key] for key in PREFERENCE_KEYS)),
+        ('real_state',),
+        lambda top_n: real_state_recommender.get_batch_recommended_ids(
+            [user_preferences], top_n
+        )[0],
+    )
+    records = property_records(property_ids)
+    return records.to_dict(orient="records"), next_cursor
+
+
+def page_response(recommendations, next_cursor):
+    return Response(
+        {'recommendations': recommendations, 'next_cursor': next_cursor},
+        status=status.HTTP_200_OK,
+    )
+
+
+def invalid_page_response(error):
+    return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def user_page_response(user_id, ranking, params):
+    try:
+        property_ids, next_cursor = user_page(user_id, ranking, params)
+    except InvalidPage as error:
+        return invalid_page_response(error)
+    # Only the rows of this page are hydrated
+    return page_response(serialize_properties(property_ids), next_cursor)
+
 
 @api_view(["GET"])
 def cosine_similarity_recommendations(request):
     try:
-        real_state_recommender = get_real_state_recommender()
-        user_preferences = {
-            "budget": float(request.query_params.get("budget")),
-            "min_bedrooms": int(request.query_params.get("bedrooms")),
-            "min_bathrooms": int(request.query_params.get("bathrooms")),
-            "preferred_sqft": float(request.query_params.get("sqft")),
-            "min_year_built": int(request.query_params.get("year_built")),
-            "parking_spaces": int(request.query_params.get("parking_spaces")),
-        }
+        user_preferences = parse_preferences(request.query_params)
+        if paginated(request.query_params):
+            try:
+                return page_response(
+                    *cosine_page(user_preferences, request.query_params)
+                )
+            except InvalidPage as error:
+                return invalid_page_response(error)
         num_recommendations = int(request.query_params.get("num_recommendations", 5))
 
-        recommendations_df = real_state_recommender.get_recommendations(
-            user_preferences, num_recommendations
-        )
-
-        # Convert DataFrame to a JSON-serializable format
-        recommendations = recommendations_df.to_dict(orient="records")
+        recommendations = cosine_recommendations(user_preferences, num_recommendations)
 
         return Response(recommendations, status=status.HTTP_200_OK)
     except:
@@ -45,29 +201,15 @@ def cosine_similarity_recommendations(request):
 @api_view(["GET"])
 def content_based_recommendations(request):
     try:
-        recommender = get_content_filtering_recommender()
         user = request.user
-        similar_properties = recommender.get_similar_properties(user, top_n=5)
-
-        # Serialize the recommended properties
-        recommendations = [
-            {
-                'id': prop.id,
-                'price': prop.price,
-                'bedrooms': prop.bedrooms,
-                'bathrooms': prop.bathrooms,
-                'sqft': prop.sqft,
-                'year_built': prop.year_built,
-                'property_type': prop.property_type,
-                'city': prop.location.city,
-                'country': prop.location.country,
-                'parking_spaces': prop.parking_spaces,
-                'has_garage': prop.has_garage,
-                'has_pool': prop.has_pool,
-                'description': prop.description,
-            }
-            for prop in similar_properties
-        ]
+        if paginated(request.query_params):
+            return user_page_response(user.id, 'content', request.query_params)
+        similar_property_ids = precomputed_ids(user.id, 'content', 5)
+        if similar_property_ids is None:
+            similar_property_ids = content_recommendation_ids(user.id)
+
+        # Serialize the recommended properties in rank order
+        recommendations = serialize_properties(similar_property_ids)
 
         return Response({'recommendations': recommendations}, status=status.HTTP_200_OK)
     except:
@@ -80,28 +222,14 @@ def content_based_recommendations(request):
 def user_based_recommend_properties_cf(request):
     try:
         user = request.user
-        recommender = get_user_based_recommender()
-        similar_properties = recommender.get_recommendations(user, top_n=5)
-
-        # Serialize the recommended properties
-        recommendations = [
-            {
-                'id': prop.id,
-                'price': prop.price,
-                'bedrooms': prop.bedrooms,
-                'bathrooms': prop.bathrooms,
-                'sqft': prop.sqft,
-                'year_built': prop.year_built,
-                'property_type': prop.property_type,
-                'city': prop.location.city,
-                'country': prop.location.country,
-                'parking_spaces': prop.parking_spaces,
-                'has_garage': prop.has_garage,
-                'has_pool': prop.has_pool,
-                'description': prop.description,
-            }
-            for prop in similar_properties
-        ]
+        if paginated(request.query_params):
+            return user_page_response(user.id, 'user_cf', request.query_params)
+        similar_property_ids = precomputed_ids(user.id, 'user_cf', 5)
+        if similar_property_ids is None:
+            similar_property_ids = user_cf_recommendation_ids(user.id)
+
+        # Serialize the recommended properties in rank order
+        recommendations = serialize_properties(similar_property_ids)
 
         return Response({'recommendations': recommendations}, status=status.HTTP_200_OK)
     except Exception as e:
@@ -114,28 +242,140 @@ def user_based_recommend_properties_cf(request):
 def item_based_recommend_properties_cf(request):
     try:
         user = request.user
-        recommender = get_item_based_recommender()
-        similar_properties = recommender.get_recommendations(user, top_n=5)
-        # Serialize the recommended properties
-        recommendations = [
-            {
-                'id': prop.id,
-                'price': prop.price,
-                'bedrooms': prop.bedrooms,
-                'bathrooms': prop.bathrooms,
-                'sqft': prop.sqft,
-                'year_built': prop.year_built,
-                'property_type': prop.property_type,
-                'city': prop.location.city,
-                'country': prop.location.country,
-                'parking_spaces': prop.parking_spaces,
-                'has_garage': prop.has_garage,
-                'has_pool': prop.has_pool,
-                'description': prop.description,
-            }
-            for prop in similar_properties
-        ]
+        if paginated(request.query_params):
+            return user_page_response(user.id, 'item_cf', request.query_params)
+        similar_property_ids = precomputed_ids(user.id, 'item_cf', 5)
+        if similar_property_ids is None:
+            similar_property_ids = item_cf_recommendation_ids(user.id)
+        # Serialize the recommended properties in rank order
+        recommendations = serialize_properties(similar_property_ids)
         return Response({'recommendations': recommendations}, status=status.HTTP_200_OK)
     except Exception as e:
         print(f"Error: {e}")
         return Response(status=status.HTTP_409_CONFLICT)
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAuthenticated])
+def matrix_factorization_recommendations(request):
+    """
+    Recommendations from the latent factors of MatrixFactorization.
+    """
+    try:
+        user = request.user
+        if paginated(request.query_params):
+            return user_page_response(user.id, 'mf', request.query_params)
+        property_ids = matrix_factorization_recommendation_ids(user.id)
+        # Serialize the recommended properties in rank order
+        recommendations = serialize_properties(property_ids)
+        return Response({'recommendations': recommendations}, status=status.HTTP_200_OK)
+    except Exception:
+        logger.exception("Computing matrix factorization recommendations failed")
+        record_error(request)
+        return Response(status=status.HTTP_409_CONFLICT)
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAuthenticated])
+def hybrid_recommendations(request):
+    """
+    Content, user-based and item-based recommendations blended into one
+    ranking; see HybridRecommender.
+    """
+    try:
+        user = request.user
+        if paginated(request.query_params):
+            return user_page_response(user.id, 'hybrid', request.query_params)
+        property_ids = hybrid_recommendation_ids(user.id)
+        # Serialize the recommended properties in rank order
+        recommendations = serialize_properties(property_ids)
+        return Response({'recommendations': recommendations}, status=status.HTTP_200_OK)
+    except Exception:
+        logger.exception("Computing hybrid recommendations failed")
+        record_error(request)
+        return Response(status=status.HTTP_409_CONFLICT)
+
+
+BATCH_ENGINES = ('cosine', 'content', 'user_cf', 'item_cf')
+
+
+@api_view(["POST"])
+@permission_classes([permissions.IsAdminUser])
+def batch_recommendations(request):
+    """
+    Recommendations for many users or preference dicts in one call.
+
+    Body: {"engine": "cosine", "preferences": [{...}, ...]} with the query
+    parameters of cosine_similarity_recommendations, or {"engine":
+    "content" | "user_cf" | "item_cf", "users": [id, ...]}; optional
+    "top_n" (default 5). Results come back in request order and all
+    recommended properties are hydrated together.
+    """
+    engine = request.data.get("engine")
+    key = "preferences" if engine == "cosine" else "users"
+    items = request.data.get(key)
+    if engine not in BATCH_ENGINES:
+        return Response(
+            {"error": f"Unknown engine: {engine}"}, status=status.HTTP_400_BAD_REQUEST
+        )
+    if not isinstance(items, list) or len(items) > MAX_BATCH_SIZE:
+        return Response(
+            {"error": f"'{key}' must be a list of at most {MAX_BATCH_SIZE} items"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    try:
+        top_n = int(request.data.get("top_n", 5))
+        if engine == "cosine":
+            preferences = [parse_preferences(item) for item in items]
+        else:
+            users = [int(item) for item in items]
+    except (AttributeError, TypeError, ValueError):
+        return Response(
+            {"error": f"Invalid 'top_n' or '{key}'"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    try:
+        if engine == "cosine":
+            ranked_ids = get_real_state_recommender().get_batch_recommended_ids(
+                preferences, top_n
+            )
+        elif engine == "content":
+            recommender = get_content_filtering_recommender()
+            ranked_ids = recommender.get_batch_similar_property_ids(users, top_n)
+        elif engine == "user_cf":
+            recommender = get_user_based_recommender()
+            ranked_ids = recommender.get_batch_recommended_ids(users, top_n)
+        else:
+            recommender = get_item_based_recommender()
+            ranked_ids = recommender.get_batch_recommended_ids(users, top_n)
+
+        # One hydration for the whole batch
+        rows = serialize_property_map({id for ids in ranked_ids for id in ids})
+        results = []
+        for index, ids in enumerate(ranked_ids):
+            result = {"recommendations": [rows[id] for id in ids if id in rows]}
+            if engine != "cosine":
+                result["user"] = users[index]
+            results.append(result)
+
+        return Response({"results": results}, status=status.HTTP_200_OK)
+    except Exception:
+        logger.exception("Computing batch recommendations failed")
+        record_error(request)
+        return Response(status=status.HTTP_409_CONFLICT)
+
+
+@api_view(["GET"])
+def recommender_readiness(request):
+    """
+    Whether every engine of this worker has been built; 503 until then,
+    while the endpoints serve popularity fallbacks.
+    """
+    engines = readiness()
+    ready = all(engine['ready'] for engine in engines.values())
+    return Response(
+        {'ready': ready, 'engines': engines},
+        status=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+    )